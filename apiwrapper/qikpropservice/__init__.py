@@ -14,7 +14,10 @@ from . import _version
 __version__ = _version.get_versions()['version']
 
 from .data_models import QikPropOptions, StatusCodes
-from .qplib import qikprop_as_a_service, QikpropAsAService
+from .qplib import qikprop_as_a_service, resume_qikprop_as_a_service, QikpropAsAService
+from .journal import JobJournal
+from .async_qplib import async_qikprop_as_a_service, AsyncQikpropAsAService
+from .compression import extract_result
 from .qpcli import qpcli
 
 
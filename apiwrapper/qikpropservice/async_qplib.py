@@ -0,0 +1,304 @@
+"""
+QikProp API Wrapper Library, asyncio version
+
+Same calls as qplib as coroutines for asyncio applications. Needs the optional httpx package
+(pip install qikpropservice[async])
+"""
+
+__all__ = ["AsyncQikpropAsAService", "async_qikprop_as_a_service"]
+
+import asyncio
+from pathlib import Path
+import time
+from typing import List, Optional, Union
+
+from tqdm import tqdm
+
+from .data_models import StatusCodes, QikPropOptions, SeverHelloGETResponse
+from .hashing import generate_checksum_file, DEFAULT_HASH_FUNCTION, DigestCache, DEFAULT_DIGEST_CACHE
+from .compression import COMPRESSION_SUFFIXES
+from .qplib import QikpropAsAService, _prepare_files, DEFAULT_MAX_WAIT
+
+
+def _httpx():
+    try:
+        import httpx
+    except ImportError:
+        raise ImportError("The asyncio client needs the httpx package, install it with "
+                          "pip install qikpropservice[async]")
+    return httpx
+
+
+def _unexpected_error(code: int, data: dict):
+    return ValueError(f"Something went wrong on the request, but the server detected something unexpected "
+                      f"happened in a way it can provide feedback that can be given to the developers. "
+                      f"See below for details.\n\n"
+                      f"Code {code}: {data['message']}")
+
+
+class AsyncQikpropAsAService:
+    """
+    QikProp As A Service API Endpoint wrapper for asyncio, see QikpropAsAService for what each call does.
+
+    Uploads and downloads are streamed, files are read and hashed in the default executor so the event loop is never
+    blocked on disk. All calls share one httpx.AsyncClient with up to max_connections kept-alive connections, use it
+    as an async context manager (or call aclose) to close them.
+    """
+
+    def __init__(self,
+                 server="http://qikprop.molssi.org/api/v1",
+                 status_endpoint="/status",
+                 task_endpoint="/tasks",
+                 hash_function=DEFAULT_HASH_FUNCTION,
+                 blocksize=1024 * 64,
+                 wait_endpoint="/status/wait",
+                 client=None,
+                 max_connections: int = 10,
+                 digest_cache: Optional[DigestCache] = None
+                 ):
+        self.server = server
+        self.status_endpoint = status_endpoint
+        self.task_endpoint = task_endpoint
+        self.wait_endpoint = wait_endpoint
+        self.hash_function = hash_function
+        self.blocksize = blocksize
+        self.digest_cache = digest_cache
+        if client is None:
+            httpx = _httpx()
+            client = httpx.AsyncClient(limits=httpx.Limits(max_connections=max_connections,
+                                                           max_keepalive_connections=max_connections),
+                                       timeout=httpx.Timeout(60))
+        self.client = client
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def _check_class_id(self, task_id: str = None, filepath: Union[Path, str] = None):
+        if not (task_id or filepath):
+            raise ValueError("Need either task_id or filepath")
+        if filepath:
+            loop = asyncio.get_running_loop()
+            if self.digest_cache is not None:
+                checksum = await loop.run_in_executor(None, lambda: self.digest_cache.checksum(
+                    filepath, hash_function=self.hash_function))
+            else:
+                checksum = await loop.run_in_executor(None, lambda: generate_checksum_file(
+                    filepath, hash_function=self.hash_function))
+            if task_id and checksum != task_id:
+                raise ValueError(f"Provided Task ID was {task_id}, but provided filepath of {filepath} generated a "
+                                 f"task ID of {checksum}. These should be the same if both are provided")
+            task_id = checksum
+        return task_id
+
+    async def _read_chunks(self, filepath: Path):
+        """Stream a file for upload, reads happen in the executor"""
+        loop = asyncio.get_running_loop()
+        with filepath.open("rb") as upload_file:
+            while True:
+                chunk = await loop.run_in_executor(None, upload_file.read, self.blocksize)
+                if not chunk:
+                    break
+                yield chunk
+
+    async def server_status(self):
+        """Check if the server responds, raises httpx.HTTPStatusError if it does not"""
+        r = await self.client.get(self.server)
+        r.raise_for_status()
+        response = SeverHelloGETResponse(**r.json())
+        return True, response.dict()
+
+    async def get_status(self,
+                         *,
+                         task_id: str = None,
+                         filepath: Union[Path, str] = None,
+                         options: Union[dict, QikPropOptions, None] = None
+                         ):
+        """Check the status of a task on the server, see QikpropAsAService.get_status"""
+        task_id = await self._check_class_id(task_id=task_id, filepath=filepath)
+        uri = self.server + self.status_endpoint
+        r = await self.client.get(uri, params={"id": task_id, **QikpropAsAService._options_params(options)})
+        if r.status_code in StatusCodes.values:
+            return True, r.status_code, r.json()
+        raise ValueError(f"Unexpected return code of {r.status_code} and message\n\n{r.text}")
+
+    async def wait_status(self,
+                          task_ids: List[str],
+                          *,
+                          options: Union[dict, QikPropOptions, None] = None,
+                          timeout: float = 30
+                          ):
+        """Wait for any of many tasks to complete, see QikpropAsAService.wait_status"""
+        uri = self.server + self.wait_endpoint
+        params = QikpropAsAService._options_params(options)
+        body = {"tasks": [{"id": task_id, **params} for task_id in task_ids], "timeout": timeout}
+        # Leave the server time to answer before giving up on the connection
+        r = await self.client.post(uri, json=body, timeout=timeout + 30)
+        code = r.status_code
+        if code >= 500:
+            raise _unexpected_error(code, r.json())
+        return code == StatusCodes.ready, code, r.json()
+
+    async def get_result(self,
+                         *,
+                         task_id: str = None,
+                         filepath: Union[Path, str] = None,
+                         options: Union[dict, QikPropOptions, None] = None,
+                         output_file: Union[Path, str] = Path("result.tar.gz"),
+                         compression: Optional[str] = None
+                         ):
+        """Get a processed file (if ready) from the server, streamed to output_file. See QikpropAsAService.get_result"""
+        task_id = await self._check_class_id(task_id=task_id, filepath=filepath)
+        output_file = Path(output_file)  # Ensure Path object
+        uri = self.server + self.task_endpoint
+        params = {"id": task_id, **QikpropAsAService._options_params(options)}
+        if compression is not None:
+            if compression not in COMPRESSION_SUFFIXES:
+                raise ValueError(f"Unknown compression {compression}, known compressions are "
+                                 f"{list(COMPRESSION_SUFFIXES)}")
+            params["compression"] = compression
+        async with self.client.stream("GET", uri, params=params) as r:
+            code = r.status_code
+            if code == StatusCodes.ready:
+                with output_file.open(mode="wb") as output:
+                    async for data in r.aiter_bytes(self.blocksize):
+                        output.write(data)
+                return True, code, {}
+            await r.aread()
+        if code >= 500:
+            raise _unexpected_error(code, r.json())
+        return False, code, r.json()
+
+    async def post_task(self,
+                        filepath: Union[Path, str],
+                        *,
+                        options: Union[dict, QikPropOptions] = QikPropOptions(),
+                        callback_url: Optional[str] = None
+                        ):
+        """Post a file to the server for processing, streamed from disk. See QikpropAsAService.post_task"""
+        filepath = Path(filepath)  # Ensure Path object
+        checksum = await self._check_class_id(filepath=filepath)
+        uri = self.server + self.task_endpoint
+        params = {"id": checksum, "filename": filepath.name, **QikpropAsAService._options_params(options)}
+        if callback_url is not None:
+            params["callback_url"] = callback_url
+        r = await self.client.post(uri, content=self._read_chunks(filepath), params=params)
+        code = r.status_code
+        data = r.json()
+        if code <= 300:
+            return True, code, data
+        elif code >= 500:
+            raise _unexpected_error(code, data)
+        return False, code, data
+
+
+async def async_qikprop_as_a_service(filepaths: Union[str, Path, List[Union[str, Path]]],
+                                     *,  # kwonly args here
+                                     output_tar_names=None,
+                                     fast: bool = False,
+                                     similar: int = 20,
+                                     server_uri: str = "https://qikprop.molssi.org/api/v1",
+                                     non_exist_ok: bool = False,
+                                     compression: str = "gzip",
+                                     max_concurrency: int = 8,
+                                     digest_cache: Union[str, Path, None] = DEFAULT_DIGEST_CACHE,
+                                     max_wait: Optional[float] = DEFAULT_MAX_WAIT
+                                     ):
+    """
+    Run QikProp as a Service over a series of files and generate their results, as qikprop_as_a_service does.
+
+    Hashing, uploads, waiting and downloads are pipelined: each file is waited on as soon as it is uploaded and
+    downloaded as soon as it is complete, while the rest of the files are still going up. At most max_concurrency
+    uploads and downloads run at once. Takes the same parameters as qikprop_as_a_service, except there is no
+    journal, so tasks given up on after max_wait seconds get an .err file.
+    """
+    input_files, output_files = _prepare_files(filepaths, output_tar_names, non_exist_ok, compression)
+    options = QikPropOptions(fast=fast, similar=similar)
+    transfers = asyncio.Semaphore(max_concurrency)
+    pending = {}  # Task ID -> output file, in the order they were posted
+    posted = asyncio.Event()
+    progress = tqdm(total=len(input_files))
+
+    def write_error(output, data):
+        output = Path(output)
+        with open(output.with_suffix(output.suffix + ".err"), "w") as errfile:
+            errfile.write(str(data))
+
+    digests = DigestCache(digest_cache) if digest_cache is not None else None
+    # One more connection than transfers for the long poll on the task statuses
+    async with AsyncQikpropAsAService(server=server_uri, max_connections=max_concurrency + 1,
+                                      digest_cache=digests) as qps:
+
+        async def upload(filepath, output):
+            async with transfers:
+                # Files the server already has a task for are not sent again
+                task_id = await qps._check_class_id(filepath=filepath)
+                success, code, data = await qps.get_status(task_id=task_id, options=options)
+                if code == StatusCodes.null:
+                    success, code, data = await qps.post_task(filepath, options=options)
+            if success:
+                pending.setdefault(data["id"], output)
+                posted.set()
+            else:
+                progress.update(1)
+                write_error(output, data)
+
+        async def download(task_id, output):
+            async with transfers:
+                downloaded, code, data = await qps.get_result(task_id=task_id, options=options, output_file=output,
+                                                              compression=compression)
+            progress.update(1)
+            if not downloaded:
+                write_error(output, data)
+
+        uploads = asyncio.ensure_future(asyncio.gather(*(upload(filepath, output)
+                                                         for filepath, output in zip(input_files, output_files))))
+        downloads = []
+        last_completed = time.monotonic()
+        try:
+            while not uploads.done() or pending:
+                if not uploads.done():
+                    last_completed = time.monotonic()  # Only waiting on the tasks once every file is up
+                elif max_wait is not None and time.monotonic() - last_completed > max_wait:
+                    for task_id, output in pending.items():
+                        progress.update(1)
+                        write_error(output, {"id": task_id, "error": f"Task was still not complete after {max_wait} "
+                                                                     f"seconds with no task completing"})
+                    break
+                if not pending:
+                    # Nothing to wait on until the next upload lands
+                    posted.clear()
+                    waiter = asyncio.ensure_future(posted.wait())
+                    await asyncio.wait([uploads, waiter], return_when=asyncio.FIRST_COMPLETED)
+                    waiter.cancel()
+                    continue
+                # Short polls while uploads are still going so new tasks join the wait soon
+                task_ids = list(pending)[:10000]
+                success, code, statuses = await qps.wait_status(task_ids, options=options,
+                                                                timeout=30 if uploads.done() else 2)
+                if not success:
+                    raise ValueError(f"Could not get the status of the tasks, code {code}: {statuses}")
+                for task_status in statuses["tasks"]:
+                    task_id = task_status["id"]
+                    if task_status["code"] in [StatusCodes.ready, StatusCodes.error, StatusCodes.null]:
+                        last_completed = time.monotonic()
+                    if task_status["code"] in [StatusCodes.ready, StatusCodes.error]:
+                        downloads.append(asyncio.ensure_future(download(task_id, pending.pop(task_id))))
+                    elif task_status["code"] == StatusCodes.null:
+                        # Accepted but no longer on the server, it won't ever finish
+                        progress.update(1)
+                        write_error(pending.pop(task_id), task_status)
+            await uploads  # Raise anything which went wrong
+            if digests is not None:
+                digests.save()
+            await asyncio.gather(*downloads)
+        finally:
+            uploads.cancel()
+            for download_task in downloads:
+                download_task.cancel()
+            progress.close()
@@ -0,0 +1,73 @@
+"""
+Reading the output tarballs of the QikProp service in any of the compressions it can serve them with
+"""
+
+__all__ = ["COMPRESSION_SUFFIXES", "detect_compression", "extract_result"]
+
+import gzip
+from pathlib import Path
+import tarfile
+from typing import List, Union
+
+# Compression name on the server -> suffix of the tarballs it produces
+COMPRESSION_SUFFIXES = {
+    "none": ".tar",
+    "gzip": ".tar.gz",
+    "zstd": ".tar.zst",
+}
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def detect_compression(filepath: Union[Path, str]) -> str:
+    """Compression of a result tarball from its first bytes, one of the COMPRESSION_SUFFIXES keys"""
+    with open(filepath, "rb") as f:
+        magic = f.read(4)
+    if magic.startswith(_GZIP_MAGIC):
+        return "gzip"
+    elif magic == _ZSTD_MAGIC:
+        return "zstd"
+    return "none"
+
+
+def _open_decompressed(filepath: Path, compression: str):
+    if compression == "gzip":
+        return gzip.open(filepath, "rb")
+    elif compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Reading zstd compressed results needs the zstandard package, "
+                              "install it with `pip install zstandard`")
+        return zstandard.ZstdDecompressor().stream_reader(open(filepath, "rb"), closefd=True)
+    return open(filepath, "rb")
+
+
+def extract_result(filepath: Union[Path, str], destination: Union[Path, str] = ".") -> List[str]:
+    """
+    Extract a result tarball from the QikProp service, whichever compression it was downloaded with
+
+    Parameters
+    ----------
+    filepath : Path or str
+        Result tarball as saved by QikpropAsAService.get_result
+    destination : Path or str, Default: "."
+        Directory to extract the QikProp output files to
+
+    Returns
+    -------
+    names : list of str
+        Names of the extracted files
+    """
+    filepath = Path(filepath)
+    with _open_decompressed(filepath, detect_compression(filepath)) as raw:
+        with tarfile.open(fileobj=raw, mode="r|") as tar:
+            names = []
+            for member in tar:
+                # Output tarballs are flat, refuse anything which would land outside of destination
+                if not member.isfile() or Path(member.name).name != member.name:
+                    continue
+                tar.extract(member, path=str(destination))
+                names.append(member.name)
+    return names
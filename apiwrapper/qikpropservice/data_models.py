@@ -22,9 +22,19 @@ class StatusGET(BaseModel):
 
 
 class StatusGETReturn(StatusGET):
+    """
+    Status of a task. Servers which track job states also report the state (queued, running, done or error) and,
+    while running, the molecules done so far. progress is the percent done, when the server could count the molecules.
+    eta is the seconds until a queued or running task is expected to be done
+    """
     code: int
     message: str
     error: Optional[str]
+    state: Optional[str] = None
+    molecules_done: Optional[int] = None
+    molecules_total: Optional[int] = None
+    progress: Optional[float] = None
+    eta: Optional[float] = None
 
 
 class SeverHelloGETResponse(BaseModel):
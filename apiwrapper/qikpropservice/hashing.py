@@ -2,19 +2,75 @@
 Hashing utility for incoming files
 """
 
-__all__ = ["generate_checksum_file", "DEFAULT_HASH_FUNCTION"]
+__all__ = ["generate_checksum_file", "DEFAULT_HASH_FUNCTION", "DigestCache", "DEFAULT_DIGEST_CACHE"]
 
 import hashlib
+import json
+import os
 from pathlib import Path
+import threading
 from typing import Union
+import uuid
 
 DEFAULT_HASH_FUNCTION = "sha1"
+DEFAULT_DIGEST_CACHE = Path.home() / ".cache" / "qikpropservice" / "digests.json"
 
 
-def generate_checksum_file(filepath: Union[Path, str], chunksize=4096, hash_function=DEFAULT_HASH_FUNCTION):
+def generate_checksum_file(filepath: Union[Path, str], chunksize=1024 * 1024, hash_function=DEFAULT_HASH_FUNCTION):
     cummulative_hash = getattr(hashlib, hash_function)()  # Setup up blank checksum
-    with open(filepath, "rb") as file:
-        # Process file in chunks
-        for byte_block in iter(lambda: file.read(chunksize), b""):
-            cummulative_hash.update(byte_block)
+    buffer = bytearray(chunksize)
+    view = memoryview(buffer)
+    with open(filepath, "rb", buffering=0) as file:
+        # Process file in chunks, read into one buffer so large files don't churn through allocations
+        for size in iter(lambda: file.readinto(buffer), 0):
+            cummulative_hash.update(view[:size])
     return cummulative_hash.hexdigest()
+
+
+class DigestCache:
+    """
+    On-disk cache of file checksums keyed on their path, size and modification time, so files which have not changed
+    are not read again to hash them. Safe to share between threads, call save to write it back out.
+
+    Parameters
+    ----------
+    path : str or Path, Default: ~/.cache/qikpropservice/digests.json
+        JSON file the cache is kept in, made on save if it does not exist
+    """
+
+    def __init__(self, path: Union[Path, str] = DEFAULT_DIGEST_CACHE):
+        self.path = Path(path)
+        self._guard = threading.Lock()
+        self._changed = False
+        try:
+            with self.path.open("r") as f:
+                self._digests = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._digests = {}
+
+    def checksum(self, filepath: Union[Path, str], hash_function=DEFAULT_HASH_FUNCTION) -> str:
+        """Checksum of a file from the cache, hashing it only if it is new or has changed since it was cached"""
+        filepath = Path(filepath).resolve()
+        stat = filepath.stat()
+        key = f"{hash_function}:{filepath}"
+        with self._guard:
+            cached = self._digests.get(key)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = generate_checksum_file(filepath, hash_function=hash_function)
+        with self._guard:
+            self._digests[key] = [stat.st_size, stat.st_mtime_ns, digest]
+            self._changed = True
+        return digest
+
+    def save(self):
+        """Write the cache out if anything was added, under a temporary name renamed into place"""
+        with self._guard:
+            if not self._changed:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex}.tmp")
+            with temp_path.open("w") as f:
+                json.dump(self._digests, f)
+            os.replace(temp_path, self.path)
+            self._changed = False
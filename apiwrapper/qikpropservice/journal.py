@@ -0,0 +1,104 @@
+"""
+Journal of the files of a qikprop_as_a_service run, kept in SQLite so an interrupted run can be resumed
+"""
+
+__all__ = ["JobJournal"]
+
+import json
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import List, Tuple, Union
+
+from .data_models import QikPropOptions
+
+
+def _path(path: Union[str, Path]) -> str:
+    # Absolute so a run can be resumed from any directory
+    return str(Path(path).resolve())
+
+
+class JobJournal:
+    """
+    SQLite journal of each input file of a run: its task ID (checksum) once submitted and whether its output was
+    downloaded. Jobs are keyed on their output file. Safe to share between threads.
+
+    States are "pending" (not submitted yet), "submitted", "done" (output downloaded) and "failed".
+
+    Parameters
+    ----------
+    path : str or Path
+        SQLite file of the journal, made if it does not exist
+    """
+
+    PENDING = "pending"
+    SUBMITTED = "submitted"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._guard = threading.Lock()
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                                     "output_path TEXT PRIMARY KEY, "
+                                     "input_path TEXT NOT NULL, "
+                                     "checksum TEXT, "
+                                     "options TEXT NOT NULL, "
+                                     "compression TEXT NOT NULL, "
+                                     "server TEXT NOT NULL, "
+                                     "state TEXT NOT NULL, "
+                                     "error TEXT, "
+                                     "updated REAL NOT NULL)")
+
+    def _execute(self, statement: str, parameters=()):
+        with self._guard, self._connection:
+            return self._connection.execute(statement, parameters).fetchall()
+
+    def add(self,
+            jobs: List[Tuple[Union[str, Path], Union[str, Path]]],
+            options: QikPropOptions,
+            compression: str,
+            server: str):
+        """Record (input file, output file) jobs as pending, replacing any earlier job with the same output file"""
+        now = time.time()
+        rows = [(_path(output_path), _path(input_path), options.json(), compression, server, self.PENDING, now)
+                for input_path, output_path in jobs]
+        with self._guard, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO jobs "
+                                         "(output_path, input_path, options, compression, server, state, updated) "
+                                         "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def mark_submitted(self, output_path: Union[str, Path], checksum: str):
+        self._execute("UPDATE jobs SET state = ?, checksum = ?, updated = ? WHERE output_path = ?",
+                      (self.SUBMITTED, checksum, time.time(), _path(output_path)))
+
+    def mark_done(self, output_path: Union[str, Path]):
+        self._execute("UPDATE jobs SET state = ?, error = NULL, updated = ? WHERE output_path = ?",
+                      (self.DONE, time.time(), _path(output_path)))
+
+    def mark_failed(self, output_path: Union[str, Path], error: str):
+        self._execute("UPDATE jobs SET state = ?, error = ?, updated = ? WHERE output_path = ?",
+                      (self.FAILED, error, time.time(), _path(output_path)))
+
+    def unfinished(self) -> List[dict]:
+        """Jobs which are pending or submitted, in the order they were added"""
+        rows = self._execute("SELECT * FROM jobs WHERE state IN (?, ?) ORDER BY rowid",
+                             (self.PENDING, self.SUBMITTED))
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job["options"] = QikPropOptions(**json.loads(job["options"]))
+            jobs.append(job)
+        return jobs
+
+    def counts(self) -> dict:
+        """Number of jobs in each state"""
+        return {row["state"]: row["total"]
+                for row in self._execute("SELECT state, COUNT(*) AS total FROM jobs GROUP BY state")}
+
+    def close(self):
+        self._connection.close()
@@ -10,7 +10,9 @@ import click
 
 from . import __version__
 from .data_models import SeverHelloGETResponse
-from .qplib import qikprop_as_a_service, QikpropAsAService
+from .qplib import qikprop_as_a_service, resume_qikprop_as_a_service, QikpropAsAService
+from .journal import JobJournal
+from .compression import COMPRESSION_SUFFIXES
 
 
 service_spec = getfullargspec(qikprop_as_a_service)
@@ -42,18 +44,50 @@ def qpcli():
 @click.option("--similar", type=click.IntRange(min=0), default=service_spec.kwonlydefaults["similar"],
               help="Generate this number of most similar molecules relative to last processed")
 @click.option("--uri", type=str, callback=_check_server, default=service_spec.kwonlydefaults["server_uri"])
+@click.option("--compression", type=click.Choice(list(COMPRESSION_SUFFIXES)),
+              default=service_spec.kwonlydefaults["compression"],
+              help="Compression to download the output tarballs with")
+@click.option("--max-concurrency", type=click.IntRange(min=1),
+              default=service_spec.kwonlydefaults["max_concurrency"],
+              help="Most uploads or downloads to run at the same time")
+@click.option("--journal", type=click.Path(dir_okay=False), default=None,
+              help="SQLite file to journal the run in, so it can be picked up again with the resume command")
+@click.option("--max-wait", type=click.FloatRange(min=0), default=service_spec.kwonlydefaults["max_wait"],
+              help="Most seconds to wait on the tasks without any of them completing before giving up on the rest")
 @click.argument("files", nargs=-1, type=click.Path(exists=True))  # No help kwarg
-def run(files, uri, fast_processing, similar):
+def run(files, uri, fast_processing, similar, compression, max_concurrency, journal, max_wait):
     """
     Run the QikProp service
 
-    Processes FILES provided against the server. Will return tarballs in {filename}.tar.gz as per the
-    qikprop_as_a_service function in the qplib module.
+    Processes FILES provided against the server. Will return tarballs in {filename}.qpout.tar.gz (or the suffix of
+    the chosen compression) as per the qikprop_as_a_service function in the qplib module.
     """
     qikprop_as_a_service(files,
                          server_uri=uri,
                          fast=fast_processing,
-                         similar=similar)
+                         similar=similar,
+                         compression=compression,
+                         max_concurrency=max_concurrency,
+                         journal=journal,
+                         max_wait=max_wait)
 
 
+@qpcli.command()
+@click.option("--max-concurrency", type=click.IntRange(min=1),
+              default=service_spec.kwonlydefaults["max_concurrency"],
+              help="Most uploads or downloads to run at the same time")
+@click.option("--max-wait", type=click.FloatRange(min=0), default=service_spec.kwonlydefaults["max_wait"],
+              help="Most seconds to wait on the tasks without any of them completing before giving up on the rest")
+@click.argument("journal", type=click.Path(exists=True, dir_okay=False))
+def resume(journal, max_concurrency, max_wait):
+    """
+    Resume an interrupted run
 
+    Picks up the run journaled in JOURNAL (run --journal) where it stopped. Outputs already downloaded are skipped
+    and files already submitted are not uploaded again.
+    """
+    journaled = JobJournal(journal)
+    counts = journaled.counts()
+    journaled.close()
+    click.echo(f"Journal {journal}: " + ", ".join(f"{total} {state}" for state, total in sorted(counts.items())))
+    resume_qikprop_as_a_service(journal, max_concurrency=max_concurrency, max_wait=max_wait)
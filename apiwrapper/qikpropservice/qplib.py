@@ -4,16 +4,26 @@ QikProp API Wrapper Library
 Provides all the functions which can be called from the CLI or as a library
 """
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+import io
+import json
 from pathlib import Path
-from time import sleep
+import time
 from typing import List, Optional, Union
+import uuid
 
 from tqdm import tqdm
 import requests
+from requests.adapters import HTTPAdapter
 
 from .data_models import StatusCodes, StatusGETReturn, QikPropOptions, SeverHelloGETResponse
-from .hashing import generate_checksum_file, DEFAULT_HASH_FUNCTION
+from .hashing import generate_checksum_file, DEFAULT_HASH_FUNCTION, DigestCache, DEFAULT_DIGEST_CACHE
+from .compression import COMPRESSION_SUFFIXES
+from .journal import JobJournal
+
+DEFAULT_MAX_WAIT = 3600  # Seconds to wait on tasks without any completing before giving up on them
 
 
 class _UpdateProgressBar:
@@ -39,11 +49,83 @@ def _handle_progress_bar(size, enable=False):
     progress_bar.close()
 
 
+def _quote(value: str) -> str:
+    """Value escaped to go in quotes in a multipart header, the way browsers do"""
+    return value.replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+class _MultipartBody:
+    """
+    multipart/form-data body whose files are read off disk as it is sent, so a batch of files is never all in memory.
+    Its length is known up front, so it goes out with a Content-Length like any other form
+    """
+
+    def __init__(self, fields: dict, files: dict, blocksize: int = 1024 * 1024):
+        self.boundary = uuid.uuid4().hex
+        self.blocksize = blocksize
+        self._parts = deque()  # (opener, length) of each piece of the body in order
+        for name, value in fields.items():
+            self._add_bytes(self._header(name) + value.encode() + b"\r\n")
+        for name, (filename, filepath) in files.items():
+            self._add_bytes(self._header(name, filename))
+            self._parts.append((filepath.open, filepath.stat().st_size))
+            self._add_bytes(b"\r\n")
+        self._add_bytes(f"--{self.boundary}--\r\n".encode())
+        self._length = sum(length for _, length in self._parts)
+        self._current = None
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def _header(self, name: str, filename: Optional[str] = None) -> bytes:
+        disposition = f'form-data; name="{_quote(name)}"'
+        if filename is not None:
+            disposition += f'; filename="{_quote(filename)}"'
+        return (f"--{self.boundary}\r\nContent-Disposition: {disposition}\r\n"
+                f"Content-Type: application/octet-stream\r\n\r\n").encode()
+
+    def _add_bytes(self, data: bytes):
+        self._parts.append((lambda mode: io.BytesIO(data), len(data)))
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.blocksize), b"")
+
+    def read(self, size: int = -1) -> bytes:
+        blocks = []
+        while self._parts and size != 0:
+            if self._current is None:
+                self._current = self._parts[0][0]("rb")
+            block = self._current.read(size)
+            if not block:  # Done with this piece, on to the next
+                self.close()
+                self._parts.popleft()
+                continue
+            blocks.append(block)
+            if size > 0:
+                size -= len(block)
+        return b"".join(blocks)
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
+
 class QikpropAsAService:
     """
     QikProp As A Service API Endpoint wrapper.
 
     A class which wraps, calls, and handles the outputs from the
+
+    All calls go through one requests.Session holding a pool of up to pool_size kept-alive connections, so the
+    methods can be called from that many threads at once. Pass session to use one of your own instead.
+
+    Files are hashed to get their task IDs, pass a DigestCache as digest_cache to only hash files which changed since
+    they were last hashed.
     """
 
     def __init__(self,
@@ -51,25 +133,58 @@ class QikpropAsAService:
                  status_endpoint="/status",
                  task_endpoint="/tasks",
                  hash_function=DEFAULT_HASH_FUNCTION,
-                 blocksize=1024
+                 blocksize=1024,
+                 results_endpoint="/results",
+                 batch_endpoint="/tasks/batch",
+                 batch_status_endpoint="/status/batch",
+                 wait_endpoint="/status/wait",
+                 session: Optional[requests.Session] = None,
+                 pool_size: int = 10,
+                 digest_cache: Optional[DigestCache] = None,
+                 uploads_endpoint="/uploads"
                  ):
         self.server = server
         self.status_endpoint = status_endpoint
         self.task_endpoint = task_endpoint
+        self.results_endpoint = results_endpoint
+        self.batch_endpoint = batch_endpoint
+        self.batch_status_endpoint = batch_status_endpoint
+        self.wait_endpoint = wait_endpoint
+        self.uploads_endpoint = uploads_endpoint
         self.hash_function = hash_function
         self.blocksize = blocksize
+        self.digest_cache = digest_cache
+        # One session for every call so connections are kept alive and reused, pool_size of them per host
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
 
     def _check_class_id(self, task_id: str = None, filepath: Union[Path, str] = None):
         if not (task_id or filepath):
             raise ValueError("Need either task_id or filepath")
         if filepath:
-            checksum = generate_checksum_file(filepath, hash_function=self.hash_function)
+            if self.digest_cache is not None:
+                checksum = self.digest_cache.checksum(filepath, hash_function=self.hash_function)
+            else:
+                checksum = generate_checksum_file(filepath, hash_function=self.hash_function)
             if task_id and checksum != task_id:
                 raise ValueError(f"Provided Task ID was {task_id}, but provided filepath of {filepath} generated a "
                                  f"task ID of {checksum}. These should be the same if both are provided")
             task_id = checksum
         return task_id
 
+    @staticmethod
+    def _options_params(options: Union[dict, QikPropOptions, None]) -> dict:
+        """Cast options to the query parameters which select the result set of a task on the server"""
+        if options is None:
+            options = QikPropOptions()
+        elif isinstance(options, dict):
+            options = QikPropOptions(**options)
+        return options.dict()
+
     def server_status(self):
         """
         Check if the server responds
@@ -79,12 +194,17 @@ class QikpropAsAService:
         requests.exceptions.HTTPError
             If the server does not respond, raises the HTTP error.
         """
-        r = requests.get(self.server)
+        r = self.session.get(self.server)
         r.raise_for_status()
         response = SeverHelloGETResponse(**r.json())
         return True, response.dict()
 
-    def get_status(self, *, task_id: str = None, filepath: Union[Path, str] = None):
+    def get_status(self,
+                   *,
+                   task_id: str = None,
+                   filepath: Union[Path, str] = None,
+                   options: Union[dict, QikPropOptions, None] = None
+                   ):
         """
         Check the status of a task on the server
 
@@ -96,6 +216,9 @@ class QikpropAsAService:
         filepath : Path or str
             Path to the file compute a checksum to generate a task_id. Either this or task_id is required
             If checksum/ID computed from the filepath contents does not match a provided task_id, an error is raised
+        options : QikPropOptions or dict matching spec, Optional
+            Options the task was posted with. The same file run with different options are different tasks on the
+            server. If not set, uses the default options.
 
         Returns
         -------
@@ -115,19 +238,124 @@ class QikpropAsAService:
         """
         task_id = self._check_class_id(task_id=task_id, filepath=filepath)
         uri = self.server + self.status_endpoint
-        r = requests.get(uri, params={"id": task_id})
+        r = self.session.get(uri, params={"id": task_id, **self._options_params(options)})
         if r.status_code in StatusCodes.values:
             return True, r.status_code, StatusGETReturn(**r.json())
         # Something has gone wrong if we got here
         raise ValueError(f"Unexpected return code of {r.status_code} and message\n\n{r.text}")
 
+    def get_status_batch(self,
+                         task_ids: List[str],
+                         *,
+                         options: Union[dict, QikPropOptions, None] = None,
+                         batch_size: int = 1000
+                         ):
+        """
+        Check the status of many tasks on the server, batch_size tasks per request
+
+        Parameters
+        ----------
+        task_ids : List of str
+            Task IDs to query against the server
+        options : QikPropOptions or dict matching spec, Optional
+            Options the tasks were posted with. If not set, uses the default options.
+        batch_size : int, Default: 1000
+            Most tasks to check in a single request. The server accepts at most 10000 per request
+
+        Returns
+        -------
+        success : bool
+            If every request was accepted and processed normally
+        code : int
+            HTTP return code of the last request. See the StatusCodes class for expected codes
+        data : dict
+            "tasks" has the status of each task in task_ids order, each as get_status would return its data, with
+            its own "code". If a request fails, the error of that request instead
+
+        Raises
+        ------
+        ValueError
+            When the server responds with a particular code indicating that something unexpected happened on the server,
+            but it was something which can be debugged through a catch all the server is coded to handle. If you get
+            this, you should report it to the developers.
+        """
+        uri = self.server + self.batch_status_endpoint
+        params = self._options_params(options)
+        task_ids = list(task_ids)
+        tasks = []
+        code = StatusCodes.ready
+        for start in range(0, len(task_ids), batch_size):
+            body = {"tasks": [{"id": task_id, **params} for task_id in task_ids[start:start + batch_size]]}
+            r = self.session.post(uri, json=body)
+            code = r.status_code
+            if code >= 500:
+                raise ValueError(f"Something went wrong on the request, but the server detected something unexpected "
+                                 f"happened in a way it can provide feedback that can be given to the developers. "
+                                 f"See below for details.\n\n"
+                                 f"Code {r.status_code}: {r.json()['message']}")
+            elif code != StatusCodes.ready:
+                return False, code, r.json()
+            tasks.extend(r.json()["tasks"])
+        return True, code, {"tasks": tasks}
+
+    def wait_status(self,
+                    task_ids: List[str],
+                    *,
+                    options: Union[dict, QikPropOptions, None] = None,
+                    timeout: float = 30
+                    ):
+        """
+        Wait for any of many tasks to complete. The server answers as soon as one of them is ready or errored, or once
+        timeout runs out, so completed tasks are known right away without polling in a loop
+
+        Parameters
+        ----------
+        task_ids : List of str
+            Task IDs to wait on, at most 10000
+        options : QikPropOptions or dict matching spec, Optional
+            Options the tasks were posted with. If not set, uses the default options.
+        timeout : float, Default: 30
+            Most seconds for the server to wait before answering, at most 30
+
+        Returns
+        -------
+        success : bool
+            If the request was accepted and processed normally
+        code : int
+            HTTP return code. See the StatusCodes class for expected codes
+        data : dict
+            "tasks" has the status of each task in task_ids order, as get_status_batch. If the request fails, the
+            error of that request instead
+
+        Raises
+        ------
+        ValueError
+            When the server responds with a particular code indicating that something unexpected happened on the server,
+            but it was something which can be debugged through a catch all the server is coded to handle. If you get
+            this, you should report it to the developers.
+        """
+        uri = self.server + self.wait_endpoint
+        params = self._options_params(options)
+        body = {"tasks": [{"id": task_id, **params} for task_id in task_ids], "timeout": timeout}
+        # Leave the server time to answer before giving up on the connection
+        r = self.session.post(uri, json=body, timeout=timeout + 30)
+        code = r.status_code
+        if code >= 500:
+            raise ValueError(f"Something went wrong on the request, but the server detected something unexpected "
+                             f"happened in a way it can provide feedback that can be given to the developers. "
+                             f"See below for details.\n\n"
+                             f"Code {r.status_code}: {r.json()['message']}")
+        return code == StatusCodes.ready, code, r.json()
+
     def get_result(self,
                    *,
                    task_id: str = None,
                    filepath: Union[Path, str] = None,
+                   options: Union[dict, QikPropOptions, None] = None,
                    output_file: Union[Path, str] = Path("result.tar.gz"),
                    use_progress_bar: bool = False,
-                   blocksize: Optional[int] = None
+                   blocksize: Optional[int] = None,
+                   compression: Optional[str] = None
                    ):
         """
         Get a processed file (if ready) from the server
@@ -140,6 +368,9 @@ class QikpropAsAService:
         filepath : Path or str
             Path to the file compute a checksum to generate a task_id. Either this or task_id is required
             If checksum/ID computed from the filepath contents does not match a provided task_id, an error is raised
+        options : QikPropOptions or dict matching spec, Optional
+            Options the task was posted with. The same file run with different options are different tasks on the
+            server. If not set, uses the default options.
         output_file : Path or str, Default: "result.tar.gz"
             Name of the tarfile to save when getting data from the server
             If there is a processing error reported by the server, a .err will be added to the suffix
@@ -150,6 +381,10 @@ class QikpropAsAService:
             Size of the download blocks to fetch from the request. Useful for breaking up large expected returns so
             data can be streamed to file rather than held in memory. If not set, uses the value set at class
             instantiation.
+        compression : str, Optional
+            Compression to get the tarball in, one of "gzip", "zstd" or "none" (plain tar). If not set, the tarball
+            comes in whatever compression the server stores it with. The saved file can be read with
+            extract_result regardless.
 
         Returns
         -------
@@ -171,7 +406,13 @@ class QikpropAsAService:
         task_id = self._check_class_id(task_id=task_id, filepath=filepath)
         output_file = Path(output_file)  # Ensure Path object
         uri = self.server + self.task_endpoint
-        r = requests.get(uri, params={"id": task_id}, stream=True)
+        params = {"id": task_id, **self._options_params(options)}
+        if compression is not None:
+            if compression not in COMPRESSION_SUFFIXES:
+                raise ValueError(f"Unknown compression {compression}, known compressions are "
+                                 f"{list(COMPRESSION_SUFFIXES)}")
+            params["compression"] = compression
+        r = self.session.get(uri, params=params, stream=True)
         code = r.status_code
         if code == StatusCodes.ready:
             total_size_in_bytes = int(r.headers.get('content-length', 0))
@@ -188,10 +429,74 @@ class QikpropAsAService:
                              f"Code {r.status_code}: {r.json()['message']}")
         return False, code, r.json()
 
+    def get_results(self,
+                    *,
+                    task_id: str = None,
+                    filepath: Union[Path, str] = None,
+                    options: Union[dict, QikPropOptions, None] = None,
+                    columns: Optional[List[str]] = None,
+                    offset: int = 0,
+                    limit: int = 1000
+                    ):
+        """
+        Get the parsed QP.CSV descriptors of a finished task without downloading the whole tarball
+
+        Parameters
+        ----------
+        task_id : str
+            Task ID to query against the server. Either this or filepath is required
+            If task_id does not match the checksum/ID computed from the filepath contents, an error is raised
+        filepath : Path or str
+            Path to the file compute a checksum to generate a task_id. Either this or task_id is required
+            If checksum/ID computed from the filepath contents does not match a provided task_id, an error is raised
+        options : QikPropOptions or dict matching spec, Optional
+            Options the task was posted with. If not set, uses the default options.
+        columns : list of str, Optional
+            Descriptor columns to get, e.g. ["molecule", "QPlogPo/w"]. All columns if not set
+        offset : int, Default: 0
+            First row (molecule) to get
+        limit : int, Default: 1000
+            Most rows to get in one call, the server caps this at 10000. Page through the rest with the returned
+            "next_offset", which is None once the last row has been returned
+
+        Returns
+        -------
+        success : bool
+            If the results were returned
+        code : int
+            HTTP return code. See the StatusCodes class for expected codes
+        data : dict
+            On success, "columns", "data" (one list of values per column), "total", "offset" and "next_offset".
+            Otherwise the task status or error from the server
+
+        Raises
+        ------
+        ValueError
+            When the server responds with a particular code indicating that something unexpected happened on the server,
+            but it was something which can be debugged through a catch all the server is coded to handle. If you get
+            this, you should report it to the developers.
+        """
+        task_id = self._check_class_id(task_id=task_id, filepath=filepath)
+        uri = self.server + self.results_endpoint
+        params = {"id": task_id, "offset": offset, "limit": limit, **self._options_params(options)}
+        if columns is not None:
+            params["columns"] = ",".join(columns)
+        r = self.session.get(uri, params=params)
+        code = r.status_code
+        if code == StatusCodes.ready:
+            return True, code, r.json()
+        elif code >= 500:
+            raise ValueError(f"Something went wrong on the request, but the server detected something unexpected "
+                             f"happened in a way it can provide feedback that can be given to the developers. "
+                             f"See below for details.\n\n"
+                             f"Code {r.status_code}: {r.json()['message']}")
+        return False, code, r.json()
+
     def post_task(self,
                   filepath: Union[Path, str],
                   *,
-                  options: Union[dict, QikPropOptions] = QikPropOptions()
+                  options: Union[dict, QikPropOptions] = QikPropOptions(),
+                  callback_url: Optional[str] = None
                   ):
         """
         Post a file to the server for processing
@@ -202,6 +507,11 @@ class QikpropAsAService:
             Path to the file to upload to the server
         options : QikPropOptions or dict matching spec
             Additional options to pass to QikProp, matches the QikPropOptions spec
+        callback_url : str, Optional
+            URL the server POSTs the task status to as JSON once the task is complete, instead of having to poll for
+            it. If the server has a callback secret set, the X-QikProp-Signature header is "sha256=" and the
+            HMAC-SHA256 of the raw body with that secret. Deliveries are retried, so the same completion may arrive
+            more than once
 
         Returns
         -------
@@ -224,9 +534,12 @@ class QikpropAsAService:
         if isinstance(options, dict):
             options = QikPropOptions(**options)
         uri = self.server + self.task_endpoint
-        params = {"id": checksum, **options.dict()}
+        # The name tells the server the format of the file, so it can split up large molecule files
+        params = {"id": checksum, "filename": filepath.name, **options.dict()}
+        if callback_url is not None:
+            params["callback_url"] = callback_url
         with filepath.open("rb") as upload_file:
-            r = requests.post(uri, data=upload_file, params=params, stream=True)
+            r = self.session.post(uri, data=upload_file, params=params, stream=True)
         code = r.status_code
         data = r.json()
         if code <= 300:
@@ -238,6 +551,247 @@ class QikpropAsAService:
                              f"Code {r.status_code}: {r.json()['message']}")
         return False, code, data
 
+    def post_task_resumable(self,
+                            filepath: Union[Path, str],
+                            *,
+                            options: Union[dict, QikPropOptions] = QikPropOptions(),
+                            callback_url: Optional[str] = None,
+                            chunk_size: int = 8 * 1024 * 1024,
+                            max_concurrency: int = 4,
+                            retries: int = 5
+                            ):
+        """
+        Post a large file to the server for processing in chunks, for files too big to get through in one request on
+        a flaky connection. Chunks are sent max_concurrency at a time and each one is retried on its own.
+
+        The upload lives on the server until it is finished, so if this is interrupted, calling it again with the same
+        file and options only sends the chunks which never made it.
+
+        Parameters
+        ----------
+        filepath : Path or str
+            Path to the file to upload to the server
+        options : QikPropOptions or dict matching spec
+            Additional options to pass to QikProp, matches the QikPropOptions spec
+        callback_url : str, Optional
+            URL the server POSTs the task status to once the task is complete, see post_task
+        chunk_size : int, Default: 8 MiB
+            Size in bytes of each chunk
+        max_concurrency : int, Default: 4
+            Number of chunks sent at once
+        retries : int, Default: 5
+            Times a chunk is sent again after a connection error or server error, backing off between each
+
+        Returns
+        -------
+        success : bool
+            If the request was accepted and processed normally
+        code : int
+            HTTP return code. See the StatusCodes class for expected codes
+        data : dict
+            Additional data and parameters with the post. "id" key has the task ID
+
+        Raises
+        ------
+        requests.exceptions.HTTPError
+            If a chunk could not be sent after all its retries
+        ValueError
+            When the server responds with a particular code indicating that something unexpected happened on the server,
+            but it was something which can be debugged through a catch all the server is coded to handle. If you get
+            this, you should report it to the developers.
+        """
+        filepath = Path(filepath)  # Ensure Path object
+        checksum = self._check_class_id(filepath=filepath)
+        if isinstance(options, dict):
+            options = QikPropOptions(**options)
+        params = {"id": checksum, "size": filepath.stat().st_size, "filename": filepath.name, **options.dict()}
+        if callback_url is not None:
+            params["callback_url"] = callback_url
+        r = self.session.post(self.server + self.uploads_endpoint, params=params)
+        code = r.status_code
+        data = r.json()
+        if code >= 500:
+            raise ValueError(f"Something went wrong on the request, but the server detected something unexpected "
+                             f"happened in a way it can provide feedback that can be given to the developers. "
+                             f"See below for details.\n\n"
+                             f"Code {r.status_code}: {data['message']}")
+        if "upload_id" not in data:  # Already on the server or not accepted, nothing to upload either way
+            return code <= 300, code, data
+        uri = f"{self.server}{self.uploads_endpoint}/{data['upload_id']}"
+        chunks = [(offset, min(offset + chunk_size, end))
+                  for start, end in data["missing"]
+                  for offset in range(start, end, chunk_size)]
+
+        def send(chunk):
+            start, end = chunk
+            with filepath.open("rb") as upload_file:
+                upload_file.seek(start)
+                body = upload_file.read(end - start)
+            for attempt in range(retries + 1):
+                try:
+                    response = self.session.put(uri, params={"offset": start}, data=body)
+                    if response.status_code < 500:
+                        break
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt == retries:
+                        raise
+                if attempt < retries:
+                    time.sleep(min(2 ** attempt, 30))
+            response.raise_for_status()
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            list(executor.map(send, chunks))
+        # Every byte is in, the server checks the file against its ID and queues it
+        r = self.session.post(uri)
+        code = r.status_code
+        data = r.json()
+        if code <= 300:
+            return True, code, data
+        elif code >= 500:
+            raise ValueError(f"Something went wrong on the request, but the server detected something unexpected "
+                             f"happened in a way it can provide feedback that can be given to the developers. "
+                             f"See below for details.\n\n"
+                             f"Code {r.status_code}: {data['message']}")
+        return False, code, data
+
+    def post_batch(self,
+                   filepaths: List[Union[Path, str]],
+                   *,
+                   options: Union[dict, QikPropOptions] = QikPropOptions(),
+                   batch_size: int = 100,
+                   callback_url: Optional[str] = None,
+                   max_concurrency: int = 1,
+                   skip_existing: bool = True
+                   ):
+        """
+        Post many files to the server for processing, batch_size files per request. Files are streamed off disk as
+        each request is sent, so only a block of each is in memory at a time
+
+        Parameters
+        ----------
+        filepaths : List of Path or str
+            Paths to the files to upload to the server
+        options : QikPropOptions or dict matching spec
+            Additional options to pass to QikProp for every file, matches the QikPropOptions spec
+        batch_size : int, Default: 100
+            Most files to upload in a single request. The server accepts at most 1000 per request
+        callback_url : str, Optional
+            URL the server POSTs the status of each task to once it is complete, see post_task
+        max_concurrency : int, Default: 1
+            Most requests to upload at the same time
+        skip_existing : bool, Default: True
+            Check which files the server already has a task for (by their checksum) before uploading, and only send
+            the ones it does not know. Re-running over mostly unchanged files then uploads next to nothing
+
+        Returns
+        -------
+        success : bool
+            If every request was accepted and processed normally. Each task still has its own code
+        code : int
+            HTTP return code of the last request. See the StatusCodes class for expected codes
+        data : dict
+            "tasks" has one entry per file in filepaths order, with the task "id" and the "code" that file would have
+            gotten from post_task. Files of a request which failed get the error and code of that request instead.
+            "chunks" has the code of each request in order, with its error if it failed
+
+        Raises
+        ------
+        ValueError
+            When the server responds with a particular code indicating that something unexpected happened on the server,
+            but it was something which can be debugged through a catch all the server is coded to handle. If you get
+            this, you should report it to the developers.
+        """
+        if isinstance(options, dict):
+            options = QikPropOptions(**options)
+        uri = self.server + self.batch_endpoint
+        filepaths = [Path(filepath) for filepath in filepaths]  # Ensure Path objects
+
+        def post_chunk(chunk):
+            task_ids = [checksum.result() for _, checksum in chunk]
+            known = set()
+            if skip_existing:
+                success, _, statuses = self.get_status_batch(task_ids, options=options)
+                if success:
+                    known = {status["id"] for status in statuses["tasks"] if status["code"] != StatusCodes.null}
+                    # Nothing to send and nothing to register, the statuses are the answer
+                    if len(known) == len(chunk) and callback_url is None:
+                        return StatusCodes.ready, statuses
+            manifest = []
+            files = {}
+            for index, ((filepath, _), task_id) in enumerate(zip(chunk, task_ids)):
+                field = f"file{index}"
+                task = {"id": task_id, "file": field, **options.dict()}
+                if callback_url is not None:
+                    task["callback_url"] = callback_url
+                manifest.append(task)
+                # The server answers with the status of tasks it has, without needing their file
+                if task_id not in known:
+                    files[field] = (filepath.name, filepath)
+            body = _MultipartBody({"manifest": json.dumps({"tasks": manifest})}, files)
+            try:
+                r = self.session.post(uri, data=body, headers={"Content-Type": body.content_type})
+            finally:
+                body.close()
+            if r.status_code >= 500:
+                raise ValueError(f"Something went wrong on the request, but the server detected something unexpected "
+                                 f"happened in a way it can provide feedback that can be given to the developers. "
+                                 f"See below for details.\n\n"
+                                 f"Code {r.status_code}: {r.json()['message']}")
+            return r.status_code, r.json()
+
+        # Files are hashed in order in the background, so later files are hashed while earlier ones upload
+        with ThreadPoolExecutor(max_workers=1) as hasher, ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            checksums = [hasher.submit(self._check_class_id, filepath=filepath) for filepath in filepaths]
+            hashed = list(zip(filepaths, checksums))
+            chunks = [hashed[start:start + batch_size] for start in range(0, len(hashed), batch_size)]
+            try:
+                responses = list(executor.map(post_chunk, chunks))
+            finally:
+                for checksum in checksums:
+                    checksum.cancel()
+        tasks = []
+        results = []
+        success, last_code = True, StatusCodes.ready
+        for chunk, (code, data) in zip(chunks, responses):
+            last_code = code
+            if code == StatusCodes.ready:
+                results.append({"code": code})
+                tasks.extend(data["tasks"])
+                continue
+            # Only the files of the request which failed are lost, each gets the error of their request
+            success = False
+            results.append({**data, "code": code})
+            tasks.extend({**data, "id": checksum.result(), "code": code} for _, checksum in chunk)
+        return success, last_code, {"tasks": tasks, "chunks": results}
+
+
+def _prepare_files(filepaths, output_tar_names, non_exist_ok: bool, compression: str):
+    """De-glob the input files and pair each with the output tarball name to save its result under"""
+    input_files = []
+    output_files = []
+    problem_paths = []
+    # Process single input
+    if isinstance(filepaths, str) or isinstance(filepaths, Path):
+        filepaths = [filepaths]
+    # De-glob all inputs
+    for single_path in filepaths:
+        input_files.extend(Path().glob(str(single_path)))
+    # Pre-process outputs
+    if output_tar_names is not None and len(output_tar_names) != len(input_files):
+        raise ValueError(f"Length of output_tar_names does not equal length of globed input files:\n"
+                         f"Input files: {str(input_file for input_file in input_files)}\n"
+                         f"Output Files: {str(output_tar_name for output_tar_name in output_tar_names)}")
+    # Check files exist and prep output files
+    for index, input_file in enumerate(input_files):
+        if not input_file.exists() and not non_exist_ok:
+            problem_paths.append(input_file)
+        if output_tar_names is not None:
+            output_files.append(output_tar_names[index])
+        else:
+            tarball_name = input_file.stem + ".qpout" + COMPRESSION_SUFFIXES[compression]
+            output_files.append(input_file.parent / Path(tarball_name))
+    return input_files, output_files
+
 
 def qikprop_as_a_service(filepaths: Union[str, Path, List[Union[str, Path]]],
                          *,  # kwonly args here
@@ -245,7 +799,12 @@ def qikprop_as_a_service(filepaths: Union[str, Path, List[Union[str, Path]]],
                          fast: bool = False,
                          similar: int = 20,
                          server_uri: str = "https://qikprop.molssi.org/api/v1",
-                         non_exist_ok: bool = False
+                         non_exist_ok: bool = False,
+                         compression: str = "gzip",
+                         max_concurrency: int = 4,
+                         digest_cache: Union[str, Path, None] = DEFAULT_DIGEST_CACHE,
+                         journal: Union[str, Path, None] = None,
+                         max_wait: Optional[float] = DEFAULT_MAX_WAIT
                          ):
     """
     Run QikProp as a Service over a series of files and generate their results. This is more meant as a helper function.
@@ -258,7 +817,7 @@ def qikprop_as_a_service(filepaths: Union[str, Path, List[Union[str, Path]]],
         Filepath(s) to be analyzed by QikProp
     output_tar_names: str, Path, List of str/Path equal in size to filepaths, optional
         Output file names from the qikprop service. If not set, output files will
-        "{file name without extension}.qpout.tar.gz"
+        "{file name without extension}.qpout.tar.gz", or the suffix of the chosen compression
     fast: bool, Default = False
         QikProp Option, Fast processing mode
     similar: int, Default = 20
@@ -267,78 +826,166 @@ def qikprop_as_a_service(filepaths: Union[str, Path, List[Union[str, Path]]],
         API endpoint URI
     non_exist_ok: bool, Default = False
         Check if all input files exist or not, if not, an error will be raised
+    compression: str, Default = "gzip"
+        Compression to download the output tarballs with, one of "gzip", "zstd" or "none"
+    max_concurrency: int, Default = 4
+        Most uploads or downloads to run at the same time, each over its own kept-alive connection
+    digest_cache: str or Path, Default = "~/.cache/qikpropservice/digests.json"
+        File to cache the checksums of the input files in, so unchanged files are not hashed again on later runs.
+        None to always hash every file
+    journal: str or Path, Optional
+        SQLite file to record the state of every file of the run in. If the run is interrupted, it can be picked up
+        where it stopped with resume_qikprop_as_a_service (qpcli resume)
+    max_wait: float, Default = 3600
+        Most seconds to wait on the tasks without any of them completing. Once it runs out, tasks which are still
+        not complete are left submitted in the journal to be picked up by resume_qikprop_as_a_service, or without a
+        journal get an .err file. None to wait for as long as it takes
     """
-    input_files = []
-    output_files = []
-    problem_paths = []
-    # Process single input
-    if isinstance(filepaths, str) or isinstance(filepaths, Path):
-        filepaths = [filepaths]
-    # De-glob all inputs
-    for single_path in filepaths:
-        input_files.extend(Path().glob(str(single_path)))
-    # Pre-process outputs
-    if output_tar_names is not None and len(output_tar_names) != len(input_files):
-        raise ValueError(f"Length of output_tar_names does not equal length of globed input files:\n"
-                         f"Input files: {str(input_file for input_file in input_files)}\n"
-                         f"Output Files: {str(output_tar_name for output_tar_name in output_tar_names)}")
-    # Check files exist and prep output files
-    for index, input_file in enumerate(input_files):
-        if not input_file.exists() and not non_exist_ok:
-            problem_paths.append(input_file)
-        if output_tar_names is not None:
-            output_files.append(output_tar_names[index])
-        else:
-            tarball_name = input_file.stem + ".qpout.tar.gz"
-            output_files.append(input_file.parent / Path(tarball_name))
+    input_files, output_files = _prepare_files(filepaths, output_tar_names, non_exist_ok, compression)
 
     # Initialize QikProp Service
     options = QikPropOptions(fast=fast, similar=similar)
-    qps = QikpropAsAService(server=server_uri)
-    task_ids = []
-    task_output_map = {}
-    errors = []
+    jobs = [{"input_path": input_file, "output_path": output_file, "checksum": None}
+            for input_file, output_file in zip(input_files, output_files)]
+    if journal is not None:
+        journal = JobJournal(journal)
+        journal.add(list(zip(input_files, output_files)), options, compression, server_uri)
+    try:
+        _run_jobs(jobs, options, server_uri, compression, max_concurrency, digest_cache, journal, max_wait)
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+def resume_qikprop_as_a_service(journal: Union[str, Path],
+                                *,
+                                max_concurrency: int = 4,
+                                digest_cache: Union[str, Path, None] = DEFAULT_DIGEST_CACHE,
+                                max_wait: Optional[float] = DEFAULT_MAX_WAIT
+                                ):
+    """
+    Pick up a qikprop_as_a_service run from its journal. Files which were already downloaded are skipped, files which
+    were submitted are waited on and downloaded without uploading them again, and the rest are submitted.
+
+    Parameters
+    ----------
+    journal: str or Path
+        SQLite journal the run was started with
+    max_concurrency: int, Default = 4
+        Most uploads or downloads to run at the same time, each over its own kept-alive connection
+    digest_cache: str or Path, Default = "~/.cache/qikpropservice/digests.json"
+        File to cache the checksums of the input files in, None to always hash every file
+    max_wait: float, Default = 3600
+        Most seconds to wait on the tasks without any of them completing, see qikprop_as_a_service
+    """
+    journal = JobJournal(journal)
+    try:
+        # Jobs only share a run if they went to the same server with the same settings
+        runs = {}
+        for job in journal.unfinished():
+            runs.setdefault((job["server"], job["options"].json(), job["compression"]), []).append(job)
+        for (server_uri, _, compression), jobs in runs.items():
+            _run_jobs(jobs, jobs[0]["options"], server_uri, compression, max_concurrency, digest_cache, journal,
+                      max_wait)
+    finally:
+        journal.close()
+
+
+def _give_up_waiting(task_ids: List[str], task_output_map: dict, max_wait: float, journal: Optional[JobJournal],
+                     write_error):
+    """Stop waiting on tasks which are not complete, leaving them to a resume if the run is journaled"""
+    if journal is not None:
+        # Still submitted in the journal, so resuming waits on them again without uploading them
+        tqdm.write(f"{len(task_ids)} tasks are still not complete after {max_wait} seconds with no task completing, "
+                   f"pick them up later with: qpcli resume {journal.path}")
+        return
+    for task_id in task_ids:
+        write_error(task_output_map[task_id], {"id": task_id, "error": f"Task was still not complete after {max_wait} "
+                                                                       f"seconds with no task completing"})
+
+
+def _run_jobs(jobs: List[dict],
+              options: QikPropOptions,
+              server_uri: str,
+              compression: str,
+              max_concurrency: int,
+              digest_cache: Union[str, Path, None],
+              journal: Optional[JobJournal] = None,
+              max_wait: Optional[float] = DEFAULT_MAX_WAIT):
+    """
+    Submit the jobs which have no task ID (checksum) yet, then wait on and download every job. Gives up on the tasks
+    still outstanding once max_wait seconds go by without any task completing
+    """
+    digests = DigestCache(digest_cache) if digest_cache is not None else None
+    # One more connection than transfers for the long poll on the task statuses
+    qps = QikpropAsAService(server=server_uri, pool_size=max_concurrency + 1, digest_cache=digests)
+    task_output_map = {job["checksum"]: Path(job["output_path"]) for job in jobs if job["checksum"] is not None}
     # Upload all tasks
-    for filepath, output_path in zip(input_files, output_files):
-        success, code, data = qps.post_task(filepath,
-                                            options=options)
-        if success:
-            task_ids.append(data["id"])
-            task_output_map[data["id"]] = output_path
-        else:
-            errors.append((filepath, data))
-    task_ids = set(task_ids)
+    to_post = [job for job in jobs if job["checksum"] is None]
+    if to_post:
+        _, _, data = qps.post_batch([job["input_path"] for job in to_post], options=options,
+                                  max_concurrency=max_concurrency)
+        # Requests which failed only fail their own files, every file has an entry either way
+        for job, task in zip(to_post, data["tasks"]):
+            if task["code"] <= 300:
+                task_output_map[task["id"]] = Path(job["output_path"])
+                if journal is not None:
+                    journal.mark_submitted(job["output_path"], task["id"])
+            elif journal is not None:
+                journal.mark_failed(job["output_path"], str(task))
+    if digests is not None:
+        digests.save()
+    task_ids = list(task_output_map)  # Unique, in submission order
     # Process all tasks
     progress = tqdm(total=len(task_ids))
-    maximum_waits = 100
-    waits = tqdm(total=maximum_waits, position=1, unit="waits")
-    counter = 0
-    while True:
-        tasks_to_remove = []
-        check_codes = []
-        for task_id in task_ids:
-            _, check_code, task_status = qps.get_status(task_id=task_id)
-            check_codes.append(check_code)
-            # get file
-            if check_code in [StatusCodes.ready, StatusCodes.error]:
-                output = task_output_map[task_id]
-                downloaded, get_code, data = qps.get_result(task_id=task_id,
-                                                            output_file=output,
-                                                            use_progress_bar=False
-                                                            )
-                progress.update(1)
-                if not downloaded:
-                    with open(output.with_suffix(output.suffix + ".err"), "w") as errfile:
-                        errfile.write(str(data))
-                tasks_to_remove.append(task_id)
-        for task_id in tasks_to_remove:
-            task_ids.remove(task_id)
-
-        counter += 1
-        waits.update(1)
-        if counter >= maximum_waits or len(task_ids) == 0:
-            break
-        sleep(5)
-
-
 
+    def write_error(output, data):
+        with open(output.with_suffix(output.suffix + ".err"), "w") as errfile:
+            errfile.write(str(data))
+        if journal is not None:
+            journal.mark_failed(output, str(data))
+
+    def download(task_id):
+        output = task_output_map[task_id]
+        downloaded, get_code, data = qps.get_result(task_id=task_id,
+                                                    options=options,
+                                                    output_file=output,
+                                                    use_progress_bar=False,
+                                                    compression=compression
+                                                    )
+        progress.update(1)
+        if not downloaded:
+            write_error(output, data)
+        elif journal is not None:
+            journal.mark_done(output)
+
+    # Downloads run in the background while waiting on the rest of the tasks
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        downloads = []
+        last_completed = time.monotonic()
+        while task_ids:
+            if max_wait is not None and time.monotonic() - last_completed > max_wait:
+                _give_up_waiting(task_ids, task_output_map, max_wait, journal, write_error)
+                break
+            # Tasks finish about in the order they went in, so waiting on the oldest ones covers the next to finish
+            success, code, statuses = qps.wait_status(task_ids[:10000], options=options)
+            if not success:
+                raise ValueError(f"Could not get the status of the tasks, code {code}: {statuses}")
+            tasks_to_remove = set()
+            for task_status in statuses["tasks"]:
+                task_id = task_status["id"]
+                check_code = task_status["code"]
+                # get file
+                if check_code in [StatusCodes.ready, StatusCodes.error]:
+                    downloads.append(executor.submit(download, task_id))
+                    tasks_to_remove.add(task_id)
+                elif check_code == StatusCodes.null:
+                    # Accepted but no longer on the server, it won't ever finish
+                    progress.update(1)
+                    write_error(task_output_map[task_id], task_status)
+                    tasks_to_remove.add(task_id)
+            if tasks_to_remove:
+                last_completed = time.monotonic()
+            task_ids = [task_id for task_id in task_ids if task_id not in tasks_to_remove]
+        for finished in downloads:
+            finished.result()  # Raise anything which went wrong
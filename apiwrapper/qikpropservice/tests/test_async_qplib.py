@@ -0,0 +1,52 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from qikpropservice.async_qplib import AsyncQikpropAsAService
+
+httpx = pytest.importorskip("httpx")
+
+server = "http://qikprop.test/api/v1"
+
+
+def _client(handler):
+    return AsyncQikpropAsAService(server=server, client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+
+def test_post_task_streams_the_file(tmp_path):
+    datafile = tmp_path / "input.sdf"
+    datafile.write_bytes(b"mol\n\nM  END\n$$$$\n")
+    checksum = hashlib.sha1(datafile.read_bytes()).hexdigest()
+    requests = []
+
+    def handler(request):
+        requests.append((request.method, request.url, request.read()))
+        return httpx.Response(201, json={"id": request.url.params["id"], "code": 201})
+
+    async def post():
+        async with _client(handler) as qps:
+            return await qps.post_task(datafile, options={"fast": True}, callback_url="https://example.com/hook")
+
+    assert asyncio.run(post()) == (True, 201, {"id": checksum, "code": 201})
+    (method, url, body), = requests
+    assert (method, url.path, body) == ("POST", "/api/v1/tasks", datafile.read_bytes())
+    assert url.params["id"] == checksum
+    assert url.params["filename"] == "input.sdf"
+    assert url.params["fast"] == "true"
+    assert url.params["callback_url"] == "https://example.com/hook"
+
+
+def test_post_task_refused(tmp_path):
+    datafile = tmp_path / "input.sdf"
+    datafile.write_bytes(b"molecule")
+
+    def handler(request):
+        return httpx.Response(409, json={"error": "ID did not match", "code": 409, "args": {}})
+
+    async def post():
+        async with _client(handler) as qps:
+            return await qps.post_task(datafile)
+
+    success, code, _ = asyncio.run(post())
+    assert (success, code) == (False, 409)
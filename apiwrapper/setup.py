@@ -28,6 +28,8 @@ if __name__ == "__main__":
         include_package_data=True,
 
         extras_require={
+            'zstd': ["zstandard"],
+            'async': ["httpx"],
             'tests': [
                 "pytest",
                 "pytest-cov",
@@ -1,14 +1,24 @@
+import json
 import logging
 from pathlib import Path
-from typing import Tuple, Union
+import time
+from typing import Callable, Optional, Tuple, Union
 
-from flask import request, send_from_directory
+from flask import request, send_from_directory, current_app
 from flask_restful import Resource, abort
 from pydantic import ValidationError
 
-from app.tasks import serve_file, response_code_from_tarball, generate_status, create_qikprop_task
+from app.tasks import (job_status, generate_status, stage_qikprop_task,
+                       generate_result_key, serve_archive, result_table, add_task_callback, upload_directory,
+                       start_upload, stage_uploaded_task, discard_upload)
+from app.uploads import read_upload, write_chunk, received_ranges, missing_ranges
+from app.callbacks import check_callback_url
+from app.compression import CODECS, CodecUnavailable, codec_from_name
+from app.factory import task_locks, task_events
 from app.data_models import (StatusGET, GETPOSTError, ResultGET, StatusCodes, QikpropPOST, StatusGETReturn,
-                             SeverHelloGETResponse)
+                             SeverHelloGETResponse, ResultsGET, ResultsGETReturn, BatchPOST,
+                             BatchPOSTResponse, BatchStatusPOST, WaitStatusPOST, BatchStatusReturn, UploadPOST,
+                             UploadPUT, UploadStatus)
 
 from . import api
 
@@ -32,12 +42,54 @@ def _check_args(input_model, model_args: dict, error_model=GETPOSTError):
                            f"Please report this to the site maintainers.")
 
 
-def _compute_status(checksum: str) -> Tuple[Union[Path, str], int, StatusGETReturn]:
-    """Parse the incoming hash to figure out if the job is present, running or not"""
-    possible_tarball = serve_file(checksum)
-    response_code = response_code_from_tarball(possible_tarball, checksum)
-    status = generate_status(response_code, possible_tarball, checksum)
-    return possible_tarball, response_code, status
+def _compute_status(checksum: str, options: dict) -> Tuple[Union[Path, str], int, StatusGETReturn]:
+    """Parse the incoming hash and options to figure out if the job is present, running or not"""
+    return job_status(checksum, options)
+
+
+_Stage = Optional[Callable[[], Tuple[dict, int]]]
+
+
+def _check_callback(callback_url: Optional[str], args) -> Optional[GETPOSTError]:
+    """Error if the server may not call a callback URL, None if it may or there is none"""
+    if callback_url is None:
+        return None
+    try:
+        check_callback_url(callback_url, current_app.config.get("CALLBACK_ALLOWLIST", ()))
+    except ValueError as e:
+        return GETPOSTError(args=args, error=str(e))
+    return None
+
+
+def _queue_task(checksum: str, options: dict, stage: _Stage, args: dict,
+                callback_url: str = None) -> Tuple[dict, int]:
+    """
+    Stage and queue a task unless it's already here, under a lease so the same task is only ever queued once. stage
+    stages and queues the file of the task, None if no file was sent.
+    The callback URL is registered for any task which is accepted, whether it was already here or not
+    """
+    error = _check_callback(callback_url, args)
+    if error is not None:
+        return error.dict(), error.code
+    data, code = _stage_task(checksum, options, stage, args)
+    if callback_url is not None and code in (StatusCodes.ready, StatusCodes.created, StatusCodes.staged,
+                                             StatusCodes.error):
+        add_task_callback(checksum, options, callback_url)
+    return data, code
+
+
+def _stage_task(checksum: str, options: dict, stage: _Stage, args: dict) -> Tuple[dict, int]:
+    with task_locks.lease(generate_result_key(checksum, options)) as leased:
+        if not leased:  # Someone else is queueing this exact task right now
+            status = generate_status(StatusCodes.staged, "In Staging", checksum, options)
+            return status.dict(), StatusCodes.staged
+        possible_tarball, response_code, status = _compute_status(checksum, options)
+        if response_code != StatusCodes.null:  # Something is here
+            return status.dict(), response_code  # Nothing to do here other than say its here
+        if stage is None:
+            error = GETPOSTError(args=args, error=f"No file was sent for ID {checksum}")
+            return error.dict(), error.code
+        return stage()
 
 
 class QikpropHelloWorld(Resource):
@@ -53,11 +105,62 @@ class QikpropStatus(Resource):
         if isinstance(args, GETPOSTError):
             return args.dict(), args.code
         checksum = args.id
-        _, response_code, status = _compute_status(checksum)
+        _, response_code, status = _compute_status(checksum, args.dict(exclude={"id"}))
         return status.dict(), response_code
 
 
-_tarbal_datatype = 'application/x-tar'
+class QikpropBatchStatus(Resource):
+    def post(self):
+        """Get the status of many QikProp Tasks at once, the JSON body is a BatchStatusPOST"""
+        try:
+            batch = BatchStatusPOST.parse_obj(request.get_json(force=True, silent=True))
+        except ValidationError as e:
+            error = GETPOSTError(args=request.args, error=f"Batch status request is not valid: {e}")
+            return error.dict(), error.code
+        tasks = [_compute_status(task.id, task.dict(exclude={"id"}))[2] for task in batch.tasks]
+        return BatchStatusReturn(tasks=tasks).dict(), StatusCodes.ready
+
+
+class QikpropWaitStatus(Resource):
+    def post(self):
+        """
+        Long poll on many QikProp Tasks, the JSON body is a WaitStatusPOST. Answers with the status of every task as
+        soon as any of them is complete (ready or error), or once the timeout runs out
+        """
+        try:
+            batch = WaitStatusPOST.parse_obj(request.get_json(force=True, silent=True))
+        except ValidationError as e:
+            error = GETPOSTError(args=request.args, error=f"Wait request is not valid: {e}")
+            return error.dict(), error.code
+        tasks = [(task.id, task.dict(exclude={"id", "timeout"})) for task in batch.tasks]
+        keys = [generate_result_key(checksum, options) for checksum, options in tasks]
+        deadline = time.monotonic() + batch.timeout
+        # Subscribe first so a task finishing between the check and the wait still wakes this up
+        with task_events.subscribe() as subscription:
+            while True:
+                statuses = [_compute_status(checksum, options)[2] for checksum, options in tasks]
+                if any(status.code in (StatusCodes.ready, StatusCodes.error) for status in statuses):
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Checked again either way, covers results of a worker which could not publish
+                task_events.wait_for_any(subscription, keys, remaining)
+        return BatchStatusReturn(tasks=statuses).dict(), StatusCodes.ready
+
+
+_archive_mimetypes = {codec.mimetype: name for name, codec in CODECS.items()}
+
+
+def _requested_codec(args: ResultGET) -> Optional[str]:
+    """Compression asked for through the compression argument, or else an Accept header naming an archive type"""
+    if args.compression is not None:
+        return args.compression
+    best = request.accept_mimetypes.best_match(list(_archive_mimetypes))
+    # Wildcards like */* don't ask for anything in particular, serve as stored
+    if best is not None and best in request.accept_mimetypes.values():
+        return _archive_mimetypes[best]
+    return None
 
 
 class QikpropData(Resource):
@@ -67,15 +170,19 @@ class QikpropData(Resource):
         args = _check_args(ResultGET, request.args)
         if isinstance(args, GETPOSTError):
             return args.dict(), args.code
-        possible_tarball, response_code, status = _compute_status(args.id)
+        possible_tarball, response_code, status = _compute_status(args.id, args.dict(exclude={"id", "compression"}))
         if response_code != StatusCodes.ready:
             return status.dict(), response_code
         elif response_code == StatusCodes.ready:
+            try:
+                possible_tarball = serve_archive(possible_tarball, _requested_codec(args))
+            except CodecUnavailable as e:
+                return GETPOSTError(args=request.args, error=str(e), code=406).dict(), 406
             directory = str(possible_tarball.parent)
             filename = str(possible_tarball.name)
             response = send_from_directory(directory,
                                            filename,
-                                           mimetype=_tarbal_datatype,  # Probably not needed
+                                           mimetype=CODECS[codec_from_name(filename)].mimetype,
                                            filename=filename,
                                            as_attachment=True)
             response.status_code = response_code  # Adjust the status code for my own app
@@ -93,12 +200,160 @@ class QikpropData(Resource):
         args = _check_args(QikpropPOST, request.args)
         if isinstance(args, GETPOSTError):
             return args.dict(), args.code
-        possible_tarball, response_code, status = _compute_status(args.id)
-        if response_code != StatusCodes.null:  # Something is here
-            return status.dict(), response_code  # Nothing to do here other than say its here
-        return create_qikprop_task(request, args.dict(exclude={"id"}), args.id)
+        options = args.dict(exclude={"id", "callback_url", "filename"})
+        return _queue_task(args.id, options,
+                           lambda: stage_qikprop_task(request.stream, request.args, options, args.id, args.filename),
+                           request.args, args.callback_url)
+
+
+class QikpropBatch(Resource):
+    def post(self):
+        """
+        Add many files in one multipart request. The manifest form field is a JSON BatchPOST listing each task, and
+        each task names the form field its file is under. Files of tasks already on the server can be left out.
+        """
+        try:
+            batch = BatchPOST.parse_raw(request.form.get("manifest", ""))
+        except ValidationError as e:
+            error = GETPOSTError(args=request.args, error=f"Batch manifest is not valid: {e}")
+            return error.dict(), error.code
+        tasks = []
+        for task in batch.tasks:
+            upload = request.files.get(task.file)
+            options = task.dict(exclude={"id", "file", "callback_url", "filename"})
+            # Called before the loop moves on, so binding the loop variables late is fine
+            stage = None
+            if upload is not None:
+                stage = lambda: stage_qikprop_task(upload.stream, task.dict(), options, task.id,
+                                                   task.filename or upload.filename)
+            data, _ = _queue_task(task.id, options, stage, task.dict(), task.callback_url)
+            tasks.append(data)
+        return BatchPOSTResponse(tasks=tasks).dict(), 200
+
+
+class QikpropResults(Resource):
+    def get(self):
+        """Get rows and columns of the parsed QP.CSV of a finished task as JSON or NDJSON"""
+        args = _check_args(ResultsGET, request.args)
+        if isinstance(args, GETPOSTError):
+            return args.dict(), args.code
+        options = args.dict(exclude={"id", "columns", "offset", "limit", "format"})
+        possible_tarball, response_code, status = _compute_status(args.id, options)
+        if response_code != StatusCodes.ready:
+            return status.dict(), response_code
+        columns = [column.strip() for column in args.columns.split(",")] if args.columns else None
+        try:
+            table = result_table(possible_tarball, columns=columns, offset=args.offset, limit=args.limit)
+        except KeyError as e:
+            return GETPOSTError(args=request.args, error=e.args[0]).dict(), 400
+        if table is None:
+            return GETPOSTError(args=request.args,
+                                error=f"No parsed results for ID {args.id}, the full output is only available "
+                                      f"as a tarball from /tasks",
+                                code=StatusCodes.null).dict(), StatusCodes.null
+        if args.format == "ndjson":
+            rows = zip(*(table["data"][column] for column in table["columns"]))
+            body = "".join(json.dumps(dict(zip(table["columns"], row))) + "\n" for row in rows)
+            response = current_app.response_class(body, mimetype="application/x-ndjson")
+            # Pagination goes in the headers since every line of the body is a row
+            response.headers["X-Total-Count"] = str(table["total"])
+            if table["next_offset"] is not None:
+                response.headers["X-Next-Offset"] = str(table["next_offset"])
+            return response
+        return ResultsGETReturn(id=args.id, **table).dict(), StatusCodes.ready
+
+
+def _upload_status(upload_id: str, info: dict, code: int = StatusCodes.ready) -> UploadStatus:
+    directory = upload_directory(upload_id)
+    received = sum(end - start for start, end in received_ranges(directory))
+    return UploadStatus(upload_id=upload_id, id=info["id"], size=info["size"], received=received,
+                        missing=missing_ranges(directory, info["size"]), code=code)
+
+
+def _find_upload(upload_id: str) -> Tuple[Optional[dict], Optional[GETPOSTError]]:
+    directory = upload_directory(upload_id)
+    info = read_upload(directory) if directory is not None else None
+    if info is None:
+        return None, GETPOSTError(args=request.args, error=f"No upload with ID {upload_id}", code=StatusCodes.null)
+    return info, None
+
+
+class QikpropUploads(Resource):
+    def post(self):
+        """
+        Start a resumable upload, the arguments are an UploadPOST. Answers with the status of the task if the server
+        already has it, else with the UploadStatus of the upload, picked back up if it was started before
+        """
+        args = _check_args(UploadPOST, request.args)
+        if isinstance(args, GETPOSTError):
+            return args.dict(), args.code
+        options = args.dict(exclude={"id", "size", "callback_url", "filename"})
+        _, response_code, _ = _compute_status(args.id, options)
+        if response_code != StatusCodes.null:  # Nothing to upload
+            return _queue_task(args.id, options, None, request.args, args.callback_url)
+        error = _check_callback(args.callback_url, request.args)
+        if error is not None:
+            return error.dict(), error.code
+        max_size = current_app.config.get("UPLOAD_MAX_SIZE")
+        if max_size is not None and args.size > max_size:
+            error = GETPOSTError(args=request.args,
+                                 error=f"Upload of {args.size} bytes is over the limit of {max_size} bytes", code=413)
+            return error.dict(), error.code
+        upload_id, info = start_upload(args.id, options, args.size, args.callback_url, args.filename)
+        return _upload_status(upload_id, info, StatusCodes.created).dict(), StatusCodes.created
+
+
+class QikpropUpload(Resource):
+    def get(self, upload_id):
+        """Progress of an upload, so a client can send only the byte ranges which are still missing"""
+        info, error = _find_upload(upload_id)
+        if error is not None:
+            return error.dict(), error.code
+        return _upload_status(upload_id, info).dict(), StatusCodes.ready
+
+    def put(self, upload_id):
+        """Write a chunk of an upload, the body is written at the offset argument of the file"""
+        args = _check_args(UploadPUT, request.args)
+        if isinstance(args, GETPOSTError):
+            return args.dict(), args.code
+        info, error = _find_upload(upload_id)
+        if error is not None:
+            return error.dict(), error.code
+        try:
+            write_chunk(upload_directory(upload_id), info["size"], args.offset, request.stream)
+        except ValueError as e:
+            return GETPOSTError(args=request.args, error=str(e)).dict(), 400
+        return _upload_status(upload_id, info).dict(), StatusCodes.ready
+
+    def post(self, upload_id):
+        """Finish an upload once every byte is in: the file is checked against its ID and its task queued"""
+        info, error = _find_upload(upload_id)
+        if error is not None:
+            return error.dict(), error.code
+        status = _upload_status(upload_id, info)
+        if status.missing:
+            error = GETPOSTError(args=request.args,
+                                 error=f"Upload {upload_id} is still missing {status.size - status.received} bytes "
+                                       f"in {len(status.missing)} ranges")
+            return error.dict(), error.code
+        checksum, options = info["id"], info["options"]
+        data, code = _queue_task(checksum, options,
+                                 lambda: stage_uploaded_task(upload_id, request.args, options, checksum,
+                                                             info.get("filename")),
+                                 request.args, info["callback_url"])
+        # Done with once staged, and a file which did not match its ID has to be uploaded again from scratch. Kept
+        # otherwise, so the upload can be finished again if it was not staged (say another request held the lease)
+        if code in (StatusCodes.created, StatusCodes.unmatched):
+            discard_upload(upload_id)
+        return data, code
 
 
 api.add_resource(QikpropHelloWorld, "/")
 api.add_resource(QikpropStatus, "/status")
+api.add_resource(QikpropBatchStatus, "/status/batch")
+api.add_resource(QikpropWaitStatus, "/status/wait")
 api.add_resource(QikpropData, "/tasks")
+api.add_resource(QikpropBatch, "/tasks/batch")
+api.add_resource(QikpropResults, "/results")
+api.add_resource(QikpropUploads, "/uploads")
+api.add_resource(QikpropUpload, "/uploads/<string:upload_id>")
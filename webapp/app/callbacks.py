@@ -0,0 +1,121 @@
+"""
+Webhook callbacks of QikProp tasks. Callback URLs are kept in the result directory of a task and each gets a POST
+of the task status once the result is complete, signed with HMAC-SHA256 when CALLBACK_SECRET is set.
+
+Delivery is at least once: a callback registered just as its task finishes can be called twice, receivers should
+use the id and options of the payload to drop repeats.
+
+Callbacks are POSTed from inside the deployment, so URLs resolving to loopback, private or otherwise non-public
+addresses are refused, both when registered and again when delivered, unless their host is in CALLBACK_ALLOWLIST.
+Deliveries connect to the address which was checked and don't follow redirects, so neither DNS changing in between
+nor a redirect can point them anywhere else.
+"""
+
+import hashlib
+import hmac
+import ipaddress
+import os
+from pathlib import Path
+import socket
+from typing import Iterable, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.constants import QP_CALLBACKS_NAME
+
+SIGNATURE_HEADER = "X-QikProp-Signature"
+
+
+def check_callback_url(url: str, allowlist: Iterable[str] = ()) -> Optional[str]:
+    """
+    Check a callback URL is one the server may call: an http(s) URL whose host is in allowlist, or else whose every
+    address is a public one. Returns an address which was checked to connect to, None for hosts in allowlist
+
+    Raises
+    ------
+    ValueError
+        If the URL can't be called
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError(f"Callback URL {url} is not an http or https URL")
+    if parts.hostname.lower() in {host.lower() for host in allowlist}:
+        return None
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError, ValueError) as e:
+        raise ValueError(f"Callback URL {url} could not be resolved: {e}")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])  # Without the scope of link local IPv6 addresses
+        if getattr(ip, "ipv4_mapped", None) is not None:
+            ip = ip.ipv4_mapped
+        if not ip.is_global:
+            raise ValueError(f"Callback URL {url} resolves to {ip}, which is not a public address")
+    return sorted(addresses)[0]
+
+
+class _PinnedAdapter(HTTPAdapter):
+    """Connects to one address whatever the host of the URL resolves to, TLS is still verified against the host"""
+
+    def __init__(self, address: str):
+        self.address = address
+        super().__init__()
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        hostname = host_params["host"]
+        host_params["host"] = self.address
+        if host_params["scheme"] == "https":
+            pool_kwargs.update(server_hostname=hostname, assert_hostname=hostname)
+        return host_params, pool_kwargs
+
+    def add_headers(self, request, **kwargs):
+        # Connecting to the address would name it as the host otherwise
+        request.headers.setdefault("Host", urlsplit(request.url).netloc.rpartition("@")[2])
+
+
+def post_callback(url: str, body: bytes, headers: dict, allowlist: Iterable[str] = (),
+                  timeout: float = 10) -> requests.Response:
+    """
+    POST a callback body to url once it is checked with check_callback_url, connected to the address which was
+    checked. Redirects are answered as they are, not followed, since where they lead was never checked
+
+    Raises
+    ------
+    ValueError
+        If the URL can't be called
+    """
+    address = check_callback_url(url, allowlist)
+    with requests.Session() as session:
+        session.trust_env = False  # A proxy from the environment would do its own resolving
+        if address is not None:
+            session.mount(urlsplit(url).scheme + "://", _PinnedAdapter(address))
+        return session.post(url, data=body, headers=headers, timeout=timeout, allow_redirects=False)
+
+
+def register_callback(serve_directory: Path, url: str):
+    """Add a callback URL to a result directory, appends are atomic so concurrent registrations don't clash"""
+    serve_directory.mkdir(parents=True, exist_ok=True)
+    fd = os.open(Path(serve_directory, QP_CALLBACKS_NAME), os.O_CREAT | os.O_APPEND | os.O_WRONLY)
+    with os.fdopen(fd, "w") as f:
+        f.write(url + "\n")
+
+
+def read_callbacks(serve_directory: Path) -> List[str]:
+    """Unique callback URLs of a result directory in the order they were registered"""
+    try:
+        with Path(serve_directory, QP_CALLBACKS_NAME).open("r") as f:
+            return list(dict.fromkeys(line.strip() for line in f if line.strip()))
+    except FileNotFoundError:
+        return []
+
+
+def sign_payload(body: bytes, secret: Optional[str]) -> dict:
+    """Headers signing a callback body, receivers recompute the HMAC-SHA256 of the raw body with the shared secret"""
+    if not secret:
+        return {}
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return {SIGNATURE_HEADER: f"sha256={digest}"}
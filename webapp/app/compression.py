@@ -0,0 +1,133 @@
+"""
+Compression codecs the QikProp output tarballs can be written and served with.
+
+zstd needs the optional zstandard package, the other codecs are all standard library.
+"""
+
+from collections import namedtuple
+import gzip
+import os
+import shutil
+from pathlib import Path
+import tarfile
+from typing import Optional
+import uuid
+
+from app.constants import QP_OUTPUT_BASE_NAME
+
+Codec = namedtuple("Codec", ["suffix", "mimetype", "default_level"])
+
+CODECS = {
+    "none": Codec("", "application/x-tar", None),
+    "gzip": Codec(".gz", "application/gzip", 6),
+    "zstd": Codec(".zst", "application/zstd", 3),
+}
+
+
+class CodecUnavailable(ValueError):
+    pass
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise CodecUnavailable("The zstd codec needs the zstandard package installed on the server")
+    return zstandard
+
+
+def check_codec(codec: str):
+    """Raise if a codec is not known or can't be used here"""
+    if codec not in CODECS:
+        raise CodecUnavailable(f"Unknown compression {codec}, known compressions are {list(CODECS)}")
+    if codec == "zstd":
+        _zstandard()
+
+
+def archive_name(codec: str) -> str:
+    return QP_OUTPUT_BASE_NAME + CODECS[codec].suffix
+
+
+def codec_from_name(name: str) -> Optional[str]:
+    """Codec of an archive from its file name, None if its not an output archive"""
+    for codec in CODECS:
+        if name == archive_name(codec):
+            return codec
+    return None
+
+
+class _CompressedWriter:
+    """Binary file wrapper which compresses everything written to it with a codec"""
+
+    def __init__(self, path: Path, codec: str, level: Optional[int]):
+        level = CODECS[codec].default_level if level is None else level
+        self._raw = open(path, "wb")
+        if codec == "gzip":
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=level)
+        elif codec == "zstd":
+            self._stream = _zstandard().ZstdCompressor(level=level).stream_writer(self._raw, closefd=False)
+        else:
+            self._stream = self._raw
+
+    def write(self, data):
+        return self._stream.write(data)
+
+    def close(self):
+        if self._stream is not self._raw:
+            self._stream.close()
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_compressed_reader(path: Path, codec: str):
+    """Binary file-like reading the decompressed contents of an archive"""
+    if codec == "gzip":
+        return gzip.open(path, "rb")
+    elif codec == "zstd":
+        return _zstandard().ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+def _replace_from_temp(output_path: Path, write):
+    """Call write on a temporary path next to output_path, then rename it into place"""
+    output_path = Path(output_path)
+    temp_path = output_path.with_name(f".{output_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        write(temp_path)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if temp_path.exists():
+            temp_path.unlink()
+        raise
+    return output_path
+
+
+def write_archive(source_dir: Path, filenames, output_path: Path, codec: str, level: Optional[int] = None) -> Path:
+    """
+    Tarball the files in source_dir which exist straight to output_path, compressed with codec. The tarball is built
+    under a temporary name next to output_path and renamed into place, so output_path is only ever complete.
+    """
+    def write(temp_path):
+        with _CompressedWriter(temp_path, codec, level) as compressed:
+            with tarfile.open(fileobj=compressed, mode="w|") as tarball:
+                for filename in filenames:
+                    if (Path(source_dir) / filename).exists():
+                        tarball.add(Path(source_dir) / filename, arcname=filename)
+
+    return _replace_from_temp(output_path, write)
+
+
+def transcode_archive(source_path: Path, source_codec: str, output_path: Path, codec: str,
+                      level: Optional[int] = None) -> Path:
+    """Recompress an archive to another codec, the tar stream itself is copied as is"""
+    def write(temp_path):
+        with open_compressed_reader(source_path, source_codec) as source:
+            with _CompressedWriter(temp_path, codec, level) as compressed:
+                shutil.copyfileobj(source, compressed, 1024 * 1024)
+
+    return _replace_from_temp(output_path, write)
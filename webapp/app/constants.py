@@ -1,5 +1,17 @@
 from pathlib import Path
 
-QP_OUTPUT_TAR_NAME = "qp_data.tar.gz"
+QP_OUTPUT_BASE_NAME = "qp_data.tar"
+QP_OUTPUT_TAR_NAME = QP_OUTPUT_BASE_NAME + ".gz"
+QP_ERROR_FILE_NAME = "ErrorDetails.txt"
+# Columnar store of the QP.CSV descriptors
+QP_TABLE_NAME = "qp_table.json"
+# Written atomically once a result directory is final, its presence is what marks a task as complete
+QP_MANIFEST_NAME = "manifest.json"
+# Exclusive claim on a result directory by the worker running it
+QP_CLAIM_NAME = ".claim"
+# Seconds after which a claim is assumed to be from a dead worker and can be taken over
+QP_CLAIM_TIMEOUT = 60 * 60 * 12
+# Webhook URLs to call once a result is complete, one per line
+QP_CALLBACKS_NAME = "callbacks.txt"
 SERVE_PATH = Path(".", "qpout").resolve()
 INBOUND_PATH = Path(".", "qpin").resolve()
@@ -4,8 +4,12 @@ Collection of datastructure models for the various requests
 
 from .qpopts import QikPropOptions
 from .requestmodels import (StatusGET, StatusGETReturn,
+                            BatchStatusPOST, WaitStatusPOST, BatchStatusReturn,
                             ResultGET,
+                            ResultsGET, ResultsGETReturn,
                             QikpropPOST, QikpropPOSTResponse,
+                            BatchTaskPOST, BatchPOST, BatchPOSTResponse,
+                            UploadPOST, UploadPUT, UploadStatus,
                             GETPOSTError,
                             SeverHelloGETResponse,
                             StatusCodes
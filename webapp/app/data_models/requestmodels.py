@@ -1,6 +1,6 @@
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
-from pydantic import BaseModel, Extra
+from pydantic import AnyHttpUrl, BaseModel, Extra, confloat, conint, conlist, constr
 
 from . import QikPropOptions
 from .. import __version_spec__
@@ -27,8 +27,8 @@ class SeverHelloGETResponse(BaseModel):
     version: Tuple[int, int, int] = __version_spec__
 
 
-class StatusGET(BaseModel):
-    """Expected Model for GET method of status"""
+class StatusGET(QikPropOptions):
+    """Expected Model for GET method of status, the options select which result set of the ID is reported"""
     id: str
 
     class Config:
@@ -37,13 +37,58 @@ class StatusGET(BaseModel):
 
 
 class StatusGETReturn(StatusGET):
+    """
+    Status of a task. Tasks tracked by the job state store also have their state (queued, running, done or error)
+    and, while running, the molecules done so far. progress is the percent done, only known when the molecules of
+    the input could be counted. eta is the estimated seconds until a queued or running task is done, from the
+    runtimes of earlier tasks with the same options and the approximate number of jobs queued ahead of it
+    """
     code: int
     message: str
     error: Optional[str]
+    state: Optional[str] = None
+    molecules_done: Optional[int] = None
+    molecules_total: Optional[int] = None
+    progress: Optional[float] = None
+    eta: Optional[float] = None
+
+
+class BatchStatusPOST(BaseModel):
+    """Tasks to get the status of in one request, each with the options of the result set to report"""
+    tasks: conlist(StatusGET, min_items=1, max_items=10000)
+
+
+class WaitStatusPOST(BatchStatusPOST):
+    """Long poll on tasks, answered once any of them is complete or after timeout seconds"""
+    timeout: confloat(ge=0, le=30) = 30
+
+
+class BatchStatusReturn(BaseModel):
+    """Status of each task of a BatchStatusPOST in request order"""
+    tasks: List[StatusGETReturn]
 
 
 class ResultGET(StatusGET):
-    """Expected model for GET method"""
+    """Expected model for GET method, compression is one of the output codecs to get the tarball with"""
+    compression: Optional[str] = None
+
+
+class ResultsGET(StatusGET):
+    """Expected model for GET method of the parsed results. Columns are comma separated, all columns if not set"""
+    columns: Optional[str] = None
+    offset: conint(ge=0) = 0
+    limit: conint(ge=1, le=10000) = 1000
+    format: constr(regex=r"^(json|ndjson)$") = "json"
+
+
+class ResultsGETReturn(BaseModel):
+    """Slice of the QP.CSV of a task, one list of values per column"""
+    id: str
+    columns: List[str]
+    data: Dict[str, List[Any]]
+    total: int
+    offset: int
+    next_offset: Optional[int]
 
 
 class GETPOSTError(BaseModel):
@@ -53,9 +98,53 @@ class GETPOSTError(BaseModel):
 
 
 class QikpropPOST(QikPropOptions):
+    """
+    Expected model for POST method, callback_url is POSTed the task status once it is complete. filename is the name
+    of the file sent, its extension tells the format of the file so molecule files can be split and counted
+    """
     id: str
+    callback_url: Optional[AnyHttpUrl] = None
+    filename: Optional[constr(max_length=255)] = None
 
 
 class QikpropPOSTResponse(QikpropPOST):
     code: int = StatusCodes.created
 
+
+class BatchTaskPOST(QikpropPOST):
+    """
+    One task of a batch POST, file is the name of the multipart form field holding its data. filename defaults to
+    the name the file was sent with
+    """
+    file: str
+
+
+class BatchPOST(BaseModel):
+    """Manifest of a batch POST, sent as JSON in the manifest form field"""
+    tasks: conlist(BatchTaskPOST, min_items=1, max_items=1000)
+
+
+class BatchPOSTResponse(BaseModel):
+    """Outcome of each task of a batch POST in manifest order, each with the code it would have had on its own"""
+    tasks: List[Dict[str, Any]]
+
+
+class UploadPOST(QikpropPOST):
+    """Start a resumable upload of a file of size bytes, the ID has to be a hex checksum since it names the upload"""
+    id: constr(regex=r"^[0-9a-f]+$")
+    size: conint(ge=0)
+
+
+class UploadPUT(BaseModel):
+    """Chunk of a resumable upload, the body is written at offset bytes into the file"""
+    offset: conint(ge=0)
+
+
+class UploadStatus(BaseModel):
+    """Progress of a resumable upload, missing lists the [start, end) byte ranges which still have to be sent"""
+    upload_id: str
+    id: str
+    size: int
+    received: int
+    missing: List[Tuple[int, int]]
+    code: int = StatusCodes.created
@@ -0,0 +1,105 @@
+"""
+Estimated seconds until QikProp jobs are done, from the TimeGuess cost model of their option set and the number of
+jobs waiting ahead of them in the Celery queue. Both are looked up at most every ETA_CACHE_TIMEOUT seconds per web
+process, so status requests don't each go to Mongo and the broker.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+from flask import current_app
+
+from app import celery
+from app.jobstate import JobStates
+from app.models.time_guess import TimeGuess, check_time_data, option_set_tracking_name
+from app.qp import OptionMap
+
+logger = logging.getLogger(__name__)
+
+ETA_CACHE_TIMEOUT = 30  # in seconds
+
+
+class _TimedCache:
+    """Values kept for a number of seconds, failed lookups are kept as None for as long so they aren't retried"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._values = {}
+        self._guard = threading.Lock()
+
+    def get(self, key, compute: Callable):
+        now = time.monotonic()
+        with self._guard:
+            cached = self._values.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        try:
+            value = compute()
+        except Exception:
+            logger.exception(f"Could not look up {key} for task ETAs")
+            value = None
+        with self._guard:
+            self._values[key] = (now + self.timeout, value)
+        return value
+
+
+_cache = _TimedCache(ETA_CACHE_TIMEOUT)
+
+
+def queue_depth() -> Optional[int]:
+    """
+    Jobs waiting in the default Celery queue, read straight off the Redis broker. Callbacks have a queue of their own
+    but anything else sent to the default queue counts as well, so this is an approximate count of QikProp jobs
+    """
+    def llen():
+        with celery.connection_for_read() as connection:
+            connection.ensure_connection(max_retries=1)  # Status requests shouldn't hang on a broker which is down
+            return connection.default_channel.client.llen(celery.conf.task_default_queue)
+    return _cache.get("queue_depth", llen)
+
+
+def cost_model(options: dict) -> Optional[TimeGuess]:
+    """TimeGuess measurements of the option set of options, None if there are none yet"""
+    run_options = OptionMap.generate_options(**options)
+
+    def lookup():
+        time_data = check_time_data(tracking_name=option_set_tracking_name(run_options))
+        return time_data if time_data.total_ops else None
+    return _cache.get(tuple(sorted(run_options.items())), lookup)
+
+
+def job_eta(state: dict, model: Optional[TimeGuess], depth: Optional[int], worker_slots: int,
+            now: float = None) -> Optional[float]:
+    """
+    Seconds until a job is done from its job state. Running jobs with progress are extrapolated from their own pace,
+    else from the cost model. Queued jobs also wait for the depth jobs queued ahead, which drain worker_slots at a
+    time. None when there is nothing to go on.
+    """
+    if state["state"] not in (JobStates.QUEUED, JobStates.RUNNING):
+        return None
+    now = time.time() if now is None else now
+    done, total = state.get("molecules_done"), state.get("molecules_total")
+    estimate = model.estimate(state.get("size_kb"), total) if model is not None else None
+    if state["state"] == JobStates.RUNNING:
+        elapsed = now - state["started_at"]
+        if done and total:
+            return elapsed * (total - done) / done
+        return max(estimate - elapsed, 0.0) if estimate is not None else None
+    if estimate is not None and depth and model.seconds_per_job:
+        estimate += depth * model.seconds_per_job / max(worker_slots, 1)
+    return estimate
+
+
+def estimate_eta(state: dict, options: dict) -> Optional[float]:
+    """ETA of a queued or running job, None if it can't be estimated"""
+    if state["state"] not in (JobStates.QUEUED, JobStates.RUNNING):
+        return None  # Not worth the lookups
+    try:
+        worker_slots = current_app.config.get("ETA_WORKER_SLOTS", 1)
+        eta = job_eta(state, cost_model(options), queue_depth(), worker_slots)
+    except Exception:
+        logger.exception("Could not estimate a task ETA")
+        return None
+    return round(eta, 1) if eta is not None else None
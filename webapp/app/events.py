@@ -0,0 +1,129 @@
+"""
+Completion events of QikProp tasks, published by the workers as results are finished so the API can answer long
+polls the moment a task is done instead of clients polling on a fixed interval
+"""
+
+from contextlib import contextmanager
+import queue
+import threading
+import time
+from typing import Iterable, Optional
+
+import redis
+
+
+class _MemorySubscription:
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def get(self, timeout: float) -> Optional[str]:
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class MemoryEventBackend:
+    """In-process events, only reaches subscribers in the same process. Used for testing"""
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._guard = threading.Lock()
+
+    def publish(self, channel: str, key: str):
+        with self._guard:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription._queue.put(key)
+
+    def subscribe(self, channel: str) -> _MemorySubscription:
+        subscription = _MemorySubscription()
+        with self._guard:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: _MemorySubscription):
+        with self._guard:
+            self._subscriptions.discard(subscription)
+
+
+class _RedisSubscription:
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+
+    def get(self, timeout: float) -> Optional[str]:
+        deadline = time.monotonic() + timeout
+        while True:
+            message = self._pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+            if message is not None and message["type"] == "message":
+                return message["data"].decode()
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return None
+
+
+class RedisEventBackend:
+    """Events shared between the Celery workers and every web worker through Redis pub/sub"""
+
+    def __init__(self, url: str):
+        self._redis = redis.Redis.from_url(url)
+
+    def publish(self, channel: str, key: str):
+        self._redis.publish(channel, key)
+
+    def subscribe(self, channel: str) -> _RedisSubscription:
+        pubsub = self._redis.pubsub()
+        pubsub.subscribe(channel)
+        return _RedisSubscription(pubsub)
+
+    def unsubscribe(self, subscription: _RedisSubscription):
+        subscription._pubsub.close()
+
+
+_backends = {
+    "memory": lambda app: MemoryEventBackend(),
+    "redis": lambda app: RedisEventBackend(app.config["REDIS_URL"]),
+}
+
+
+class TaskEvents:
+    """Flask extension publishing and waiting on task completions through the TASK_EVENT_BACKEND config backend"""
+
+    channel = "qikprop:done"
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = _backends[app.config["TASK_EVENT_BACKEND"]](app)
+
+    def publish(self, key: str):
+        """Announce the result of a key is complete"""
+        self.backend.publish(self.channel, key)
+
+    @contextmanager
+    def subscribe(self):
+        """
+        Subscribe to completions, yields a subscription whose get(timeout) returns the next completed key or None
+        on timeout. Subscribe before checking on results so no completion slips in between.
+        """
+        subscription = self.backend.subscribe(self.channel)
+        try:
+            yield subscription
+        finally:
+            self.backend.unsubscribe(subscription)
+
+    @staticmethod
+    def wait_for_any(subscription, keys: Iterable[str], timeout: float) -> Optional[str]:
+        """Wait up to timeout seconds for any of keys to complete, returns the key or None"""
+        keys = set(keys)
+        deadline = time.monotonic() + timeout
+        remaining = timeout
+        while remaining > 0:
+            key = subscription.get(remaining)
+            if key is None or key in keys:
+                return key
+            remaining = deadline - time.monotonic()
+        return None
@@ -16,6 +16,9 @@ from config import config
 
 from celery import Celery
 from .celery_utils import init_celery
+from .locks import TaskLocks
+from .events import TaskEvents
+from .jobstate import JobStates
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +36,9 @@ pagedown = PageDown()
 moment = Moment()  # formatting dates and time
 cache = Cache()
 cors = CORS()
+task_locks = TaskLocks()
+task_events = TaskEvents()
+job_states = JobStates()
 
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
@@ -55,6 +61,9 @@ def create_app(config_name=PKG_NAME, **kwargs):
     pagedown.init_app(app)
     cache.init_app(app)
     cors.init_app(app)
+    task_locks.init_app(app)
+    task_events.init_app(app)
+    job_states.init_app(app)
 
 
     if app.config['SSL_REDIRECT']:
@@ -1,6 +1,5 @@
 import hashlib
-
-# TODO: hash the options as well
+import json
 
 
 hash_method = hashlib.sha1
@@ -37,6 +36,15 @@ def generate_checksum_file(file):
     return checksum
 
 
+def generate_checksum_options(options: dict) -> str:
+    """
+    Hash a set of (already normalized) QikProp options. Keys are sorted and separators fixed so the same options
+    always produce the same digest regardless of the order they were passed in.
+    """
+    canonical = json.dumps(options, sort_keys=True, separators=(",", ":"))
+    return hash_method(canonical.encode("utf-8")).hexdigest()
+
+
 def write_file_and_checksum_from_stream(datastream, filepath="streamed.file", chunk_size=4096):
     """Write a file to disk and processes its hash on the fly, best used with a temporary directory"""
     cumulative_hash = hash_method()
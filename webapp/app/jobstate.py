@@ -0,0 +1,101 @@
+"""
+State of each QikProp job (queued, running, done or error) with its timestamps and result location, written as the
+job moves along so the API can answer status requests from one lookup instead of probing the staging and serve
+directories. Keys without a state (results from before the store, or a flushed store) fall back to the directories.
+"""
+
+import json
+import threading
+import time
+from typing import Optional
+
+import redis
+
+
+class MemoryJobStateBackend:
+    """In-process job states, only seen by the same process. Used for testing"""
+
+    def __init__(self):
+        self._states = {}
+        self._guard = threading.Lock()
+
+    def update(self, name: str, fields: dict):
+        with self._guard:
+            self._states.setdefault(name, {}).update(fields)
+
+    def get(self, name: str) -> Optional[dict]:
+        with self._guard:
+            state = self._states.get(name)
+            return dict(state) if state is not None else None
+
+    def delete_prefix(self, prefix: str):
+        with self._guard:
+            for name in [name for name in self._states if name.startswith(prefix)]:
+                del self._states[name]
+
+
+class RedisJobStateBackend:
+    """Job states shared by the Celery workers and every web worker, one Redis hash of JSON values per job"""
+
+    def __init__(self, url: str):
+        self._redis = redis.Redis.from_url(url)
+
+    def update(self, name: str, fields: dict):
+        # Field by field so concurrent updates of different fields don't clobber each other
+        self._redis.hset(name, mapping={field: json.dumps(value) for field, value in fields.items()})
+
+    def get(self, name: str) -> Optional[dict]:
+        state = self._redis.hgetall(name)
+        if not state:
+            return None
+        return {field.decode(): json.loads(value) for field, value in state.items()}
+
+    def delete_prefix(self, prefix: str):
+        names = list(self._redis.scan_iter(match=prefix + "*"))
+        if names:
+            self._redis.delete(*names)
+
+
+_backends = {
+    "memory": lambda app: MemoryJobStateBackend(),
+    "redis": lambda app: RedisJobStateBackend(app.config["REDIS_URL"]),
+}
+
+
+class JobStates:
+    """Flask extension keeping the state of each result key in the backend set by the JOB_STATE_BACKEND config"""
+
+    prefix = "qikprop:job:"
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    ERROR = "error"
+
+    # Timestamp field set when a job enters each state
+    _timestamps = {QUEUED: "queued_at", RUNNING: "started_at", DONE: "finished_at", ERROR: "finished_at"}
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = _backends[app.config["JOB_STATE_BACKEND"]](app)
+
+    def mark(self, key: str, state: str, **fields):
+        """Move the job of a key to state, stamped with the time, along with any other fields of the job"""
+        fields.update({"state": state, self._timestamps[state]: time.time()})
+        self.backend.update(self.prefix + key, fields)
+
+    def update(self, key: str, **fields):
+        """Update fields of the job of a key without moving it to another state"""
+        self.backend.update(self.prefix + key, fields)
+
+    def get(self, key: str) -> Optional[dict]:
+        """State and fields of the job of a key, None if the key isn't tracked"""
+        return self.backend.get(self.prefix + key)
+
+    def clear(self, checksum: str):
+        """Forget the jobs of a file across every option set it was run with"""
+        self.backend.delete_prefix(f"{self.prefix}{checksum}/")
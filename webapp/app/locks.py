@@ -0,0 +1,90 @@
+"""
+Short lived leases around the check-then-enqueue path of QikProp tasks so only one job per result is ever queued,
+even when the same file is posted to several web workers at once
+"""
+
+from contextlib import contextmanager
+import threading
+import time
+import uuid
+
+import redis
+
+
+class MemoryLeaseBackend:
+    """In-process leases, only safe for a single web process. Used for testing"""
+
+    def __init__(self):
+        self._leases = {}
+        self._guard = threading.Lock()
+
+    def acquire(self, name: str, timeout: float):
+        token = uuid.uuid4().hex
+        now = time.monotonic()
+        with self._guard:
+            held = self._leases.get(name)
+            if held is not None and held[1] > now:
+                return None
+            self._leases[name] = (token, now + timeout)
+        return token
+
+    def release(self, name: str, token: str):
+        with self._guard:
+            held = self._leases.get(name)
+            if held is not None and held[0] == token:
+                del self._leases[name]
+
+
+class RedisLeaseBackend:
+    """Leases shared by every web worker through Redis, expire on their own if the holder dies"""
+
+    def __init__(self, url: str):
+        self._redis = redis.Redis.from_url(url)
+
+    def acquire(self, name: str, timeout: float):
+        lock = self._redis.lock(name, timeout=timeout, blocking=False)
+        if not lock.acquire():
+            return None
+        return lock
+
+    def release(self, name: str, token):
+        try:
+            token.release()
+        except redis.exceptions.LockError:
+            pass  # Lease already expired, nothing to give back
+
+
+_backends = {
+    "memory": lambda app: MemoryLeaseBackend(),
+    "redis": lambda app: RedisLeaseBackend(app.config["REDIS_URL"]),
+}
+
+
+class TaskLocks:
+    """Flask extension handing out task leases from the backend set by the TASK_LOCK_BACKEND config"""
+
+    prefix = "qikprop:lock:"
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.timeout = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = _backends[app.config["TASK_LOCK_BACKEND"]](app)
+        self.timeout = app.config["TASK_LOCK_TIMEOUT"]
+
+    @contextmanager
+    def lease(self, key: str):
+        """
+        Try to take the lease on a key without waiting. Yields True if this caller holds it, False if someone
+        else already does. The lease is given back on exit and expires after TASK_LOCK_TIMEOUT seconds regardless.
+        """
+        name = self.prefix + key
+        token = self.backend.acquire(name, self.timeout)
+        try:
+            yield token is not None
+        finally:
+            if token is not None:
+                self.backend.release(name, token)
@@ -4,8 +4,8 @@ from werkzeug.utils import secure_filename
 
 from . import main
 from app.hashing import generate_checksum_file
-from app.tasks import serve_file, run_qikprop_worker, inbound_staging_web, clear_output
-from ..constants import QP_OUTPUT_TAR_NAME
+from app.tasks import serve_file, queue_qikprop_job, inbound_staging_web, clear_output, generate_result_key
+from ..factory import task_locks
 from ..models import save_access
 import logging
 from .forms import ProgramForm
@@ -37,15 +37,18 @@ def server_shutdown():
 
 
 @main.route('/qpout/<checksum>')
-def get_qp_output(checksum):
-    possible_tarball = serve_file(checksum)
+@main.route('/qpout/<checksum>/<options_checksum>')
+def get_qp_output(checksum, options_checksum=None):
+    # No options given means the results of a default options run
+    if options_checksum is None:
+        result_key = generate_result_key(checksum, {})
+    else:
+        result_key = f"{checksum}/{options_checksum}"
+    possible_tarball = serve_file(result_key)
     if isinstance(possible_tarball, Path):
-        fname = possible_tarball.name
-        if QP_OUTPUT_TAR_NAME in possible_tarball.name:
-            fname = QP_OUTPUT_TAR_NAME
         return send_from_directory(str(possible_tarball.parent),
                                    str(possible_tarball.name),
-                                   filename=fname,
+                                   filename=possible_tarball.name,
                                    as_attachment=True)
     elif isinstance(possible_tarball, str):
         return (f"Tasks for computations at ID {checksum} have not run or are not completed yet. "
@@ -79,14 +82,18 @@ def index():
         flash(f'Thank you for submitting {filename}, Data was uploaded, now processing under hash: {checksum}')
         # Extract options
         options = {option: getattr(form, option).data for option in OptionMap.known_methods() if option in form}
+        result_key = generate_result_key(checksum, options)
         save_access(page="homepage", access_type="run")
         # Run the code
         try:
-            staged_file = inbound_staging_web(file, filename, checksum)
-            print(f"File at invocation is {staged_file}")
-            run_qikprop_worker.delay(str(staged_file), options, checksum)
+            # Same file with the same options has already been run or is being queued, serve that instead
+            with task_locks.lease(result_key) as leased:
+                if leased and serve_file(result_key) is None:
+                    staged_file = inbound_staging_web(file, filename, result_key)
+                    print(f"File at invocation is {staged_file}")
+                    queue_qikprop_job(staged_file, options, checksum)
             return render_template('qikpropservice/upload_data_form.html', form=form,
-                                   hash=checksum,
+                                   hash=result_key,
                                    version=_version)
         except Exception as e:
             save_access(page="homepage", access_type="run", error=str(e))
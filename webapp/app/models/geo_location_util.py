@@ -5,6 +5,7 @@ https://www.maxmind.com
 """
 
 import geoip2.database
+from functools import lru_cache
 from os.path import dirname, join, abspath
 import logging
 
@@ -13,14 +14,25 @@ logger = logging.getLogger(__name__)
 
 _app_path = dirname(dirname(abspath(__file__)))
 _geo_file = "GeoLite2-City.mmdb"
-geoip2_reader = geoip2.database.Reader(join(_app_path, 'data', 'geo',
-                                            'GeoLite2-City_latest', _geo_file))
+
+
+@lru_cache(maxsize=None)
+def geoip2_reader():
+    """GeoIP database, opened on first lookup so importing the models doesn't need it. None if it can't be opened"""
+    try:
+        return geoip2.database.Reader(join(_app_path, 'data', 'geo', 'GeoLite2-City_latest', _geo_file))
+    except (OSError, ValueError):
+        logger.exception('Could not open the GeoIP database, access logs will have no location data')
+        return None
 
 
 def get_geoip2_data(ip_address):
     out = {}
+    reader = geoip2_reader()
+    if reader is None:
+        return out
     try:
-        loc_data = geoip2_reader.city(ip_address)
+        loc_data = reader.city(ip_address)
         out['city'] = loc_data.city.name
         out['country'] = loc_data.country.name
         out['country_code'] = loc_data.country.iso_code
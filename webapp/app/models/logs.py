@@ -1,8 +1,15 @@
+import atexit
 import datetime
+import logging
+import os
+import threading
+
 from ..factory import db
 from flask import request, current_app
 from .geo_location_util import get_geoip2_data
 
+logger = logging.getLogger(__name__)
+
 
 class Log(db.DynamicDocument):   # flexible schema, can have extra attributes
     """
@@ -63,6 +70,72 @@ class Log(db.DynamicDocument):   # flexible schema, can have extra attributes
                + ', date: ' + str(self.date)
 
 
+class AccessLogBuffer:
+    """
+    Access log records held in memory and written to MongoDB in bulk by a background thread, once flush_size of them
+    are in or every flush_interval seconds. GeoIP lookups happen on that thread too, so a slow or unavailable Mongo
+    never holds up a request. Records past max_size are dropped rather than piling up while Mongo is away.
+    """
+
+    def __init__(self, flush_size: int = 100, flush_interval: float = 5, max_size: int = 10000):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self._records = []
+        self._guard = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add(self, record: dict):
+        with self._guard:
+            if len(self._records) >= self.max_size:
+                return
+            self._records.append(record)
+            full = len(self._records) >= self.flush_size
+            # Threads don't survive a fork, each worker process starts its own
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="access-log-writer", daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write out every record held so far"""
+        with self._guard:
+            records, self._records = self._records, []
+        if not records:
+            return
+        # Nothing can be let out, the writer thread would die with it and logging stop for good
+        try:
+            logs = [Log(**get_geoip2_data(record["ip_address"]), **record) for record in records]
+            Log.objects.insert(logs, load_bulk=False)
+        except Exception:
+            logger.exception(f"Could not write {len(records)} access logs, they are dropped")
+
+
+_access_logs = None
+_access_logs_guard = threading.Lock()
+
+
+def _access_log_buffer() -> AccessLogBuffer:
+    """Buffer of this process, made on first use from the app config"""
+    global _access_logs
+    with _access_logs_guard:
+        if _access_logs is None:
+            _access_logs = AccessLogBuffer(flush_size=current_app.config['DB_LOGGING_FLUSH_SIZE'],
+                                           flush_interval=current_app.config['DB_LOGGING_FLUSH_INTERVAL'])
+            atexit.register(_access_logs.flush)
+        return _access_logs
+
+
 def save_access(page, access_type, **kwargs):
 
     if not current_app.config['DB_LOGGING']:
@@ -86,16 +159,12 @@ def save_access(page, access_type, **kwargs):
     if user_agent is not None and len(user_agent) > 512:
         user_agent = user_agent[:512]
 
-    # extra geo data
-    extra = get_geoip2_data(ip_address)
-
-    log = Log(page=page,
-              access_type=access_type,
-              ip_address=ip_address,
-              user_agent=user_agent,
-              header_email=header_email,
-              referrer=referrer,
-              **extra,
-              **kwargs)
-
-    log.save()
+    # Only what's needed from the request is taken here, the GeoIP lookup and the write happen off the request
+    _access_log_buffer().add(dict(page=page,
+                                  access_type=access_type,
+                                  date=datetime.datetime.utcnow(),
+                                  ip_address=ip_address,
+                                  user_agent=user_agent,
+                                  header_email=header_email,
+                                  referrer=referrer,
+                                  **kwargs))
@@ -1,58 +1,129 @@
+import atexit
 import datetime
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
 from ..factory import db
 from flask import request, current_app
 from flask_mongoengine import DoesNotExist
+from mongoengine import NotUniqueError
 
 DEFAULT_TRACKING_NAME = "LiveDefault"
 
+logger = logging.getLogger(__name__)
+
 
 class TimeGuess(db.DynamicDocument):   # flexible schema, can have extra attributes
     """
-    Stores average time per computation
+    Stores the time computations took, as running totals which are only ever incremented so concurrent workers can
+    add to them atomically. Averages are worked out from the totals
 
 
     Attributes
     ----------
-    time_per_kb: float
-        time per kilobyte the operation took
-
     total_ops: int
         total number of operations
 
+    total_seconds: float
+        total time the operations took
+
+    total_kb: float
+        total size of the files of the operations
+
+    total_molecule_ops: int
+        total number of operations whose molecules could be counted
+
+    total_molecule_seconds: float
+        total time the operations whose molecules could be counted took
+
+    total_molecules: int
+        total number of molecules of those operations
+
     """
 
-    time_per_kb = db.FloatField()
-    total_ops = db.IntField()
     tracking_name = db.StringField()
+    total_ops = db.IntField(default=0)
+    total_seconds = db.FloatField(default=0)
+    total_kb = db.FloatField(default=0)
+    total_molecule_ops = db.IntField(default=0)
+    total_molecule_seconds = db.FloatField(default=0)
+    total_molecules = db.IntField(default=0)
 
     meta = {
         'strict': True,     # allow extra fields
         'indexes': [
-            "tracking_name",
+            # Unique so concurrent upserts of a new tracking name can't make two documents
+            {"fields": ["tracking_name"], "unique": True},
         ]
     }
 
     def __str__(self):
         return 'Tracking Name: ' + str(self.tracking_name) \
                + ', Time Per kB (s): ' + str(self.time_per_kb) \
+               + ', Time Per Molecule (s): ' + str(self.seconds_per_molecule) \
                + ', Total Number of measurements: ' + str(self.total_ops)
 
+    @property
+    def time_per_kb(self) -> Optional[float]:
+        return self.total_seconds / self.total_kb if self.total_kb else None
+
+    @property
+    def seconds_per_job(self) -> Optional[float]:
+        return self.total_seconds / self.total_ops if self.total_ops else None
+
+    @property
+    def seconds_per_molecule(self) -> Optional[float]:
+        return self.total_molecule_seconds / self.total_molecules if self.total_molecules else None
+
+    def estimate(self, filesize_kb: Optional[float] = None, molecules: Optional[int] = None) -> Optional[float]:
+        """Seconds an operation is expected to take, per molecule if they are known else per kB. None if no data"""
+        if molecules and self.seconds_per_molecule is not None:
+            return molecules * self.seconds_per_molecule
+        if filesize_kb is not None and self.time_per_kb is not None:
+            return filesize_kb * self.time_per_kb
+        return None
+
 
-def check_time_data(tracking_name=DEFAULT_TRACKING_NAME):
+def option_set_tracking_name(run_options: dict) -> str:
+    """Tracking name of the measurements of one set of (normalized) QikProp options, since fast runs cost less"""
+    return DEFAULT_TRACKING_NAME + ":" + ",".join(f"{key}={value}" for key, value in sorted(run_options.items()))
+
+
+def check_time_data(tracking_name=DEFAULT_TRACKING_NAME) -> TimeGuess:
+    """Measurements of a tracking name, an empty unsaved TimeGuess if there are none yet. Read only"""
 
     # Check if document exists
     try:
-        time_data = db.timeguess.objects.get(tracking_name=tracking_name)
+        time_data = TimeGuess.objects.get(tracking_name=tracking_name)
     except DoesNotExist:
-        time_data = {"tracking_name": tracking_name,
-                     "total_ops": 1,
-                     "time_per_kb": 0
-                     }
+        time_data = TimeGuess(tracking_name=tracking_name)
 
     return time_data
 
 
-def update_estimate(operation_time, filesize_kb, tracking_name=DEFAULT_TRACKING_NAME):
+def _measurement(operation_time, filesize_kb, molecules=None) -> dict:
+    """Totals of one operation, in the same fields as TimeGuess"""
+    totals = {"total_ops": 1, "total_seconds": operation_time, "total_kb": filesize_kb,
+              "total_molecule_ops": 0, "total_molecule_seconds": 0.0, "total_molecules": 0}
+    if molecules:
+        totals.update(total_molecule_ops=1, total_molecule_seconds=operation_time, total_molecules=molecules)
+    return totals
+
+
+def _increment(tracking_name: str, totals: dict):
+    """Add totals to the document of a tracking name in one atomic $inc, making the document if it's new"""
+    increments = {f"inc__{field}": value for field, value in totals.items()}
+    try:
+        TimeGuess.objects(tracking_name=tracking_name).update_one(upsert=True, **increments)
+    except NotUniqueError:
+        # Another worker made the document between our match and insert, it's there to increment now
+        TimeGuess.objects(tracking_name=tracking_name).update_one(upsert=True, **increments)
+
+
+def update_estimate(operation_time, filesize_kb, tracking_name=DEFAULT_TRACKING_NAME, molecules=None):
     """
 
     operation_time: int/float
@@ -60,17 +131,72 @@ def update_estimate(operation_time, filesize_kb, tracking_name=DEFAULT_TRACKING_
     filesize_kb: float
         Size of file in kb
     tracking_name: str, default is whatever DEFAULT_TRACKING_NAME is set to in time_guess.py
+    molecules: int, optional
+        Number of molecules in the file, if they could be counted
     """
+    _increment(tracking_name, _measurement(operation_time, filesize_kb, molecules))
 
-    time_data = check_time_data(tracking_name=tracking_name)
-    time_per_kb = time_data["time_per_kb"]
-    total_ops = time_data["total_ops"]
-
-    new_average = ((time_per_kb * total_ops) + (operation_time/filesize_kb)) / (total_ops + 1)
-
-    time_data["time_per_kb"] = new_average
-    time_data["total_ops"] += 1
 
-    time_guess = TimeGuess(**time_data)
+class RuntimeAccumulator:
+    """
+    Totals of operations kept in the worker and written out as one $inc per tracking name once flush_size operations
+    are in or flush_interval seconds have gone by, so busy workers don't go to Mongo on every job. A background thread
+    flushes on the interval, so the totals of an idle worker still go out. Safe to share between threads, totals which
+    could not be written are kept for the next flush.
+    """
 
-    time_guess.save()
+    def __init__(self, flush_interval: float = 60, flush_size: int = 100):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._pending = {}
+        self._count = 0
+        self._flushed = time.monotonic()
+        self._guard = threading.Lock()
+        self._pid = None
+
+    def add(self, operation_time, filesize_kb, tracking_name=DEFAULT_TRACKING_NAME, molecules=None):
+        """Take in an operation, same arguments as update_estimate, flushing if it's time to"""
+        with self._guard:
+            self._merge(tracking_name, _measurement(operation_time, filesize_kb, molecules))
+            self._count += 1
+            due = self._count >= self.flush_size or time.monotonic() - self._flushed >= self.flush_interval
+            # Started in the process doing the adding, a forked pool process needs a flusher of its own
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name="runtime-flusher", daemon=True).start()
+        if due:
+            self.flush()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                with self._guard:
+                    due = self._pending and time.monotonic() - self._flushed >= self.flush_interval
+                if due:
+                    self.flush()
+            except Exception:
+                logger.exception("Could not flush the runtimes, trying again on the next interval")
+
+    def _merge(self, tracking_name: str, totals: dict):
+        pending = self._pending.setdefault(tracking_name, dict.fromkeys(totals, 0))
+        for field, value in totals.items():
+            pending[field] += value
+
+    def flush(self):
+        """Write out everything taken in so far"""
+        with self._guard:
+            pending, self._pending = self._pending, {}
+            self._count = 0
+            self._flushed = time.monotonic()
+        for tracking_name, totals in pending.items():
+            try:
+                _increment(tracking_name, totals)
+            except Exception:
+                logger.exception(f"Could not write the runtimes of {tracking_name}, keeping them for the next flush")
+                with self._guard:
+                    self._merge(tracking_name, totals)
+
+
+runtime_accumulator = RuntimeAccumulator()
+atexit.register(runtime_accumulator.flush)
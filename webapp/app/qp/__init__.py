@@ -1 +1,2 @@
-from .runqp import run_qikprop, OptionMap
+from .runqp import run_qikprop, OptionMap, get_scratch_pool, QP_OUTPUT_CODEC
+from .shard import count_molecules
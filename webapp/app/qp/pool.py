@@ -0,0 +1,146 @@
+"""
+Pool of pre-warmed scratch directories for running xQPROP in.
+
+Each directory keeps a QPlimits file rendered for the option set it last ran with, so back to back jobs with the
+same options only have to drop their input file in and run. Directories are emptied of everything else between jobs.
+"""
+
+import atexit
+from contextlib import contextmanager
+from functools import lru_cache
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+
+LIMITS_FILE = "QPlimits"
+
+
+@lru_cache(maxsize=None)
+def _limits_template(qp_dir: str) -> str:
+    with open(os.path.join(qp_dir, 'QPlimits_mod'), 'r') as limits_skel:
+        return limits_skel.read()
+
+
+@lru_cache(maxsize=64)
+def _render_limits(qp_dir: str, option_items: tuple) -> str:
+    """Render the QPlimits file for a set of run options, template reads and renders are cached"""
+    return _limits_template(qp_dir).format(**dict(option_items))
+
+
+class _ScratchDirectory:
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.option_items = None  # Options the QPlimits in here was rendered with
+
+    def prepare(self, qp_dir: str, option_items: tuple) -> bool:
+        """Get the directory ready for a job, returns True if the existing limits file could be reused"""
+        if option_items == self.option_items:
+            return True
+        with open(self.path / LIMITS_FILE, 'w') as limits_output:
+            limits_output.write(_render_limits(qp_dir, option_items))
+        self.option_items = option_items
+        return False
+
+    def clear(self):
+        """Remove everything from the last job but the limits file"""
+        for entry in self.path.iterdir():
+            if entry.name == LIMITS_FILE:
+                continue
+            if entry.is_dir() and not entry.is_symlink():
+                shutil.rmtree(entry)
+            else:
+                entry.unlink()
+
+
+class QikpropScratchPool:
+    """
+    Thread safe pool of scratch directories, up to max_size of them are created on demand and jobs wait for a free
+    one after that.
+
+    Parameters
+    ----------
+    qp_dir : str
+        QikProp install directory holding the QPlimits_mod template
+    max_size : int
+        Most scratch directories (and so concurrent jobs) the pool hands out
+    root : str, Optional
+        Directory to make the scratch directories in, system temp space if not set
+    """
+
+    def __init__(self, qp_dir: str, max_size: int, root: str = None):
+        self.qp_dir = qp_dir
+        self.max_size = max_size
+        self._root = pathlib.Path(tempfile.mkdtemp(prefix="qikprop_pool_", dir=root))
+        self._idle = []
+        self._size = 0
+        self._made = 0  # Names directories, never reused even if one could not be made
+        self._jobs = 0
+        self._reused = 0
+        self._condition = threading.Condition()
+        atexit.register(self.close)
+
+    def _take(self, option_items: tuple) -> _ScratchDirectory:
+        with self._condition:
+            while not self._idle and self._size >= self.max_size:
+                self._condition.wait()
+            if self._idle:
+                # Prefer a directory already rendered for these options
+                for index, scratch in enumerate(self._idle):
+                    if scratch.option_items == option_items:
+                        return self._idle.pop(index)
+                return self._idle.pop()
+            self._size += 1
+            self._made += 1
+            path = self._root / f"scratch_{self._made}"
+        try:
+            path.mkdir()
+        except BaseException:
+            # Give the slot back, or the pool stays a directory short and waiters could block for good
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        return _ScratchDirectory(path)
+
+    def _give_back(self, scratch: _ScratchDirectory):
+        with self._condition:
+            self._idle.append(scratch)
+            self._condition.notify()
+
+    @contextmanager
+    def scratch(self, run_options: dict):
+        """Check out a scratch directory with QPlimits rendered for run_options, yields its path"""
+        option_items = tuple(sorted(run_options.items()))
+        scratch = self._take(option_items)
+        try:
+            reused = scratch.prepare(self.qp_dir, option_items)
+            with self._condition:
+                self._jobs += 1
+                self._reused += reused
+            yield scratch.path
+        except BaseException:
+            # Don't trust the state of a directory a job blew up in
+            scratch.option_items = None
+            raise
+        finally:
+            try:
+                scratch.clear()
+            finally:
+                self._give_back(scratch)
+
+    def stats(self) -> dict:
+        """Size and utilization of the pool"""
+        with self._condition:
+            idle = len(self._idle)
+            return {"max_size": self.max_size,
+                    "size": self._size,
+                    "in_use": self._size - idle,
+                    "idle": idle,
+                    "utilization": (self._size - idle) / self.max_size,
+                    "jobs": self._jobs,
+                    "limits_reused": self._reused}
+
+    def close(self):
+        shutil.rmtree(self._root, ignore_errors=True)
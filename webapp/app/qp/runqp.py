@@ -1,22 +1,41 @@
 import subprocess as sp
-from tempfile import TemporaryDirectory
 import os
 import shutil
 import pathlib
-import contextlib
-import tarfile
 import hashlib
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
 
-from contextlib import contextmanager
+import threading
 import time
 
-from ..constants import QP_OUTPUT_TAR_NAME
+from ..compression import write_archive, check_codec
+from .pool import QikpropScratchPool
+from .shard import is_shardable, shard_molecule_file, merge_outputs
 
 hasher = hashlib
 
 script_dir = pathlib.Path(__file__).parent.resolve()
 
+qp_dir = os.path.join(script_dir, 'QikProp')
+
+# Number of scratch directories kept warm per worker process, one per concurrent job
+QP_POOL_SIZE = int(os.environ.get("QP_POOL_SIZE", os.cpu_count() or 1))
+# Molecules per xQPROP process for multi-molecule inputs, 0 runs every file as a single process
+QP_SHARD_SIZE = int(os.environ.get("QP_SHARD_SIZE", 500))
+# Most shards of one file run at the same time
+QP_SHARD_WORKERS = int(os.environ.get("QP_SHARD_WORKERS", QP_POOL_SIZE))
+
+# Compression of the output tarballs, "gzip", "zstd" or "none", and its level (codec default if not set)
+QP_OUTPUT_CODEC = os.environ.get("QP_OUTPUT_CODEC", "gzip")
+QP_OUTPUT_LEVEL = int(os.environ["QP_OUTPUT_LEVEL"]) if os.environ.get("QP_OUTPUT_LEVEL") else None
+check_codec(QP_OUTPUT_CODEC)
+# Seconds between reads of the QP.CSV of a running xQPROP when following its progress
+QP_TAIL_INTERVAL = 1.0
+
+QP_OUTPUT_FILES = ["QPSA.out", "QP.out", "QP.CSV", "QPwarning", "QPlog", "stderr", "stdout"]
+
 default_qp_options = {
     "proc_mode": "normal",
     "nmol": 20
@@ -114,67 +133,141 @@ class OptionMap:
         return self._options
 
 
-@contextlib.contextmanager
-def temp_set_environ(variable, value):
-    existing = os.environ.get(variable, None)
-    os.environ[variable] = value
-    yield
-    if existing is None:
-        del os.environ[variable]
-    else:
-        os.environ[variable] = existing
-
-
-@contextlib.contextmanager
-def temp_cd(*args, **kwargs):
-    pwd = pathlib.Path().resolve()
-    with TemporaryDirectory(*args, **kwargs) as tmp_dir:
-        os.chdir(tmp_dir)
-        yield
-    os.chdir(pwd)
-
-
-def run_qikprop(datafile, filename, options):
-    # Find the qikprop dir
-    qp_dir = os.path.join(script_dir, 'QikProp')
+_scratch_pool = None
+_scratch_pool_lock = threading.Lock()
+
+
+def get_scratch_pool() -> QikpropScratchPool:
+    """Scratch directory pool of this process, made on first use so it is not shared across forked workers"""
+    global _scratch_pool
+    with _scratch_pool_lock:
+        if _scratch_pool is None:
+            _scratch_pool = QikpropScratchPool(qp_dir, QP_POOL_SIZE)
+        return _scratch_pool
+
+
+def _qikprop_environ() -> dict:
+    """Environment for the xQPROP subprocess, a copy so the worker's own environment is never touched"""
+    env = os.environ.copy()
+    env["QPdir"] = qp_dir
+    return env
+
+
+def _tail(proc: sp.Popen, path: pathlib.Path, line_callback):
+    """Hand each complete line written to path to line_callback until proc exits, path need not exist yet"""
+    followed = None
+    partial = b""
+    try:
+        while True:
+            running = proc.poll() is None
+            if followed is None and path.exists():
+                followed = open(path, 'rb')
+            if followed is not None:
+                partial += followed.read()
+                *lines, partial = partial.split(b"\n")
+                for line in lines:
+                    line_callback(line.decode(errors="replace"))
+            if not running:
+                break
+            time.sleep(QP_TAIL_INTERVAL)
+    finally:
+        if followed is not None:
+            followed.close()
+    if partial:
+        line_callback(partial.decode(errors="replace"))
+
+
+def _csv_rows(row_callback):
+    """
+    Line callback for a QP.CSV being written which passes on its rows but not the header line.
+    QikProp starts a new QP.CSV with the header and appends one row per molecule as it is done
+    """
+    header = True
+
+    def on_line(line: str):
+        nonlocal header
+        if header:
+            header = False
+        elif line.strip():
+            row_callback(line)
+    return on_line
+
+
+def _run_xqprop(scratch_dir: pathlib.Path, datafile, filename, progress_callback=None):
+    """
+    Run xQPROP on a single data file in a scratch directory, the outputs are left in there.
+    Its stdout and stderr go straight to files, progress_callback is handed each QP.CSV row as it is written.
+    """
+    # Move the data file into the scratch dir here
+    # Have to use shutil.move for possible different file system mounts else raises "Invalid cross-device link"
+    # Move handles other filesystems as of Py 3.3
+    shutil.move(datafile, scratch_dir / filename)
+    # Run qikprop
+    xqp = os.path.join(qp_dir, 'xQPROP')
+    qp_commands = [xqp, filename]
+    with open(scratch_dir / 'stdout', 'wb') as stdout, open(scratch_dir / 'stderr', 'wb') as stderr:
+        proc = sp.Popen(qp_commands, stdout=stdout, stderr=stderr, cwd=scratch_dir, env=_qikprop_environ())
+        try:
+            if progress_callback is not None:
+                _tail(proc, scratch_dir / 'QP.CSV', _csv_rows(progress_callback))
+        finally:
+            proc.wait()
+
+
+def _run_shard(shard: pathlib.Path, run_options: dict, output_dir: pathlib.Path,
+               progress_callback=None) -> pathlib.Path:
+    """Run one shard in its own scratch directory and keep its outputs in output_dir"""
+    with get_scratch_pool().scratch(run_options) as scratch_dir:
+        _run_xqprop(scratch_dir, shard, shard.name, progress_callback=progress_callback)
+        output_dir.mkdir(parents=True)
+        for out_data in QP_OUTPUT_FILES:
+            if (scratch_dir / out_data).exists():
+                shutil.move(str(scratch_dir / out_data), str(output_dir / out_data))
+    return output_dir
+
+
+def _package_outputs(source_dir: pathlib.Path, output_path: pathlib.Path) -> pathlib.Path:
+    """Tarball the outputs in source_dir straight to output_path with the configured compression"""
+    return write_archive(source_dir, QP_OUTPUT_FILES, output_path, QP_OUTPUT_CODEC, QP_OUTPUT_LEVEL)
+
+
+def _run_sharded(datafile, filename, run_options, output_path, progress_callback=None):
+    """
+    Split multi-molecule files and run the shards in parallel, merging their outputs in input order.
+    Returns None if the file is not worth splitting.
+    """
+    if QP_SHARD_SIZE <= 0 or not is_shardable(filename):
+        return None
+    with TemporaryDirectory() as work_dir:
+        work_dir = pathlib.Path(work_dir)
+        shards = shard_molecule_file(datafile, filename, work_dir / "shards", QP_SHARD_SIZE)
+        if shards is None:
+            return None
+        with ThreadPoolExecutor(max_workers=QP_SHARD_WORKERS) as executor:
+            output_dirs = list(executor.map(
+                lambda shard: _run_shard(shard, run_options, work_dir / "outputs" / shard.stem, progress_callback),
+                shards
+            ))
+        merge_outputs(output_dirs, work_dir / "merged", QP_OUTPUT_FILES)
+        return _package_outputs(work_dir / "merged", output_path)
+
+
+def run_qikprop(datafile, filename, options, output_path, progress_callback=None):
+    """
+    Run QikProp on a data file and tarball its outputs to output_path, which is returned.
+
+    progress_callback, if given, is called with every row xQPROP appends to QP.CSV while it runs, one per molecule
+    done. Shards run in parallel threads so it has to be thread safe.
+    """
     # Parse the options
     run_options = OptionMap.generate_options(**options)
 
-    # Create the temporary space
-    with temp_set_environ("QPdir", qp_dir):
-        with temp_cd():
-            # Move the data file into the temp dir here
-            # Have to use shutil.move for possible different file system mounts else raises "Invalid cross-device link"
-            # Move handles other filesystems as of Py 3.3
-            shutil.move(datafile, filename)
-            # Copy the existing QPlimits and apply settings
-            with open(os.path.join(qp_dir, 'QPlimits_mod'), 'r') as limits_skel:
-                limits = limits_skel.read()
-            with open('QPlimits', 'w') as limits_output:
-                limits_output.write(limits.format(**run_options))
-            # Run qikprop
-            xqp = os.path.join(qp_dir, 'xQPROP')
-            qp_commands = [xqp, filename]
-            proc = sp.run(qp_commands, stdout=sp.PIPE, stderr=sp.PIPE)
-            # Write outputs
-            with open('stdout', 'w') as stdout:
-                stdout.write(proc.stdout.decode())
-            with open('stder', 'w') as stderr:
-                stderr.write(proc.stderr.decode())
-            # Make a tarball of the outputs
-            tarball_name = QP_OUTPUT_TAR_NAME
-            with tarfile.open(tarball_name, mode="w:gz") as tarball:
-                for out_data in ["QPSA.out", "QP.out", "QP.CSV", "QPwarning", "QPlog", "stderr", "stdout"]:
-                    try:
-                        tarball.add(out_data)
-                    except:
-                        # Not really caring if the data aren't there
-                        pass
-                tar_hash = str(hash(tarball))[:8]
-            # Copy to the staging directory, add a bit of hash data to avoid overwrite
-            stage_name = tarball_name + '.' + tar_hash
-            stage_path = os.path.join(script_dir, "staging", stage_name)
-            # Attempt to make path
-            pathlib.Path(os.path.join(script_dir, "staging")).mkdir(exist_ok=True)
-            shutil.copyfile(tarball_name, os.path.join(script_dir, "staging", stage_name))
-    return stage_path
+    packaged = _run_sharded(datafile, filename, run_options, output_path, progress_callback=progress_callback)
+    if packaged is not None:
+        return packaged
+
+    # Check out a scratch directory with the QPlimits already rendered for these options
+    # Everything below works on absolute paths in it so concurrent jobs in one process never share a working directory
+    with get_scratch_pool().scratch(run_options) as scratch_dir:
+        _run_xqprop(scratch_dir, datafile, filename, progress_callback=progress_callback)
+        return _package_outputs(scratch_dir, output_path)
@@ -0,0 +1,181 @@
+"""
+Split multi-molecule input files into shards which can be run by separate xQPROP processes, and merge the outputs
+of those runs back together.
+
+Supported are MDL SD files (records end in $$$$), Mol2 files (records start at @<TRIPOS>MOLECULE) and Maestro files
+(f_m_ct blocks, with the file header repeated at the top of every shard). Gzipped versions are read and written
+out as plain shards. Everything else is run as a single file.
+"""
+
+import gzip
+import pathlib
+from typing import Iterator, List, Optional, Union
+
+# Input suffix -> (record format, compressed, suffix of the shards)
+_FORMATS = {
+    "sdf": ("sdf", False, "sdf"),
+    "sd": ("sdf", False, "sd"),
+    "mol": ("sdf", False, "mol"),
+    "sdfgz": ("sdf", True, "sdf"),
+    "sdgz": ("sdf", True, "sd"),
+    "molgz": ("sdf", True, "mol"),
+    "sdf.gz": ("sdf", True, "sdf"),
+    "sd.gz": ("sdf", True, "sd"),
+    "mol2": ("mol2", False, "mol2"),
+    "mae": ("mae", False, "mae"),
+    "maegz": ("mae", True, "mae"),
+    "mae.gz": ("mae", True, "mae"),
+}
+
+
+def _split_suffix(filename: str):
+    """Split a filename in its stem and a suffix known to _FORMATS, (filename, None) if not known"""
+    lowered = filename.lower()
+    for suffix in sorted(_FORMATS, key=len, reverse=True):
+        if lowered.endswith("." + suffix):
+            return filename[:-len(suffix) - 1], suffix
+    return filename, None
+
+
+def _sdf_records(lines: Iterator[bytes]) -> Iterator[bytes]:
+    record = []
+    for line in lines:
+        record.append(line)
+        if line.strip() == b"$$$$":
+            yield b"".join(record)
+            record = []
+    if b"".join(record).strip():
+        yield b"".join(record)
+
+
+def _mol2_records(lines: Iterator[bytes]) -> Iterator[bytes]:
+    record = []
+    has_molecule = False
+    for line in lines:
+        if line.startswith(b"@<TRIPOS>MOLECULE"):
+            if has_molecule:
+                yield b"".join(record)
+                record = []
+            has_molecule = True
+        record.append(line)
+    if has_molecule:
+        yield b"".join(record)
+
+
+def _mae_records(lines: Iterator[bytes]) -> Iterator[bytes]:
+    """Maestro blocks, the first thing yielded is the file header which goes at the top of every shard"""
+    record = []
+    header_done = False
+    for line in lines:
+        # Only unindented blocks are new structures, nested blocks are indented
+        if line.startswith(b"f_m_ct"):
+            yield b"".join(record)
+            record = []
+            header_done = True
+        record.append(line)
+    if not header_done:
+        yield b"".join(record)
+    elif record:
+        yield b"".join(record)
+
+
+_READERS = {
+    "sdf": (_sdf_records, False),
+    "mol2": (_mol2_records, False),
+    "mae": (_mae_records, True),
+}
+
+
+def is_shardable(filename: str) -> bool:
+    return _split_suffix(filename)[1] is not None
+
+
+def _read_records(datafile: pathlib.Path, filename: str):
+    """Header and record iterator of a data file, None if its format can't be split"""
+    stem, suffix = _split_suffix(filename)
+    if suffix is None:
+        return None
+    record_format, compressed, _ = _FORMATS[suffix]
+    reader, has_header = _READERS[record_format]
+    opener = gzip.open if compressed else open
+    handle = opener(datafile, "rb")
+    records = reader(iter(handle.readline, b""))
+    header = next(records, b"") if has_header else b""
+    return handle, header, records
+
+
+def count_molecules(datafile: Union[pathlib.Path, str], filename: str) -> Optional[int]:
+    """Count the molecules in a data file, None if its format is not one which can be split"""
+    read = _read_records(pathlib.Path(datafile), filename)
+    if read is None:
+        return None
+    handle, _, records = read
+    with handle:
+        return sum(1 for _ in records)
+
+
+def shard_molecule_file(datafile: Union[pathlib.Path, str],
+                        filename: str,
+                        directory: Union[pathlib.Path, str],
+                        shard_size: int) -> Optional[List[pathlib.Path]]:
+    """
+    Split a data file into shards of at most shard_size molecules written to directory.
+
+    Returns the shard paths in input order, or None if the file can't be split or fits in a single shard, in which
+    case it should be run as is.
+    """
+    if shard_size <= 0:
+        return None
+    read = _read_records(pathlib.Path(datafile), filename)
+    if read is None:
+        return None
+    handle, header, records = read
+    stem, suffix = _split_suffix(filename)
+    shard_suffix = _FORMATS[suffix][2]
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    shards = []
+    shard = None
+    count = 0
+    with handle:
+        for record in records:
+            if shard is None or count == shard_size:
+                if shard is not None:
+                    shard.close()
+                shard_path = directory / f"{stem}_{len(shards) + 1:04d}.{shard_suffix}"
+                shards.append(shard_path)
+                shard = shard_path.open("wb")
+                shard.write(header)
+                count = 0
+            shard.write(record)
+            count += 1
+    if shard is not None:
+        shard.close()
+    if len(shards) <= 1:
+        for shard_path in shards:
+            shard_path.unlink()
+        return None
+    return shards
+
+
+def merge_outputs(shard_directories: List[pathlib.Path], merged_directory: pathlib.Path, output_files: List[str]):
+    """
+    Merge the xQPROP outputs of each shard, in order, into merged_directory. Files are concatenated, except for the
+    QP.CSV header which is only kept from the first shard which has one.
+    """
+    merged_directory.mkdir(parents=True, exist_ok=True)
+    for out_data in output_files:
+        parts = [directory / out_data for directory in shard_directories if (directory / out_data).exists()]
+        if not parts:
+            continue
+        with (merged_directory / out_data).open("wb") as merged:
+            header_written = False
+            for part in parts:
+                with part.open("rb") as source:
+                    if out_data.endswith(".CSV"):
+                        header = source.readline()
+                        if not header_written:
+                            merged.write(header)
+                            header_written = True
+                    for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                        merged.write(chunk)
@@ -0,0 +1,112 @@
+"""
+Columnar store of the QP.CSV descriptors of finished tasks.
+
+The CSV is parsed once when a task completes into a JSON file of one list per column next to the tarball, so
+API clients can pull only the rows and columns they need without downloading and unpacking the full archive.
+"""
+
+import csv
+from functools import lru_cache
+import io
+import json
+import math
+import os
+from pathlib import Path
+import tarfile
+from typing import List, Optional
+import uuid
+
+from app.compression import codec_from_name, open_compressed_reader
+
+QP_CSV_NAME = "QP.CSV"
+
+
+# Molecule names which happen to look like numbers (IDs, "1e5") stay as written
+_TEXT_COLUMNS = {"molecule", "title", "name"}
+
+
+def _finite(value):
+    """NaN and infinities are not valid JSON, stored as missing"""
+    return value if math.isfinite(value) else None
+
+
+def _cast_column(column: str, values: List[str]) -> list:
+    """
+    Store a column as numbers if every value in it is one, so a column doesn't mix types from row to row. QikProp
+    writes an empty field for a missing value
+    """
+    values = [value.strip() for value in values]
+    if column.lower() not in _TEXT_COLUMNS:
+        for cast in (int, float):
+            try:
+                return [_finite(cast(value)) if value != "" else None for value in values]
+            except ValueError:
+                pass
+    return [value if value != "" else None for value in values]
+
+
+def _read_csv_from_archive(archive: Path) -> Optional[str]:
+    with open_compressed_reader(archive, codec_from_name(archive.name)) as raw:
+        with tarfile.open(fileobj=raw, mode="r|") as tar:
+            for member in tar:
+                if member.name == QP_CSV_NAME:
+                    return tar.extractfile(member).read().decode(errors="replace")
+    return None
+
+
+def write_result_table(archive: Path, table_path: Path) -> Optional[Path]:
+    """
+    Parse the QP.CSV of an output tarball into a columnar table at table_path, written under a temporary name and
+    renamed into place. Returns None if the tarball has no QP.CSV.
+    """
+    text = _read_csv_from_archive(archive)
+    if text is None:
+        return None
+    reader = csv.reader(io.StringIO(text))
+    columns = [column.strip() for column in next(reader, [])]
+    data = {column: [] for column in columns}
+    rows = 0
+    for row in reader:
+        if not row:
+            continue
+        for column, value in zip(columns, row + [""] * (len(columns) - len(row))):
+            data[column].append(value)
+        rows += 1
+    data = {column: _cast_column(column, values) for column, values in data.items()}
+    temp_path = table_path.with_name(f".{table_path.name}.{uuid.uuid4().hex}.tmp")
+    with temp_path.open("w") as f:
+        json.dump({"columns": columns, "rows": rows, "data": data}, f, separators=(",", ":"))
+    os.replace(temp_path, table_path)
+    return table_path
+
+
+@lru_cache(maxsize=4)
+def _load_table(table_path: str, version: tuple) -> dict:
+    # Keyed on the version of the file too, a cleared and rerun task writes a new table at the same path
+    with open(table_path, "r") as f:
+        return json.load(f)
+
+
+def read_result_table(table_path: Path, columns: Optional[List[str]] = None, offset: int = 0,
+                      limit: Optional[int] = None) -> dict:
+    """
+    Slice of a result table, rows [offset, offset + limit) of the requested columns (all of them if not set).
+
+    Raises
+    ------
+    KeyError
+        If any of the requested columns are not in the table
+    """
+    stat = os.stat(table_path)
+    table = _load_table(str(table_path), (stat.st_ino, stat.st_mtime_ns, stat.st_size))
+    if columns is None:
+        columns = table["columns"]
+    missing = [column for column in columns if column not in table["data"]]
+    if missing:
+        raise KeyError(f"Columns {missing} are not in the results, available columns are {table['columns']}")
+    stop = table["rows"] if limit is None else min(offset + limit, table["rows"])
+    return {"columns": columns,
+            "data": {column: table["data"][column][offset:stop] for column in columns},
+            "total": table["rows"],
+            "offset": offset,
+            "next_offset": stop if stop < table["rows"] else None}
@@ -1,18 +1,48 @@
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
 from pathlib import Path
 from shutil import rmtree, move
 from tempfile import TemporaryDirectory
 import traceback
-from typing import Union
+from typing import List, Optional, Tuple, Union
 
+from flask import current_app
 from flask_restful import abort
+import requests
+from celery.signals import worker_process_shutdown, worker_shutdown
 from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
 
-from app.hashing import write_file_and_checksum_from_stream, hash_method
+from app.hashing import write_file_and_checksum_from_stream, hash_method, generate_checksum_options
 from app import celery
-from app.constants import QP_OUTPUT_TAR_NAME, INBOUND_PATH, SERVE_PATH
-from app.qp import run_qikprop
+from app.factory import task_events, job_states
+from app.jobstate import JobStates
+from app.eta import estimate_eta
+from app.models.time_guess import runtime_accumulator, option_set_tracking_name
+from app.constants import (QP_OUTPUT_TAR_NAME, QP_ERROR_FILE_NAME, QP_MANIFEST_NAME, QP_CLAIM_NAME,
+                           QP_CLAIM_TIMEOUT, QP_TABLE_NAME, INBOUND_PATH, SERVE_PATH)
+from app.qp import run_qikprop, OptionMap, get_scratch_pool, count_molecules, QP_OUTPUT_CODEC
+from app.compression import archive_name, codec_from_name, check_codec, transcode_archive
+from app.results import write_result_table, read_result_table
+from app.callbacks import register_callback, read_callbacks, sign_payload, post_callback
+from app.uploads import UPLOAD_DATA_NAME, open_upload, checksum_upload, sweep_uploads
 from app.data_models import StatusCodes, StatusGETReturn, GETPOSTError, QikpropPOSTResponse
 
+logger = logging.getLogger(__name__)
+
+UPLOADS_DIRECTORY = "uploads"
+API_FILE_NAME = "api_file.file"  # Staged name of files sent without a usable name
+# Most often the molecules done of a running job are written to the job state store, in seconds
+PROGRESS_INTERVAL = 5.0
+# Callback deliveries and their retries go on their own queue so the default one only holds QikProp jobs
+CALLBACK_QUEUE = "callbacks"
+_UPLOAD_ID = re.compile(r"[0-9a-f]+-[0-9a-f]+")
+
 
 def _generate_dir_and_file_paths(directory, checksum, filename):
     target_dir = Path(directory, f"{checksum}").resolve()
@@ -20,38 +50,268 @@ def _generate_dir_and_file_paths(directory, checksum, filename):
     return target_dir, target_file
 
 
+def generate_result_key(checksum: str, options: dict) -> str:
+    """
+    Key of the result cache for a file and its options, used as the relative directory under the inbound and serve
+    paths. The options are normalized through the OptionMap first so equivalent option sets share one entry while
+    different option sets for the same file never overwrite each other.
+    """
+    options_checksum = generate_checksum_options(OptionMap.generate_options(**options))
+    return f"{checksum}/{options_checksum}"
+
+
+def read_manifest(serve_directory: Path) -> Optional[dict]:
+    """Read the completion manifest of a result directory, None if the result is not complete"""
+    try:
+        with Path(serve_directory, QP_MANIFEST_NAME).open("r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(serve_directory: Path, manifest: dict):
+    """Write the completion manifest under a temporary name and rename it so readers never see a partial one"""
+    manifest_path = Path(serve_directory, QP_MANIFEST_NAME)
+    temp_path = manifest_path.with_name(f".{QP_MANIFEST_NAME}.{os.getpid()}.tmp")
+    with temp_path.open("w") as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, manifest_path)
+
+
+def _claim_result(serve_directory: Path) -> bool:
+    """
+    Take the exclusive claim on a result directory. Only one worker can hold it at a time so repeated or
+    concurrent tasks for the same result collapse into a single xQPROP run. Claims older than QP_CLAIM_TIMEOUT are
+    assumed to belong to a dead worker and are taken over.
+    """
+    claim = Path(serve_directory, QP_CLAIM_NAME)
+    for _ in range(2):
+        try:
+            fd = os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - claim.stat().st_mtime < QP_CLAIM_TIMEOUT:
+                    return False
+                claim.unlink()
+            except FileNotFoundError:
+                pass  # Released between the open and the stat, try again
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{socket.gethostname()}:{os.getpid()}")
+        return True
+    return False
+
+
+def _release_claim(serve_directory: Path):
+    try:
+        Path(serve_directory, QP_CLAIM_NAME).unlink()
+    except FileNotFoundError:
+        pass
+
+
 @celery.task()
 def run_qikprop_worker(datafile: Union[Path, str], options: dict, checksum: str):
     datafile = Path(datafile)  # Cast to Path
-    serve_directory, serve_file_path = _generate_dir_and_file_paths(SERVE_PATH, checksum, QP_OUTPUT_TAR_NAME)
-    # Don't double up the work
-    # Check does not work right now since tarballs are named QP_OUTPUT_TAR_NAME.{tarball hash}
-    #     Leaving here until improvements can be made
-    if serve_file_path.exists():
+    result_key = generate_result_key(checksum, options)
+    serve_directory, serve_file_path = _generate_dir_and_file_paths(SERVE_PATH, result_key,
+                                                                    archive_name(QP_OUTPUT_CODEC))
+    # Don't double up the work, either its already done or another worker has it
+    manifest = read_manifest(serve_directory)
+    if manifest is not None:
+        _record_completion(result_key, manifest, serve_directory)  # In case the state was lost or queued again
         return
-
     serve_directory.mkdir(parents=True, exist_ok=True)
+    if not _claim_result(serve_directory):
+        return
     try:
-        output_file = run_qikprop(datafile, datafile.name, options)
-        output_file_path = Path(output_file)
-        # Setup new location - Make the checksum directory
+        # Another worker may have finished and let go of the claim between the check above and taking it
+        manifest = read_manifest(serve_directory)
+        if manifest is not None:
+            _record_completion(result_key, manifest, serve_directory)
+            return
+        manifest = _run_claimed(datafile, options, checksum, result_key, serve_directory, serve_file_path)
+    finally:
+        _release_claim(serve_directory)
+    _record_completion(result_key, manifest, serve_directory)
+    try:
+        task_events.publish(result_key)
+    except Exception:
+        # Long polls still see the result on their next check, just not right away
+        logger.exception(f"Could not publish the completion of {result_key}")
+    _queue_callbacks(serve_directory, manifest, checksum, options)
+    return
+
 
-        # Move the file with shutil. Path.rename causes issues cross filesystem
-        move(output_file_path, serve_file_path)
+def _run_claimed(datafile: Path, options: dict, checksum: str, result_key: str, serve_directory: Path,
+                 serve_file_path: Path) -> dict:
+    """Run a job whose result this worker holds the claim on and write its manifest, which is returned"""
+    manifest = {"id": checksum, "options": OptionMap.generate_options(**options)}
+    try:
+        # None for formats which can't be split, progress is then only the molecules done so far
+        total = count_molecules(datafile, datafile.name)
+        size_kb = datafile.stat().st_size / 1024
+        _record_state(result_key, JobStates.RUNNING, host=socket.gethostname(), molecules_done=0,
+                      molecules_total=total, size_kb=size_kb)
+        started = time.monotonic()
+        # Tarball is written straight to where it is served from
+        run_qikprop(datafile, datafile.name, options, serve_file_path,
+                    progress_callback=_JobProgress(result_key, total))
+        _record_runtime(options, time.monotonic() - started, size_kb, total)
+        manifest.update(status="complete", file=serve_file_path.name)
+        # Parse the descriptors once now so they can be served without the tarball
+        try:
+            if write_result_table(serve_file_path, serve_directory / QP_TABLE_NAME) is not None:
+                manifest["table"] = QP_TABLE_NAME
+        except Exception:
+            logger.exception(f"Could not build the results table of {result_key}, only the tarball is served")
         # Cleanup inbound staging directory
         str_path = str(datafile)
         if str(INBOUND_PATH) in str_path and checksum in str_path:
             rmtree(datafile.parent)
     except Exception:
-        e = serve_directory / "ErrorDetails.txt"
+        e = serve_directory / QP_ERROR_FILE_NAME
         with e.open("w") as f:
             f.write(traceback.format_exc())
-    return
+        manifest.update(status="error", file=e.name)
+    manifest["completed"] = time.time()
+    # Results only become visible once the manifest is written
+    _write_manifest(serve_directory, manifest)
+    return manifest
+
+
+def _record_state(result_key: str, state: str, **fields):
+    try:
+        job_states.mark(result_key, state, **fields)
+    except Exception:
+        # Status lookups fall back on the directories for keys the store doesn't know, and stale states get fixed on
+        # the next run of the key, so this isn't worth failing the job over
+        logger.exception(f"Could not record {result_key} as {state}")
+
+
+class _JobProgress:
+    """
+    Progress callback of a running job, counts the QP.CSV rows of the molecules xQPROP has done and writes the count to
+    the job state store at most every PROGRESS_INTERVAL seconds. Shards call it from their own threads
+    """
+
+    def __init__(self, result_key: str, total: Optional[int]):
+        self.result_key = result_key
+        self.total = total
+        self.done = 0
+        self._written = time.monotonic()
+        self._guard = threading.Lock()
+
+    def __call__(self, row: str):
+        with self._guard:
+            self.done += 1
+            if self.total is not None:
+                self.done = min(self.done, self.total)
+            now = time.monotonic()
+            if now - self._written < PROGRESS_INTERVAL:
+                return
+            self._written = now
+            done = self.done
+        try:
+            job_states.update(self.result_key, molecules_done=done)
+        except Exception:
+            logger.exception(f"Could not record the progress of {self.result_key}")
+
+
+def _record_completion(result_key: str, manifest: dict, serve_directory: Path):
+    """Record a finished job in the job state store from its manifest, errors along with their details"""
+    fields = {"result": f"{result_key}/{manifest['file']}"}
+    if manifest.get("status") == "error":
+        with Path(serve_directory, manifest["file"]).open("r") as f:
+            fields["error"] = f.read()
+        _record_state(result_key, JobStates.ERROR, **fields)
+    else:
+        _record_state(result_key, JobStates.DONE, **fields)
+
+
+def _record_runtime(options: dict, seconds: float, size_kb: float, molecules: Optional[int]):
+    """
+    Add a finished run to the cost model of its option set, which the ETAs of later jobs come from. Runs are totalled
+    in the worker and written out in batches
+    """
+    try:
+        runtime_accumulator.add(seconds, size_kb,
+                                tracking_name=option_set_tracking_name(OptionMap.generate_options(**options)),
+                                molecules=molecules)
+    except Exception:
+        logger.exception("Could not record the runtime of a QikProp job")
+
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def _flush_runtimes(**kwargs):
+    """
+    Write out the runtimes still totalled in a worker as it goes. worker_shutdown covers the threads pool, which runs
+    jobs in the main worker process, worker_process_shutdown the child processes of prefork, which skip atexit
+    """
+    try:
+        runtime_accumulator.flush()
+    except Exception:
+        logger.exception("Could not write out the runtimes of QikProp jobs")
+
+
+def queue_qikprop_job(staged_file: Path, options: dict, checksum: str):
+    """Queue the QikProp job of a staged file and record it as queued"""
+    _record_state(generate_result_key(checksum, options), JobStates.QUEUED,
+                  size_kb=Path(staged_file).stat().st_size / 1024)
+    run_qikprop_worker.delay(str(staged_file), options, checksum)
 
 
-def prepare_inbound_staging(filename: str, checksum: str) -> Path:
+def _callback_payload(serve_directory: Path, manifest: dict, checksum: str, options: dict) -> dict:
+    possible_tarball = serve_directory / manifest["file"]
+    code = response_code_from_tarball(possible_tarball, checksum)
+    return generate_status(code, possible_tarball, checksum, options).dict()
+
+
+def _queue_callbacks(serve_directory: Path, manifest: dict, checksum: str, options: dict, urls: List[str] = None):
+    """Queue delivery of the completion payload to the callbacks of a result, all registered ones if urls not set"""
+    urls = read_callbacks(serve_directory) if urls is None else urls
+    if not urls:
+        return
+    payload = _callback_payload(serve_directory, manifest, checksum, options)
+    for url in urls:
+        deliver_callback.delay(url, payload)
+
+
+@celery.task(bind=True, queue=CALLBACK_QUEUE, autoretry_for=(requests.RequestException,), retry_backoff=True,
+             retry_backoff_max=600, retry_jitter=True, max_retries=8)
+def deliver_callback(self, url: str, payload: dict):
+    """
+    POST a completion payload to a callback URL, retried with exponential backoff on connection and server errors.
+    The URL is checked again first, since what its host resolves to could have changed since it was registered
+    """
+    body = json.dumps(payload).encode()
+    headers = {"Content-Type": "application/json", **sign_payload(body, current_app.config.get("CALLBACK_SECRET"))}
+    try:
+        r = post_callback(url, body, headers, current_app.config.get("CALLBACK_ALLOWLIST", ()))
+    except ValueError as e:
+        logger.warning(f"Callback for {payload['id']} was not sent: {e}")
+        return None
+    if r.status_code >= 500:
+        r.raise_for_status()
+    elif 300 <= r.status_code < 400:
+        # Redirects aren't followed, where they lead could be anywhere. Sending it again won't change that either
+        logger.warning(f"Callback to {url} for {payload['id']} was redirected to {r.headers.get('Location')}, "
+                       f"redirects are not followed")
+    elif r.status_code >= 400:
+        # The receiver rejected it, sending it again won't change that
+        logger.warning(f"Callback to {url} for {payload['id']} was refused with code {r.status_code}")
+    return r.status_code
+
+
+@celery.task()
+def qikprop_pool_stats():
+    """Scratch directory pool size and utilization of the worker process which picks this up"""
+    return get_scratch_pool().stats()
+
+
+def prepare_inbound_staging(filename: str, result_key: str) -> Path:
     """Setup all of the directories and file locations """
-    inbound_directory, inbound_file = _generate_dir_and_file_paths(INBOUND_PATH, checksum, filename)
+    inbound_directory, inbound_file = _generate_dir_and_file_paths(INBOUND_PATH, result_key, filename)
     # Don't overwrite staging files
     if inbound_file.exists():
         return inbound_file
@@ -60,33 +320,38 @@ def prepare_inbound_staging(filename: str, checksum: str) -> Path:
     return inbound_file
 
 
-def inbound_staging_web(file: FileStorage, filename: str, checksum: str):
+def inbound_staging_web(file: FileStorage, filename: str, result_key: str):
     """Setup inbound file staging. Do this because FileStorage isn't serializable in Celery"""
-    inbound_file = prepare_inbound_staging(filename, checksum)
+    inbound_file = prepare_inbound_staging(filename, result_key)
     # Save the file
     file.save(str(inbound_file))
     return inbound_file
 
 
-def inbound_staging_api(file: Path, filename: str, checksum: str):
+def inbound_staging_api(file: Path, filename: str, result_key: str):
     """Setup inbound file staging from some other location into a known location"""
-    inbound_file = prepare_inbound_staging(filename, checksum)
+    inbound_file = prepare_inbound_staging(filename, result_key)
     # Move the file with shutil. Path.rename causes issues cross filesystem
     move(file, inbound_file)
     return inbound_file
 
 
-def serve_file(checksum):
-    """See if the files are ready yet"""
-    inbound_directory, _ = _generate_dir_and_file_paths(INBOUND_PATH, checksum, "junk.file")
-    serve_directory, serve_file_path = _generate_dir_and_file_paths(SERVE_PATH, checksum, QP_OUTPUT_TAR_NAME)
-    error_file = Path(serve_directory, "ErrorDetails.txt")
-    # Serve tarball if there
-    if serve_file_path.exists():
-        return serve_file_path
-    # serve the error file if there
-    elif error_file.exists():
-        return error_file
+def serve_file(result_key, state: Optional[dict] = None):
+    """
+    See if the files are ready yet. Answered from the job state of the key (looked up if state not given) when the
+    job state store tracks it, else from the staging and serve directories
+    """
+    state = job_states.get(result_key) if state is None else state
+    if state is not None:
+        if state["state"] in (JobStates.DONE, JobStates.ERROR):
+            return Path(SERVE_PATH, state["result"]).resolve()
+        return "In Staging"
+    inbound_directory, _ = _generate_dir_and_file_paths(INBOUND_PATH, result_key, "junk.file")
+    serve_directory, _ = _generate_dir_and_file_paths(SERVE_PATH, result_key, QP_OUTPUT_TAR_NAME)
+    manifest = read_manifest(serve_directory)
+    # Serve the tarball or error file once the result is complete
+    if manifest is not None:
+        return serve_directory / manifest["file"]
     # Serve info about file in staging
     elif inbound_directory.exists():
         return "In Staging"
@@ -94,29 +359,43 @@ def serve_file(checksum):
     return
 
 
-def serialize_file_response(input_file: Path) -> Union[str, bytes]:
-    serialized_file = ""
-    return serialized_file
-
-
-def deserialize_file_response(input_string: Path) -> str:  # Possibly not needed?
-    deserialize_file = ""
-    return deserialize_file
-
-
-def consistent_file_response(file_string: Union[str, bytes]):
-    """Helper function to ensure file response is consistent"""
-    return {"file_data": file_string}
-
-
-def package_file(possible_tarball, code):
-    if code == StatusCodes.staged:
-        return consistent_file_response("")
-    return consistent_file_response(serialize_file_response(possible_tarball))
-
-
-def generate_status(code: int, possible_tarball: Path, checksum: str) -> StatusGETReturn:
-    ret = StatusGETReturn(id=checksum, code=code, message="")
+def result_table(possible_tarball: Path, columns: Optional[List[str]] = None, offset: int = 0,
+                 limit: Optional[int] = None) -> Optional[dict]:
+    """Rows and columns of the parsed QP.CSV of a finished task, None if no table was made for it"""
+    table_name = read_manifest(possible_tarball.parent).get("table")
+    if table_name is None:
+        return None
+    return read_result_table(possible_tarball.parent / table_name, columns=columns, offset=offset, limit=limit)
+
+
+def job_status(checksum: str, options: dict) -> Tuple[Union[Path, str, None], int, StatusGETReturn]:
+    """Result location, status code and status of the job of a file and its options"""
+    result_key = generate_result_key(checksum, options)
+    state = job_states.get(result_key)
+    possible_tarball = serve_file(result_key, state)
+    response_code = response_code_from_tarball(possible_tarball, checksum)
+    return possible_tarball, response_code, generate_status(response_code, possible_tarball, checksum, options, state)
+
+
+def generate_status(code: int, possible_tarball: Path, checksum: str, options: dict = None,
+                    state: Optional[dict] = None) -> StatusGETReturn:
+    """
+    Status of a job from its code and its job state if tracked. Error details come from the job state, or else are
+    read from possible_tarball
+    """
+    options = options if options is not None else {}
+    ret = StatusGETReturn(id=checksum, code=code, message="", **options)
+    error = None
+    if state is not None:
+        ret.state = state["state"]
+        ret.molecules_done = state.get("molecules_done")
+        ret.molecules_total = state.get("molecules_total")
+        error = state.get("error")
+        if ret.state == JobStates.DONE:
+            ret.progress = 100.0
+        elif ret.state == JobStates.RUNNING and ret.molecules_done is not None and ret.molecules_total:
+            ret.progress = round(100 * ret.molecules_done / ret.molecules_total, 1)
+        ret.eta = estimate_eta(state, options)
     if code == StatusCodes.ready:
         ret.message = "Complete"
     elif code == StatusCodes.null:
@@ -124,8 +403,9 @@ def generate_status(code: int, possible_tarball: Path, checksum: str) -> StatusG
     elif code == StatusCodes.staged:
         ret.message = "File is staged for processing or is being processed"
     elif code == StatusCodes.error:
-        with open(possible_tarball, "r") as f:
-            error = f.read()
+        if error is None:
+            with open(possible_tarball, "r") as f:
+                error = f.read()
         ret.message = "Complete, but threw error"
         ret.error = error
     else:
@@ -143,7 +423,7 @@ def response_code_from_tarball(possible_tarball: Union[str, Path, None], checksu
         return StatusCodes.null
     # Checksum is present and done
     if isinstance(possible_tarball, Path):
-        if QP_OUTPUT_TAR_NAME not in possible_tarball.name:
+        if codec_from_name(possible_tarball.name) is None:
             return StatusCodes.error  # Case error file
         # Case valid/processed tarball
         return StatusCodes.ready
@@ -159,36 +439,105 @@ def response_code_from_tarball(possible_tarball: Union[str, Path, None], checksu
                        f"report this to the site maintainers.")
 
 
+def serve_archive(tarball: Path, codec: Optional[str] = None) -> Path:
+    """
+    Output tarball of a finished task compressed with codec. The tarball is stored with whatever codec the worker
+    was configured with, other codecs are transcoded from it on first request and kept next to it after that.
+    """
+    stored_codec = codec_from_name(tarball.name)
+    if codec is None or codec == stored_codec:
+        return tarball
+    check_codec(codec)
+    requested = tarball.with_name(archive_name(codec))
+    if not requested.exists():
+        transcode_archive(tarball, stored_codec, requested, codec)
+    return requested
+
+
+def add_task_callback(checksum: str, options: dict, url: str):
+    """Call url once the result of a task is complete, right away if it already is"""
+    serve_directory, _ = _generate_dir_and_file_paths(SERVE_PATH, generate_result_key(checksum, options), "junk.file")
+    register_callback(serve_directory, url)
+    # The worker reads the callbacks as it finishes, so one which was done before this was registered missed it
+    manifest = read_manifest(serve_directory)
+    if manifest is not None:
+        _queue_callbacks(serve_directory, manifest, checksum, options, urls=[url])
+
+
 def clear_output(checksum):
-    """Delete any existing output given a specific checksum"""
-    possible_tarball = serve_file(checksum)
-    if isinstance(possible_tarball, Path):
-        rmtree(possible_tarball.parent)
+    """Delete any existing output given a specific checksum, across every option set it was run with"""
+    serve_directory = Path(SERVE_PATH, checksum).resolve()
+    if serve_directory.is_dir():
+        rmtree(serve_directory)
+        job_states.clear(checksum)
         return True
     return False
 
 
-def create_qikprop_task(request, options, checksum):
-    # Check the checksum and the request match
-    with TemporaryDirectory() as td:
-        temp_file = Path(td) / "temp.data"
-        # This will write and check the file
-        computed_checksum = write_file_and_checksum_from_stream(request.stream, filepath=temp_file)
-        if checksum != computed_checksum:
-            return GETPOSTError(args=request.args,
-                                error=f"ID of request did not match ID/checksum of file! "
-                                      f"Input ID: {checksum}, Computed ID: {computed_checksum} "
-                                      f"ID computation handled server side of file contents through "
-                                      f"{hash_method.__name__}.",
-                                code=StatusCodes.unmatched).dict(), StatusCodes.unmatched
-        # TODO: Find a better file name, wont really matter here
-        staged_file = inbound_staging_api(temp_file, "api_file.file", checksum)
+def _queue_staged_file(datafile: Path, computed_checksum: str, args, options: dict, checksum: str,
+                       filename: Optional[str] = None):
+    """
+    Check a file written to a temporary location matches its checksum, stage it and queue the QikProp job for it.
+    The file is staged under filename, since its extension tells the worker if it can split and count the molecules
+    """
+    if checksum != computed_checksum:
+        return GETPOSTError(args=args,
+                            error=f"ID of request did not match ID/checksum of file! "
+                                  f"Input ID: {checksum}, Computed ID: {computed_checksum} "
+                                  f"ID computation handled server side of file contents through "
+                                  f"{hash_method.__name__}.",
+                            code=StatusCodes.unmatched).dict(), StatusCodes.unmatched
+    staged_file = inbound_staging_api(datafile, secure_filename(filename or "") or API_FILE_NAME,
+                                      generate_result_key(checksum, options))
     # Finally run the job
-    run_qikprop_worker.delay(str(staged_file), options, checksum)
-    print(options)
+    queue_qikprop_job(staged_file, options, checksum)
     return QikpropPOSTResponse(id=checksum, **options).dict(), StatusCodes.created
 
 
-
-
-
+def stage_qikprop_task(stream, args, options, checksum, filename: Optional[str] = None):
+    """
+    Write a data stream to staging, check it matches its checksum and queue the QikProp job for it, staged under
+    filename if the file came with one
+    """
+    # Check the checksum and the request match
+    with TemporaryDirectory() as td:
+        temp_file = Path(td) / "temp.data"
+        # This will write and check the file
+        computed_checksum = write_file_and_checksum_from_stream(stream, filepath=temp_file)
+        return _queue_staged_file(temp_file, computed_checksum, args, options, checksum, filename)
+
+
+def upload_directory(upload_id: str) -> Optional[Path]:
+    """Partial file staging directory of a resumable upload, None if the upload ID can't be one of ours"""
+    if not _UPLOAD_ID.fullmatch(upload_id):
+        return None
+    return Path(INBOUND_PATH, UPLOADS_DIRECTORY, upload_id).resolve()
+
+
+def start_upload(checksum: str, options: dict, size: int, callback_url: Optional[str] = None,
+                 filename: Optional[str] = None) -> Tuple[str, dict]:
+    """
+    Start the resumable upload of a file, or pick up the one already going for the same file and options. The upload
+    ID comes from the result key, so a client which lost track of its upload gets the same one back
+    """
+    upload_id = generate_result_key(checksum, options).replace("/", "-")
+    # Uploads which were given up on are cleared out as new ones come in
+    ttl = current_app.config.get("UPLOAD_TTL")
+    if ttl is not None:
+        sweep_uploads(Path(INBOUND_PATH, UPLOADS_DIRECTORY).resolve(), ttl)
+    info = open_upload(upload_directory(upload_id),
+                       {"id": checksum, "options": options, "size": size, "callback_url": callback_url,
+                        "filename": filename})
+    return upload_id, info
+
+
+def stage_uploaded_task(upload_id: str, args, options: dict, checksum: str, filename: Optional[str] = None):
+    """Check a completed upload matches its checksum, stage it under filename and queue the QikProp job for it"""
+    directory = upload_directory(upload_id)
+    return _queue_staged_file(directory / UPLOAD_DATA_NAME, checksum_upload(directory), args, options, checksum,
+                              filename)
+
+
+def discard_upload(upload_id: str):
+    """Delete the partial file staging of an upload, if it's still around"""
+    rmtree(upload_directory(upload_id), ignore_errors=True)
@@ -0,0 +1,123 @@
+"""
+Resumable uploads of large input files.
+
+An upload is started with the size of the file, then its chunks are written at their offsets in any order (and in
+parallel) into a preallocated partial file. Each finished chunk leaves a marker, so after a dropped connection the
+client can ask which byte ranges are still missing and only send those. Once every byte is in, the file is checked
+against its checksum and staged like any other input.
+"""
+
+import json
+import os
+from pathlib import Path
+import shutil
+import time
+from typing import List, Optional, Tuple
+import uuid
+
+from app.hashing import hash_method
+
+UPLOAD_INFO_NAME = "upload.json"
+UPLOAD_DATA_NAME = "data.part"
+UPLOAD_CHUNKS_NAME = "chunks"
+_COPY_SIZE = 1024 * 1024
+
+
+def read_upload(directory: Path) -> Optional[dict]:
+    """Details of an upload (id, options, size, callback_url, filename), None if there is no such upload"""
+    try:
+        with Path(directory, UPLOAD_INFO_NAME).open("r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def open_upload(directory: Path, info: dict) -> dict:
+    """Start an upload in directory, or pick up the one already there. Returns the details of the upload"""
+    existing = read_upload(directory)
+    if existing is not None and existing["size"] == info["size"]:
+        return existing
+    if existing is not None:
+        shutil.rmtree(directory, ignore_errors=True)  # Same ID with another size can't be the same file
+    (directory / UPLOAD_CHUNKS_NAME).mkdir(parents=True, exist_ok=True)
+    with (directory / UPLOAD_DATA_NAME).open("wb") as f:
+        f.truncate(info["size"])
+    # Details go in last, an upload only exists once they are there
+    temp_path = directory / f".{UPLOAD_INFO_NAME}.{uuid.uuid4().hex}.tmp"
+    with temp_path.open("w") as f:
+        json.dump(info, f)
+    os.replace(temp_path, directory / UPLOAD_INFO_NAME)
+    return info
+
+
+def write_chunk(directory: Path, size: int, offset: int, stream) -> int:
+    """
+    Write a chunk from stream at offset of the partial file and mark its byte range as received. Returns the length
+    of the chunk.
+
+    Raises
+    ------
+    ValueError
+        If the chunk runs past the end of the file
+    """
+    length = 0
+    with (directory / UPLOAD_DATA_NAME).open("r+b") as f:
+        f.seek(offset)
+        for block in iter(lambda: stream.read(_COPY_SIZE), b""):
+            length += len(block)
+            if offset + length > size:
+                raise ValueError(f"Chunk at offset {offset} runs past the end of the {size} byte file")
+            f.write(block)
+    # Only marked once all of it is written, a chunk cut off part way is sent again
+    (directory / UPLOAD_CHUNKS_NAME / f"{offset}-{offset + length}").touch()
+    return length
+
+
+def received_ranges(directory: Path) -> List[Tuple[int, int]]:
+    """Merged [start, end) byte ranges of the file which have been received"""
+    ranges = sorted(tuple(int(bound) for bound in marker.name.split("-"))
+                    for marker in (directory / UPLOAD_CHUNKS_NAME).iterdir())
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        elif end > start:
+            merged.append((start, end))
+    return merged
+
+
+def missing_ranges(directory: Path, size: int) -> List[Tuple[int, int]]:
+    """[start, end) byte ranges of the file which still have to be sent"""
+    missing = []
+    position = 0
+    for start, end in received_ranges(directory):
+        if start > position:
+            missing.append((position, start))
+        position = max(position, end)
+    if position < size:
+        missing.append((position, size))
+    return missing
+
+
+def sweep_uploads(root: Path, ttl: float):
+    """Delete the uploads in root which nothing was written to for ttl seconds, they were given up on"""
+    if not root.is_dir():
+        return
+    cutoff = time.time() - ttl
+    for directory in root.iterdir():
+        # Writing a chunk changes the partial file, finishing one adds its marker
+        paths = [directory, directory / UPLOAD_CHUNKS_NAME, directory / UPLOAD_DATA_NAME]
+        try:
+            last_written = max(path.stat().st_mtime for path in paths if path.exists())
+        except (FileNotFoundError, ValueError):
+            continue  # Gone while looking at it
+        if last_written < cutoff:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def checksum_upload(directory: Path) -> str:
+    checksum = hash_method()
+    with (directory / UPLOAD_DATA_NAME).open("rb") as f:
+        for block in iter(lambda: f.read(_COPY_SIZE), b""):
+            checksum.update(block)
+    return checksum.hexdigest()
@@ -30,9 +30,39 @@ class Config:
 
     # log page access to db or not
     DB_LOGGING = True
+    # Page access logs are written in bulk off the request, once this many are in or this many seconds go by
+    DB_LOGGING_FLUSH_SIZE = 100
+    DB_LOGGING_FLUSH_INTERVAL = 5
 
     UPLOAD_FOLDER = 'uploads/'
 
+    # Redis shared by the web app and workers, name is the docker-compose service name
+    REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379')
+
+    # Leases around queueing a QikProp task, "redis" or "memory" (single process only)
+    TASK_LOCK_BACKEND = os.environ.get('TASK_LOCK_BACKEND', 'redis')
+    TASK_LOCK_TIMEOUT = 60 * 10  # in seconds, covers uploading the file before it is staged
+
+    # Task completion events for long polling, "redis" or "memory" (single process only)
+    TASK_EVENT_BACKEND = os.environ.get('TASK_EVENT_BACKEND', 'redis')
+
+    # State of each job for status lookups, "redis" or "memory" (single process only)
+    JOB_STATE_BACKEND = os.environ.get('JOB_STATE_BACKEND', 'redis')
+
+    # Jobs the Celery workers run at once altogether, the queue ahead of a job drains this fast in its ETA
+    ETA_WORKER_SLOTS = int(os.environ.get('ETA_WORKER_SLOTS', os.environ.get('QP_WORKER_THREADS', 4)))
+
+    # Shared secret signing task completion webhooks, unsigned if not set
+    CALLBACK_SECRET = os.environ.get('CALLBACK_SECRET')
+    # Comma separated webhook hosts which may be called even though they aren't public, say a pipeline on the same
+    # network. Webhooks to any other loopback or private address are refused
+    CALLBACK_ALLOWLIST = [host.strip() for host in os.environ.get('CALLBACK_ALLOWLIST', '').split(',') if host.strip()]
+
+    # Largest file a resumable upload can be started for, in bytes
+    UPLOAD_MAX_SIZE = int(os.environ.get('UPLOAD_MAX_SIZE', 10 * 1024 ** 3))
+    # Resumable uploads nothing was written to for this long are deleted, in seconds
+    UPLOAD_TTL = int(os.environ.get('UPLOAD_TTL', 60 * 60 * 24))
+
     MONGODB_SETTINGS = {
         'host': os.environ.get('MONGO_URI',
                                "mongodb://<dbuser>:<dbpassword>localhost:27017/qikpropservice_db"),
@@ -58,6 +88,9 @@ class TestingConfig(Config):
     MONGODB_SETTINGS = {
         'db': "test_qikpropservice_db",
     }
+    TASK_LOCK_BACKEND = 'memory'
+    TASK_EVENT_BACKEND = 'memory'
+    JOB_STATE_BACKEND = 'memory'
 
 
 class ProductionConfig(Config):
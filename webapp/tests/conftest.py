@@ -1,5 +1,7 @@
 import pytest
-from app import create_app
+from app import create_app, tasks
+from app.factory import job_states
+from app.jobstate import MemoryJobStateBackend
 
 
 @pytest.fixture(scope="session")
@@ -14,3 +16,12 @@ def app():
 def flask_test_client(app):
     with app.test_client() as test_client:
         yield test_client
+
+
+@pytest.fixture
+def task_paths(tmp_path, monkeypatch):
+    """Point the inbound and serve paths at a temporary directory, with a fresh in-memory job state store"""
+    monkeypatch.setattr(tasks, "INBOUND_PATH", tmp_path / "qpin")
+    monkeypatch.setattr(tasks, "SERVE_PATH", tmp_path / "qpout")
+    monkeypatch.setattr(job_states, "backend", MemoryJobStateBackend())
+    return tmp_path
@@ -0,0 +1,221 @@
+import io
+import json
+import os
+from pathlib import Path
+import threading
+import time
+
+from flask import Flask
+import pytest
+
+from app import tasks
+from app.api import api_blueprint
+from app.data_models import StatusCodes
+from app.factory import task_locks, task_events, job_states
+from app.hashing import hash_method
+from app.qp.shard import shard_molecule_file
+
+
+@pytest.fixture
+def api_client(tmp_path, monkeypatch):
+    """Bare app with only the API, no database, memory leases and jobs recorded instead of queued"""
+    monkeypatch.setattr(tasks, "INBOUND_PATH", tmp_path / "qpin")
+    monkeypatch.setattr(tasks, "SERVE_PATH", tmp_path / "qpout")
+    queued = []
+    monkeypatch.setattr(tasks.run_qikprop_worker, "delay", lambda *args: queued.append(args))
+    app = Flask(__name__)
+    app.config.update(TESTING=True, TASK_LOCK_BACKEND="memory", TASK_LOCK_TIMEOUT=60, TASK_EVENT_BACKEND="memory",
+                      JOB_STATE_BACKEND="memory")
+    task_locks.init_app(app)
+    task_events.init_app(app)
+    job_states.init_app(app)
+    app.register_blueprint(api_blueprint, url_prefix="/api/v1")
+    with app.test_client() as client:
+        client.queued = queued
+        yield client
+
+
+def _checksum(data: bytes) -> str:
+    return hash_method(data).hexdigest()
+
+
+def test_batch_post(api_client):
+    first, second = b"first molecule", b"second molecule"
+    manifest = {"tasks": [{"id": _checksum(first), "file": "a"},
+                          {"id": _checksum(second), "file": "b", "fast": True},
+                          {"id": _checksum(first), "file": "a"},
+                          {"id": _checksum(b"not sent"), "file": "c"}]}
+    response = api_client.post("/api/v1/tasks/batch",
+                               data={"manifest": json.dumps(manifest),
+                                     "a": (io.BytesIO(first), "a.sdf"),
+                                     "b": (io.BytesIO(second), "b.sdf")},
+                               content_type="multipart/form-data")
+    assert response.status_code == 200
+    codes = [task["code"] for task in response.get_json()["tasks"]]
+    # The repeat is already staged by the first entry, the last has no file
+    assert codes == [StatusCodes.created, StatusCodes.created, StatusCodes.staged, 400]
+    assert len(api_client.queued) == 2
+
+
+def test_private_callback_refused(api_client):
+    data = b"first molecule"
+    response = api_client.post("/api/v1/tasks", query_string={"id": _checksum(data),
+                                                              "callback_url": "http://127.0.0.1:6379/"}, data=data)
+    assert response.status_code == 400
+    assert not api_client.queued
+
+
+def test_batch_post_bad_manifest(api_client):
+    response = api_client.post("/api/v1/tasks/batch", data={"manifest": json.dumps({"tasks": []})},
+                               content_type="multipart/form-data")
+    assert response.status_code == 400
+    assert not api_client.queued
+
+
+def test_posted_file_keeps_its_format(api_client, tmp_path):
+    data = b"mol\n\nM  END\n$$$$\n" * 5
+    response = api_client.post("/api/v1/tasks", query_string={"id": _checksum(data), "filename": "input.sdf"},
+                               data=data)
+    assert response.status_code == StatusCodes.created
+    staged_file = Path(api_client.queued[0][0])
+    assert staged_file.suffix == ".sdf"
+    assert len(shard_molecule_file(staged_file, staged_file.name, tmp_path / "shards", 2)) == 3
+    # Batch files are named by their multipart filename, the filename is not an option of the task
+    manifest = {"tasks": [{"id": _checksum(data + data), "file": "a"}]}
+    api_client.post("/api/v1/tasks/batch", data={"manifest": json.dumps(manifest), "a": (io.BytesIO(data + data),
+                                                                                         "../batch.sdf")},
+                    content_type="multipart/form-data")
+    staged_file, options, _ = api_client.queued[1]
+    assert Path(staged_file).name == "batch.sdf"
+    assert "filename" not in options
+
+
+def test_posted_job_counts_its_molecules(api_client, monkeypatch):
+    totals = []
+
+    def fake_run_qikprop(datafile, filename, options, output_path, progress_callback=None):
+        totals.append(job_states.get(tasks.generate_result_key(checksum, {}))["molecules_total"])
+        output_path.write_bytes(b"data")
+        return output_path
+
+    monkeypatch.setattr(tasks, "run_qikprop", fake_run_qikprop)
+    monkeypatch.setattr(tasks, "_record_runtime", lambda *args: None)
+    data = b"mol\n\nM  END\n$$$$\n" * 5
+    checksum = _checksum(data)
+    api_client.post("/api/v1/tasks", query_string={"id": checksum, "filename": "input.sdf"}, data=data)
+    tasks.run_qikprop_worker(*api_client.queued[0])
+    assert totals == [5]
+    status = api_client.get("/api/v1/status", query_string={"id": checksum}).get_json()
+    assert (status["state"], status["molecules_total"], status["progress"]) == ("done", 5, 100.0)
+
+
+def test_batch_status(api_client):
+    data = b"first molecule"
+    api_client.post("/api/v1/tasks", query_string={"id": _checksum(data)}, data=data)
+    response = api_client.post("/api/v1/status/batch",
+                               json={"tasks": [{"id": _checksum(data)},
+                                               {"id": _checksum(data), "fast": True},
+                                               {"id": _checksum(b"never posted")}]})
+    assert response.status_code == 200
+    statuses = response.get_json()["tasks"]
+    assert [status["code"] for status in statuses] == [StatusCodes.staged, StatusCodes.null, StatusCodes.null]
+    assert statuses[1]["fast"] is True
+    assert api_client.post("/api/v1/status/batch", data="not json").status_code == 400
+
+
+def test_wait_status_wakes_on_completion(api_client):
+    data = b"first molecule"
+    checksum = _checksum(data)
+    api_client.post("/api/v1/tasks", query_string={"id": checksum}, data=data)
+
+    def finish():
+        time.sleep(0.2)
+        result_key = tasks.generate_result_key(checksum, {})
+        serve_directory = tasks.SERVE_PATH / result_key
+        serve_directory.mkdir(parents=True)
+        (serve_directory / "qp_data.tar.gz").write_bytes(b"")
+        manifest = {"id": checksum, "status": "complete", "file": "qp_data.tar.gz"}
+        tasks._write_manifest(serve_directory, manifest)
+        tasks._record_completion(result_key, manifest, serve_directory)
+        task_events.publish(result_key)
+
+    worker = threading.Thread(target=finish)
+    worker.start()
+    start = time.monotonic()
+    response = api_client.post("/api/v1/status/wait", json={"tasks": [{"id": checksum}], "timeout": 10})
+    worker.join()
+    assert time.monotonic() - start < 5
+    assert [status["code"] for status in response.get_json()["tasks"]] == [StatusCodes.ready]
+
+
+def test_wait_status_times_out(api_client):
+    start = time.monotonic()
+    response = api_client.post("/api/v1/status/wait", json={"tasks": [{"id": _checksum(b"never posted")}],
+                                                            "timeout": 0.2})
+    assert time.monotonic() - start >= 0.2
+    assert [status["code"] for status in response.get_json()["tasks"]] == [StatusCodes.null]
+
+
+def test_resumable_upload(api_client):
+    data = b"a molecule which is sent in more than one chunk"
+    checksum = _checksum(data)
+    response = api_client.post("/api/v1/uploads", query_string={"id": checksum, "size": len(data)})
+    assert response.status_code == StatusCodes.created
+    upload = response.get_json()
+    assert upload["missing"] == [[0, len(data)]]
+    uri = f"/api/v1/uploads/{upload['upload_id']}"
+    # Chunks land out of order, and the upload can't finish until all of them are in
+    api_client.put(uri, query_string={"offset": 20}, data=data[20:])
+    assert api_client.post(uri).status_code == 400
+    assert api_client.put(uri, query_string={"offset": 40}, data=data).status_code == 400
+    # Starting again picks up where it left off
+    upload = api_client.post("/api/v1/uploads", query_string={"id": checksum, "size": len(data)}).get_json()
+    assert upload["missing"] == [[0, 20]]
+    assert api_client.put(uri, query_string={"offset": 0}, data=data[:20]).get_json()["missing"] == []
+    response = api_client.post(uri)
+    assert response.status_code == StatusCodes.created
+    assert len(api_client.queued) == 1
+    assert api_client.get(uri).status_code == StatusCodes.null
+    # Already on the server, nothing to upload
+    response = api_client.post("/api/v1/uploads", query_string={"id": checksum, "size": len(data)})
+    assert response.status_code == StatusCodes.staged
+
+
+def test_resumable_upload_kept_until_staged(api_client):
+    data = b"a molecule"
+    checksum = _checksum(data)
+    upload = api_client.post("/api/v1/uploads", query_string={"id": checksum, "size": len(data)}).get_json()
+    uri = f"/api/v1/uploads/{upload['upload_id']}"
+    api_client.put(uri, query_string={"offset": 0}, data=data)
+    # Another request is queueing the same task, the upload can be finished again after
+    with task_locks.lease(tasks.generate_result_key(checksum, {})):
+        assert api_client.post(uri).status_code == StatusCodes.staged
+    assert api_client.get(uri).status_code == StatusCodes.ready
+    assert api_client.post(uri).status_code == StatusCodes.created
+    assert api_client.get(uri).status_code == StatusCodes.null
+
+
+def test_resumable_upload_limits(api_client):
+    api_client.application.config.update(UPLOAD_MAX_SIZE=100, UPLOAD_TTL=60)
+    assert api_client.post("/api/v1/uploads", query_string={"id": _checksum(b"big"), "size": 101}).status_code == 413
+    upload = api_client.post("/api/v1/uploads", query_string={"id": _checksum(b"old"), "size": 3}).get_json()
+    uri = f"/api/v1/uploads/{upload['upload_id']}"
+    # Nothing was written to it for longer than the TTL, the next upload to start clears it out
+    long_ago = time.time() - 120
+    for path in tasks.upload_directory(upload["upload_id"]).rglob("*"):
+        os.utime(path, (long_ago, long_ago))
+    os.utime(tasks.upload_directory(upload["upload_id"]), (long_ago, long_ago))
+    api_client.post("/api/v1/uploads", query_string={"id": _checksum(b"new"), "size": 3})
+    assert api_client.get(uri).status_code == StatusCodes.null
+
+
+def test_resumable_upload_checksum_mismatch(api_client):
+    data = b"a molecule"
+    checksum = _checksum(b"some other molecule")
+    upload = api_client.post("/api/v1/uploads", query_string={"id": checksum, "size": len(data)}).get_json()
+    uri = f"/api/v1/uploads/{upload['upload_id']}"
+    api_client.put(uri, query_string={"offset": 0}, data=data)
+    assert api_client.post(uri).status_code == StatusCodes.unmatched
+    assert not api_client.queued
+    assert api_client.get(uri).status_code == StatusCodes.null
+    assert api_client.get("/api/v1/uploads/..").status_code == StatusCodes.null
@@ -0,0 +1,131 @@
+import hashlib
+import hmac
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import threading
+
+from flask import Flask
+import pytest
+import requests
+
+from app import callbacks, tasks
+from app.callbacks import SIGNATURE_HEADER, check_callback_url
+from app.tasks import generate_result_key
+
+
+checksum = "da39a3ee5e6b4b0d3255bfef95601890afd80709"
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    queued = []
+    monkeypatch.setattr(tasks.deliver_callback, "delay", lambda *args: queued.append(args))
+    return queued
+
+
+def test_callbacks_queued_on_completion(task_paths, queued, monkeypatch):
+    def fake_run_qikprop(datafile, filename, options, output_path, progress_callback=None):
+        output_path.write_bytes(b"data")
+        return output_path
+
+    monkeypatch.setattr(tasks, "run_qikprop", fake_run_qikprop)
+    staged = tasks.prepare_inbound_staging("input.sdf", generate_result_key(checksum, {"fast": True}))
+    staged.write_text("molecule")
+    tasks.add_task_callback(checksum, {"fast": True}, "http://example.com/hook")
+    tasks.add_task_callback(checksum, {"fast": True}, "http://example.com/hook")
+    assert not queued
+
+    tasks.run_qikprop_worker(str(staged), {"fast": True}, checksum)
+    assert len(queued) == 1
+    url, payload = queued[0]
+    assert url == "http://example.com/hook"
+    assert payload["id"] == checksum and payload["fast"] is True and payload["code"] == 200
+
+    # Registered after the fact, called right away
+    tasks.add_task_callback(checksum, {"fast": True}, "http://example.com/late")
+    assert queued[1][0] == "http://example.com/late"
+
+
+def test_callbacks_sent_to_their_own_queue(monkeypatch):
+    sent = []
+    monkeypatch.setattr(tasks.celery, "send_task", lambda name, *args, **options: sent.append((name, options)))
+    tasks.deliver_callback.delay("http://example.com/hook", {"id": checksum})
+    assert sent[0][0] == tasks.deliver_callback.name
+    assert sent[0][1]["queue"] == tasks.CALLBACK_QUEUE != tasks.celery.conf.task_default_queue
+
+
+@pytest.fixture
+def receiver():
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            received.append((dict(self.headers), body))
+            if self.path == "/redirect":
+                # Somewhere the callback check would never have let through
+                self.send_response(302)
+                self.send_header("Location", f"http://localhost:{self.server.server_port}/internal")
+            else:
+                self.send_response(500 if self.path == "/broken" else 204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", received
+    server.shutdown()
+
+
+def test_deliver_callback_signed(receiver):
+    url, received = receiver
+    app = Flask(__name__)
+    app.config.update(CALLBACK_SECRET="secret", CALLBACK_ALLOWLIST=["127.0.0.1"])
+    with app.app_context():
+        assert tasks.deliver_callback(url + "/hook", {"id": checksum, "code": 200}) == 204
+        with pytest.raises(requests.HTTPError):
+            tasks.deliver_callback(url + "/broken", {"id": checksum, "code": 200})
+    headers, body = received[0]
+    assert json.loads(body) == {"id": checksum, "code": 200}
+    expected = hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+    assert headers[SIGNATURE_HEADER] == f"sha256={expected}"
+
+
+def test_callback_urls_must_be_public():
+    for url in ("http://127.0.0.1/hook", "http://localhost:8080/hook", "http://10.1.2.3/hook",
+                "http://169.254.169.254/latest", "http://[::1]/hook", "http://[::ffff:192.168.0.1]/hook", "ftp://x"):
+        with pytest.raises(ValueError):
+            check_callback_url(url)
+    check_callback_url("http://93.184.216.34/hook")
+    check_callback_url("http://LOCALHOST:8080/hook", allowlist=["localhost"])
+
+
+def test_deliver_callback_refuses_private_addresses(receiver):
+    url, received = receiver
+    with Flask(__name__).app_context():
+        assert tasks.deliver_callback(url + "/hook", {"id": checksum, "code": 200}) is None
+    assert not received
+
+
+def test_deliver_callback_does_not_follow_redirects(receiver):
+    url, received = receiver
+    app = Flask(__name__)
+    app.config["CALLBACK_ALLOWLIST"] = ["127.0.0.1"]
+    with app.app_context():
+        # Not an error worth retrying, and the redirect target is never called
+        assert tasks.deliver_callback(url + "/redirect", {"id": checksum, "code": 200}) == 302
+    assert len(received) == 1
+
+
+def test_deliver_callback_connects_to_the_checked_address(receiver, monkeypatch):
+    url, received = receiver
+    port = url.rpartition(":")[2]
+    # The host resolves to nothing now, the delivery still goes to the address which was checked
+    monkeypatch.setattr(callbacks, "check_callback_url", lambda url, allowlist=(): "127.0.0.1")
+    with Flask(__name__).app_context():
+        assert tasks.deliver_callback(f"http://hooks.invalid:{port}/hook", {"id": checksum, "code": 200}) == 204
+    headers, _ = received[0]
+    assert headers["Host"] == f"hooks.invalid:{port}"
@@ -0,0 +1,43 @@
+import tarfile
+
+import pytest
+
+from app.compression import archive_name, codec_from_name, open_compressed_reader, write_archive, CodecUnavailable
+from app.tasks import serve_archive
+
+
+@pytest.fixture
+def outputs(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "QP.CSV").write_text("molecule,#stars\nmol,0\n")
+    (source / "QP.out").write_text("output\n")
+    return source
+
+
+def _members(path, codec):
+    with open_compressed_reader(path, codec) as raw:
+        with tarfile.open(fileobj=raw, mode="r|") as tar:
+            return sorted(member.name for member in tar)
+
+
+@pytest.mark.parametrize("codec", ["none", "gzip", "zstd"])
+def test_write_archive(outputs, tmp_path, codec):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    output = write_archive(outputs, ["QP.CSV", "QP.out", "QPlog"], tmp_path / archive_name(codec), codec, 1)
+    assert codec_from_name(output.name) == codec
+    assert _members(output, codec) == ["QP.CSV", "QP.out"]
+
+
+def test_serve_archive_transcodes_once(outputs, tmp_path):
+    stored = write_archive(outputs, ["QP.CSV", "QP.out"], tmp_path / archive_name("gzip"), "gzip")
+    assert serve_archive(stored) == stored
+    assert serve_archive(stored, "gzip") == stored
+    plain = serve_archive(stored, "none")
+    assert plain.name == "qp_data.tar"
+    assert _members(plain, "none") == ["QP.CSV", "QP.out"]
+    modified = plain.stat().st_mtime_ns
+    assert serve_archive(stored, "none").stat().st_mtime_ns == modified
+    with pytest.raises(CodecUnavailable):
+        serve_archive(stored, "bzip2")
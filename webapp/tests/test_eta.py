@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+
+from app.eta import job_eta
+from app.jobstate import JobStates
+
+
+def _model(seconds_per_molecule=2.0, time_per_kb=1.0, seconds_per_job=60.0):
+    return SimpleNamespace(seconds_per_job=seconds_per_job,
+                           estimate=lambda size_kb, molecules: molecules * seconds_per_molecule if molecules
+                           else size_kb * time_per_kb)
+
+
+def test_queued_eta_includes_the_queue():
+    state = {"state": JobStates.QUEUED, "queued_at": 0, "size_kb": 30}
+    assert job_eta(state, _model(), depth=0, worker_slots=4, now=10) == 30
+    # 8 jobs ahead of 60 seconds each on 4 slots
+    assert job_eta(state, _model(), depth=8, worker_slots=4, now=10) == 30 + 120
+    assert job_eta(state, None, depth=8, worker_slots=4, now=10) is None
+
+
+def test_running_eta():
+    state = {"state": JobStates.RUNNING, "started_at": 100, "size_kb": 30, "molecules_total": 50}
+    # No progress yet, from the cost model
+    assert job_eta(dict(state, molecules_done=0), _model(), depth=8, worker_slots=4, now=110) == 90
+    # Progress goes from the pace of the job itself, a fifth done in 10 seconds
+    assert job_eta(dict(state, molecules_done=10), _model(), depth=8, worker_slots=4, now=110) == 40
+    assert job_eta({"state": JobStates.DONE}, _model(), depth=8, worker_slots=4) is None
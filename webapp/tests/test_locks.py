@@ -0,0 +1,33 @@
+import time
+
+from app.locks import MemoryLeaseBackend, TaskLocks
+
+
+class _FakeApp:
+    config = {"TASK_LOCK_BACKEND": "memory", "TASK_LOCK_TIMEOUT": 60}
+
+
+def test_lease_is_exclusive():
+    locks = TaskLocks(_FakeApp())
+    with locks.lease("abc/123") as first:
+        assert first
+        with locks.lease("abc/123") as second:
+            assert not second
+        # Other keys are unaffected
+        with locks.lease("abc/456") as other:
+            assert other
+    # Given back on exit
+    with locks.lease("abc/123") as again:
+        assert again
+
+
+def test_memory_lease_expires():
+    backend = MemoryLeaseBackend()
+    token = backend.acquire("key", timeout=0.01)
+    assert token is not None
+    assert backend.acquire("key", timeout=0.01) is None
+    time.sleep(0.02)
+    assert backend.acquire("key", timeout=0.01) is not None
+    # Releasing an expired and retaken lease does nothing
+    backend.release("key", token)
+    assert backend.acquire("key", timeout=0.01) is None
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import pytest
+
+from app.models import logs
+from app.models.logs import AccessLogBuffer
+
+
+class _Written(list):
+    pass
+
+
+@pytest.fixture
+def inserted(monkeypatch):
+    """Log documents made into plain dicts, inserts recorded instead of written"""
+    written = _Written()
+    done = threading.Event()
+
+    class FakeObjects:
+        @staticmethod
+        def insert(documents, load_bulk=True):
+            written.append(documents)
+            done.set()
+
+    monkeypatch.setattr(logs, "Log", type("Log", (dict,), {"objects": FakeObjects}))
+    monkeypatch.setattr(logs, "get_geoip2_data", lambda ip_address: {"country_code": "US"})
+    written.done = done
+    return written
+
+
+def test_buffer_writes_in_bulk_off_the_caller(inserted):
+    buffer = AccessLogBuffer(flush_size=3, flush_interval=3600)
+    buffer.add({"page": "homepage", "ip_address": "127.0.0.1"})
+    buffer.add({"page": "homepage", "ip_address": "127.0.0.1"})
+    assert not inserted
+    buffer.add({"page": "homepage", "ip_address": "127.0.0.1"})
+    assert inserted.done.wait(5)
+    assert len(inserted) == 1 and len(inserted[0]) == 3
+    assert inserted[0][0] == {"page": "homepage", "ip_address": "127.0.0.1", "country_code": "US"}
+
+
+def test_buffer_drops_past_max_size(inserted):
+    buffer = AccessLogBuffer(flush_size=100, flush_interval=3600, max_size=2)
+    for _ in range(5):
+        buffer.add({"page": "homepage", "ip_address": "127.0.0.1"})
+    buffer.flush()
+    assert [len(documents) for documents in inserted] == [2]
+
+
+def test_buffer_survives_bad_records(inserted, monkeypatch):
+    def lookup(ip_address):
+        if ip_address is None:
+            raise ValueError("not an IP address")
+        return {"country_code": "US"}
+
+    monkeypatch.setattr(logs, "get_geoip2_data", lookup)
+    buffer = AccessLogBuffer(flush_size=1, flush_interval=3600)
+    buffer.add({"page": "homepage", "ip_address": None})
+    deadline = time.monotonic() + 5
+    while buffer._records and time.monotonic() < deadline:  # Taken by the writer thread
+        time.sleep(0.01)
+    buffer.add({"page": "homepage", "ip_address": "127.0.0.1"})
+    # The writer thread is still going after the record it could not write
+    assert inserted.done.wait(5)
+    assert inserted[0] == [{"page": "homepage", "ip_address": "127.0.0.1", "country_code": "US"}]
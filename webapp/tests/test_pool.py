@@ -0,0 +1,69 @@
+import pathlib
+import threading
+
+import pytest
+
+from app.qp.pool import QikpropScratchPool, LIMITS_FILE
+
+
+@pytest.fixture
+def pool(tmp_path):
+    qp_dir = tmp_path / "QikProp"
+    qp_dir.mkdir()
+    (qp_dir / "QPlimits_mod").write_text("mode {proc_mode} nmol {nmol}")
+    scratch_pool = QikpropScratchPool(str(qp_dir), max_size=2, root=str(tmp_path))
+    yield scratch_pool
+    scratch_pool.close()
+
+
+normal = {"proc_mode": "normal", "nmol": 20}
+fast = {"proc_mode": "fast", "nmol": 5}
+
+
+def test_scratch_reuses_limits(pool):
+    with pool.scratch(normal) as first:
+        assert (first / LIMITS_FILE).read_text() == "mode normal nmol 20"
+        (first / "QP.out").write_text("output")
+    # Job files are cleared, limits are kept for the next job with the same options
+    with pool.scratch(normal) as second:
+        assert second == first
+        assert sorted(p.name for p in second.iterdir()) == [LIMITS_FILE]
+    with pool.scratch(fast) as third:
+        assert (third / LIMITS_FILE).read_text() == "mode fast nmol 5"
+    stats = pool.stats()
+    assert stats["size"] == 1
+    assert stats["jobs"] == 3
+    assert stats["limits_reused"] == 1
+    assert stats["in_use"] == 0
+
+
+def test_scratch_pool_is_bounded(pool):
+    def run_job():
+        with pool.scratch(normal):
+            pass
+
+    with pool.scratch(normal) as first, pool.scratch(fast) as second:
+        assert first != second
+        assert pool.stats()["utilization"] == 1
+        waiter = threading.Thread(target=run_job)
+        waiter.start()
+        waiter.join(timeout=0.1)
+        assert waiter.is_alive()  # Waits on a free directory
+    waiter.join(timeout=1)
+    assert not waiter.is_alive()
+    assert pool.stats()["size"] == 2
+
+
+def test_scratch_slot_returned_on_failure(pool, monkeypatch):
+    def disk_full(self, *args, **kwargs):
+        raise OSError("No space left on device")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(pathlib.Path, "mkdir", disk_full)
+        for _ in range(3):
+            with pytest.raises(OSError):
+                with pool.scratch(normal):
+                    pass
+    assert pool.stats()["size"] == 0
+    with pool.scratch(normal), pool.scratch(fast):
+        assert pool.stats()["size"] == 2
@@ -0,0 +1,72 @@
+import pytest
+
+from app.compression import archive_name, write_archive
+from app.results import write_result_table, read_result_table
+
+
+@pytest.fixture
+def archive(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "QP.CSV").write_text("molecule,#stars,QPlogPo/w,comment\n"
+                                   "mol_1,0,1.5,\n"
+                                   "mol_2,2,-0.25,odd\n"
+                                   "mol_3,1,3.0,\n")
+    return write_archive(source, ["QP.CSV"], tmp_path / archive_name("gzip"), "gzip")
+
+
+def test_write_and_read_table(archive, tmp_path):
+    table_path = write_result_table(archive, tmp_path / "qp_table.json")
+    table = read_result_table(table_path)
+    assert table["columns"] == ["molecule", "#stars", "QPlogPo/w", "comment"]
+    assert table["data"]["#stars"] == [0, 2, 1]
+    assert table["data"]["QPlogPo/w"] == [1.5, -0.25, 3.0]
+    assert table["data"]["comment"] == [None, "odd", None]
+    assert table["total"] == 3
+    assert table["next_offset"] is None
+
+
+def test_columns_keep_one_type(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "QP.CSV").write_text("molecule,#stars,QPlogS,mixed\n"
+                                   "1e5,0,nan,1\n"
+                                   "007,2,-inf,x\n"
+                                   "mol_3,,4,2\n")
+    archive = write_archive(source, ["QP.CSV"], tmp_path / archive_name("none"), "none")
+    table = read_result_table(write_result_table(archive, tmp_path / "qp_table.json"))
+    assert table["data"]["molecule"] == ["1e5", "007", "mol_3"]
+    assert table["data"]["#stars"] == [0, 2, None]
+    assert table["data"]["QPlogS"] == [None, None, 4.0]
+    assert table["data"]["mixed"] == ["1", "x", "2"]
+
+
+def test_read_table_pages(archive, tmp_path):
+    table_path = write_result_table(archive, tmp_path / "qp_table.json")
+    page = read_result_table(table_path, columns=["molecule"], offset=0, limit=2)
+    assert page["data"] == {"molecule": ["mol_1", "mol_2"]}
+    assert page["next_offset"] == 2
+    page = read_result_table(table_path, columns=["molecule"], offset=page["next_offset"], limit=2)
+    assert page["data"] == {"molecule": ["mol_3"]}
+    assert page["next_offset"] is None
+    with pytest.raises(KeyError):
+        read_result_table(table_path, columns=["not_a_column"])
+
+
+def test_no_csv_no_table(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "QP.out").write_text("output\n")
+    archive = write_archive(source, ["QP.out"], tmp_path / archive_name("none"), "none")
+    assert write_result_table(archive, tmp_path / "qp_table.json") is None
+
+
+def test_rewritten_table_is_read_again(archive, tmp_path):
+    table_path = write_result_table(archive, tmp_path / "qp_table.json")
+    assert read_result_table(table_path)["total"] == 3
+    # Same path, as when a cleared task is run again
+    source = tmp_path / "rerun"
+    source.mkdir()
+    (source / "QP.CSV").write_text("molecule,#stars\nmol_1,0\n")
+    write_result_table(write_archive(source, ["QP.CSV"], tmp_path / archive_name("none"), "none"), table_path)
+    assert read_result_table(table_path)["data"] == {"molecule": ["mol_1"], "#stars": [0]}
@@ -0,0 +1,80 @@
+import os
+import tarfile
+
+import pytest
+
+from app.qp import runqp
+from app.qp.pool import QikpropScratchPool
+
+
+fake_xqprop = """#!/bin/sh
+echo "$QPdir" > QP.out
+echo "molecule,#stars" > QP.CSV
+echo "$1,0" >> QP.CSV
+echo "Processing $1"
+echo "warning from xQPROP" 1>&2
+"""
+
+
+@pytest.fixture
+def fake_qikprop(tmp_path, monkeypatch):
+    """Stand in xQPROP which writes minimal outputs, used in its own scratch pool"""
+    qp_dir = tmp_path / "QikProp"
+    qp_dir.mkdir()
+    (qp_dir / "QPlimits_mod").write_text("mode {proc_mode} nmol {nmol}")
+    xqprop = qp_dir / "xQPROP"
+    xqprop.write_text(fake_xqprop)
+    xqprop.chmod(0o755)
+    pool = QikpropScratchPool(str(qp_dir), max_size=2, root=str(tmp_path))
+    monkeypatch.setattr(runqp, "qp_dir", str(qp_dir))
+    monkeypatch.setattr(runqp, "_scratch_pool", pool)
+    yield qp_dir
+    pool.close()
+
+
+def test_run_qikprop_leaves_process_state(fake_qikprop, tmp_path):
+    datafile = tmp_path / "input.sdf"
+    datafile.write_text("molecule")
+    cwd = os.getcwd()
+    tarball = runqp.run_qikprop(datafile, datafile.name, {}, tmp_path / "qp_data.tar.gz")
+    assert tarball == tmp_path / "qp_data.tar.gz"
+    # No temporary tarball is left behind
+    assert not list(tmp_path.glob(".qp_data.tar.gz.*"))
+    assert os.getcwd() == cwd
+    assert "QPdir" not in os.environ or os.environ["QPdir"] != str(fake_qikprop)
+    with tarfile.open(tarball) as tar:
+        assert tar.extractfile("QP.out").read().decode().strip() == str(fake_qikprop)
+        assert "QP.CSV" in tar.getnames()
+        assert tar.extractfile("stderr").read().decode() == "warning from xQPROP\n"
+
+
+def test_run_qikprop_sharded(fake_qikprop, tmp_path, monkeypatch):
+    monkeypatch.setattr(runqp, "QP_SHARD_SIZE", 2)
+    datafile = tmp_path / "input.sdf"
+    datafile.write_text("mol\n\nM  END\n$$$$\n" * 5)
+    tarball = runqp.run_qikprop(datafile, datafile.name, {}, tmp_path / "qp_data.tar.gz")
+    with tarfile.open(tarball) as tar:
+        csv = tar.extractfile("QP.CSV").read().decode()
+        stdout = tar.extractfile("stdout").read().decode()
+    assert csv == "molecule,#stars\ninput_0001.sdf,0\ninput_0002.sdf,0\ninput_0003.sdf,0\n"
+    assert stdout.count("Processing") == 3
+
+
+def test_run_qikprop_progress(fake_qikprop, tmp_path, monkeypatch):
+    monkeypatch.setattr(runqp, "QP_TAIL_INTERVAL", 0.01)
+    datafile = tmp_path / "input.pdb"
+    datafile.write_text("molecule")
+    lines = []
+    runqp.run_qikprop(datafile, datafile.name, {}, tmp_path / "qp_data.tar.gz", progress_callback=lines.append)
+    assert lines == ["input.pdb,0"]
+
+
+def test_run_qikprop_progress_sharded(fake_qikprop, tmp_path, monkeypatch):
+    monkeypatch.setattr(runqp, "QP_TAIL_INTERVAL", 0.01)
+    monkeypatch.setattr(runqp, "QP_SHARD_SIZE", 2)
+    datafile = tmp_path / "input.sdf"
+    datafile.write_text("mol\n\nM  END\n$$$$\n" * 5)
+    rows = []
+    runqp.run_qikprop(datafile, datafile.name, {}, tmp_path / "qp_data.tar.gz", progress_callback=rows.append)
+    # One row per shard from the stand in, the header of each shard's QP.CSV is never counted
+    assert sorted(rows) == ["input_0001.sdf,0", "input_0002.sdf,0", "input_0003.sdf,0"]
@@ -0,0 +1,61 @@
+import gzip
+
+from app.qp.shard import count_molecules, shard_molecule_file, merge_outputs
+
+
+def _sdf(n):
+    return "".join(f"mol{i}\n  header\n\n  0  0  0  0  0  0  0  0  0  0999 V2000\nM  END\n$$$$\n" for i in range(n))
+
+
+def test_shard_sdf(tmp_path):
+    datafile = tmp_path / "input.sdf"
+    datafile.write_text(_sdf(5))
+    assert count_molecules(datafile, "input.sdf") == 5
+    shards = shard_molecule_file(datafile, "input.sdf", tmp_path / "shards", 2)
+    assert [shard.name for shard in shards] == ["input_0001.sdf", "input_0002.sdf", "input_0003.sdf"]
+    assert "".join(shard.read_text() for shard in shards) == datafile.read_text()
+    # Fits in one shard, or can't be split at all
+    assert shard_molecule_file(datafile, "input.sdf", tmp_path / "whole", 5) is None
+    assert not list((tmp_path / "whole").iterdir())
+    assert shard_molecule_file(datafile, "input.pdb", tmp_path / "pdb", 2) is None
+
+
+def test_shard_gzipped_sdf(tmp_path):
+    datafile = tmp_path / "input.sdf.gz"
+    with gzip.open(datafile, "wt") as f:
+        f.write(_sdf(3))
+    shards = shard_molecule_file(datafile, "input.sdf.gz", tmp_path / "shards", 2)
+    assert [shard.name for shard in shards] == ["input_0001.sdf", "input_0002.sdf"]
+    assert shards[1].read_text() == _sdf(3).split("$$$$\n", 2)[2]
+
+
+def test_shard_mol2(tmp_path):
+    molecule = "@<TRIPOS>MOLECULE\nmol\n 1 0 0 0 0\n@<TRIPOS>ATOM\n 1 C 0.0 0.0 0.0 C.3\n"
+    datafile = tmp_path / "input.mol2"
+    datafile.write_text("# comment\n" + molecule * 3)
+    shards = shard_molecule_file(datafile, "input.mol2", tmp_path / "shards", 1)
+    assert len(shards) == 3
+    assert shards[0].read_text() == "# comment\n" + molecule
+    assert shards[2].read_text() == molecule
+
+
+def test_shard_mae_repeats_header(tmp_path):
+    header = "{\n s_m_m2io_version\n :::\n 2.0.0\n}\n\n"
+    block = "f_m_ct {\n s_m_title\n :::\n mol\n m_atom[1] {\n  # First column is atom index #\n :::\n }\n}\n\n"
+    datafile = tmp_path / "input.mae"
+    datafile.write_text(header + block * 2)
+    shards = shard_molecule_file(datafile, "input.mae", tmp_path / "shards", 1)
+    assert [shard.read_text() for shard in shards] == [header + block, header + block]
+    assert count_molecules(datafile, "input.mae") == 2
+
+
+def test_merge_outputs(tmp_path):
+    first, second = tmp_path / "first", tmp_path / "second"
+    for index, directory in enumerate((first, second)):
+        directory.mkdir()
+        (directory / "QP.CSV").write_text(f"molecule,#stars\nmol{index},0\n")
+        (directory / "QP.out").write_text(f"out {index}\n")
+    merge_outputs([first, second], tmp_path / "merged", ["QP.CSV", "QP.out", "QPlog"])
+    assert (tmp_path / "merged" / "QP.CSV").read_text() == "molecule,#stars\nmol0,0\nmol1,0\n"
+    assert (tmp_path / "merged" / "QP.out").read_text() == "out 0\nout 1\n"
+    assert not (tmp_path / "merged" / "QPlog").exists()
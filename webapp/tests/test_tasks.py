@@ -0,0 +1,154 @@
+from shutil import rmtree
+
+import pytest
+
+from app import tasks
+from app.constants import QP_OUTPUT_TAR_NAME
+from app.data_models import StatusCodes
+from app.factory import job_states
+from app.jobstate import JobStates
+from app.tasks import generate_result_key
+
+
+checksum = "da39a3ee5e6b4b0d3255bfef95601890afd80709"
+
+
+def test_result_key_defaults_are_canonical():
+    # Missing options and explicit defaults map to the same result set
+    default_key = generate_result_key(checksum, {})
+    assert default_key == generate_result_key(checksum, {"fast": False, "similar": 20})
+    assert default_key.startswith(checksum + "/")
+
+
+def test_result_key_separates_options():
+    default_key = generate_result_key(checksum, {})
+    fast_key = generate_result_key(checksum, {"fast": True})
+    similar_key = generate_result_key(checksum, {"similar": 5})
+    assert len({default_key, fast_key, similar_key}) == 3
+    # Order and unknown options do not change the key
+    assert generate_result_key(checksum, {"similar": 5, "fast": True}) == \
+           generate_result_key(checksum, {"fast": True, "similar": "5", "not_an_option": 1})
+
+
+def test_claim_is_exclusive(tmp_path):
+    assert tasks._claim_result(tmp_path)
+    assert not tasks._claim_result(tmp_path)
+    tasks._release_claim(tmp_path)
+    assert tasks._claim_result(tmp_path)
+
+
+def test_worker_runs_once_per_result(task_paths, monkeypatch):
+    runs = []
+
+    def fake_run_qikprop(datafile, filename, options, output_path, progress_callback=None):
+        runs.append(filename)
+        output_path.write_bytes(b"data")
+        return output_path
+
+    monkeypatch.setattr(tasks, "run_qikprop", fake_run_qikprop)
+    result_key = generate_result_key(checksum, {})
+    staged = tasks.prepare_inbound_staging("input.sdf", result_key)
+    staged.write_text("molecule")
+    assert tasks.serve_file(result_key) == "In Staging"
+
+    tasks.run_qikprop_worker(str(staged), {}, checksum)
+    tasks.run_qikprop_worker(str(staged), {}, checksum)
+    assert len(runs) == 1
+    served = tasks.serve_file(result_key)
+    assert served.name == QP_OUTPUT_TAR_NAME
+    assert tasks.read_manifest(served.parent)["status"] == "complete"
+
+
+def test_job_states_follow_the_worker(task_paths, monkeypatch):
+    states = []
+
+    def fake_run_qikprop(datafile, filename, options, output_path, progress_callback=None):
+        states.append(job_states.get(result_key)["state"])
+        raise RuntimeError("xQPROP fell over")
+
+    monkeypatch.setattr(tasks, "run_qikprop", fake_run_qikprop)
+    monkeypatch.setattr(tasks.run_qikprop_worker, "delay", lambda *args: None)
+    result_key = generate_result_key(checksum, {})
+    staged = tasks.prepare_inbound_staging("input.sdf", result_key)
+    staged.write_text("molecule")
+    tasks.queue_qikprop_job(staged, {}, checksum)
+    assert job_states.get(result_key)["state"] == JobStates.QUEUED
+
+    tasks.run_qikprop_worker(str(staged), {}, checksum)
+    assert states == [JobStates.RUNNING]
+    state = job_states.get(result_key)
+    assert state["state"] == JobStates.ERROR and "xQPROP fell over" in state["error"]
+    assert state["queued_at"] <= state["started_at"] <= state["finished_at"]
+    # Status comes from the store alone, even with the directories gone
+    rmtree(task_paths / "qpout")
+    _, code, status = tasks.job_status(checksum, {})
+    assert code == StatusCodes.error and "xQPROP fell over" in status.error
+
+
+def test_worker_reports_progress(task_paths, monkeypatch):
+    seen = []
+
+    def fake_run_qikprop(datafile, filename, options, output_path, progress_callback=None):
+        seen.append(tasks.job_status(checksum, {})[2])
+        for row in ["mol_1,0", "mol_2,0", "mol_3,0"]:
+            progress_callback(row)
+            seen.append(tasks.job_status(checksum, {})[2])
+        output_path.write_bytes(b"data")
+        return output_path
+
+    monkeypatch.setattr(tasks, "run_qikprop", fake_run_qikprop)
+    monkeypatch.setattr(tasks, "PROGRESS_INTERVAL", 0)
+    result_key = generate_result_key(checksum, {})
+    staged = tasks.prepare_inbound_staging("input.sdf", result_key)
+    staged.write_text("mol\n\nM  END\n$$$$\n" * 4)
+    tasks.run_qikprop_worker(str(staged), {}, checksum)
+    assert [status.state for status in seen] == [JobStates.RUNNING] * 4
+    assert [status.molecules_done for status in seen] == [0, 1, 2, 3]
+    assert [status.progress for status in seen] == [0, 25, 50, 75]
+    status = tasks.job_status(checksum, {})[2]
+    assert status.state == JobStates.DONE and status.progress == 100
+
+
+def test_worker_rechecks_manifest_after_claim(task_paths, monkeypatch):
+    runs = []
+
+    def fake_run_qikprop(datafile, filename, options, output_path, progress_callback=None):
+        runs.append(filename)
+        output_path.write_bytes(b"data")
+        return output_path
+
+    monkeypatch.setattr(tasks, "run_qikprop", fake_run_qikprop)
+    result_key = generate_result_key(checksum, {})
+    staged = tasks.prepare_inbound_staging("input.sdf", result_key)
+    staged.write_text("molecule")
+    serve_directory = task_paths / "qpout" / result_key
+    manifest = {"id": checksum, "status": "complete", "file": QP_OUTPUT_TAR_NAME}
+    claim_result = tasks._claim_result
+
+    def finished_meanwhile(directory):
+        # Another worker finishes, cleans up its input and lets go of the claim right before this one takes it
+        (directory / QP_OUTPUT_TAR_NAME).write_bytes(b"data")
+        tasks._write_manifest(directory, manifest)
+        rmtree(staged.parent)
+        return claim_result(directory)
+
+    monkeypatch.setattr(tasks, "_claim_result", finished_meanwhile)
+    tasks.run_qikprop_worker(str(staged), {}, checksum)
+    assert not runs
+    assert tasks.read_manifest(serve_directory) == manifest
+    assert not (serve_directory / tasks.QP_CLAIM_NAME).exists()
+
+
+def test_worker_releases_claim_on_failure(task_paths, monkeypatch):
+    monkeypatch.setattr(tasks, "run_qikprop", lambda *args, **kwargs: None)
+
+    def disk_full(directory, manifest):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(tasks, "_write_manifest", disk_full)
+    result_key = generate_result_key(checksum, {})
+    staged = tasks.prepare_inbound_staging("input.sdf", result_key)
+    staged.write_text("molecule")
+    with pytest.raises(OSError):
+        tasks.run_qikprop_worker(str(staged), {}, checksum)
+    assert not (task_paths / "qpout" / result_key / tasks.QP_CLAIM_NAME).exists()
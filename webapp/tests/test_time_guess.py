@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from app.models import time_guess
+from app.models.time_guess import RuntimeAccumulator, TimeGuess
+
+
+@pytest.fixture
+def increments(monkeypatch):
+    written = []
+    monkeypatch.setattr(time_guess, "_increment", lambda name, totals: written.append((name, dict(totals))))
+    return written
+
+
+def test_accumulator_flushes_in_batches(increments):
+    accumulator = RuntimeAccumulator(flush_interval=3600, flush_size=3)
+    accumulator.add(10, 5, tracking_name="fast", molecules=10)
+    accumulator.add(20, 5, tracking_name="fast")
+    assert not increments
+    accumulator.add(30, 10, tracking_name="normal", molecules=3)
+    assert sorted(increments) == [
+        ("fast", {"total_ops": 2, "total_seconds": 30, "total_kb": 10, "total_molecule_ops": 1,
+                  "total_molecule_seconds": 10, "total_molecules": 10}),
+        ("normal", {"total_ops": 1, "total_seconds": 30, "total_kb": 10, "total_molecule_ops": 1,
+                    "total_molecule_seconds": 30, "total_molecules": 3}),
+    ]
+
+
+def test_accumulator_keeps_failed_flushes(monkeypatch):
+    accumulator = RuntimeAccumulator(flush_interval=3600, flush_size=100)
+    accumulator.add(10, 5, tracking_name="fast")
+
+    def down(name, totals):
+        raise ConnectionError("Mongo is down")
+
+    monkeypatch.setattr(time_guess, "_increment", down)
+    accumulator.flush()
+    written = []
+    monkeypatch.setattr(time_guess, "_increment", lambda name, totals: written.append((name, dict(totals))))
+    accumulator.add(20, 5, tracking_name="fast")
+    accumulator.flush()
+    assert written == [("fast", {"total_ops": 2, "total_seconds": 30, "total_kb": 10, "total_molecule_ops": 0,
+                                 "total_molecule_seconds": 0, "total_molecules": 0})]
+
+
+def test_estimates_from_totals():
+    model = TimeGuess(tracking_name="fast", total_ops=2, total_seconds=30, total_kb=10, total_molecule_ops=1,
+                      total_molecule_seconds=10, total_molecules=10)
+    assert model.seconds_per_job == 15
+    assert model.estimate(filesize_kb=4) == 12
+    assert model.estimate(filesize_kb=4, molecules=5) == 5
+    assert TimeGuess(tracking_name="new").estimate(filesize_kb=4) is None
+
+
+def test_accumulator_flushes_on_the_interval_when_idle(increments):
+    accumulator = RuntimeAccumulator(flush_interval=0.05, flush_size=100)
+    accumulator.add(10, 5, tracking_name="fast")
+    deadline = time.monotonic() + 5
+    while not increments and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [name for name, _ in increments] == ["fast"]